@@ -0,0 +1 @@
+"""Benchmarks for the NSOH API Rollback Tracker."""
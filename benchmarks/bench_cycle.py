@@ -0,0 +1,397 @@
+"""Benchmarks for the ingest -> detect -> persist cycle.
+
+Replays the committed data/snapshots corpus through each stage of a
+detection cycle and reports per-stage latency percentiles, throughput and
+peak traced allocations:
+
+    decode     json.loads + Snapshot.from_dict of a stored NSOH snapshot
+    detect     detect_rollbacks over consecutive NSOH snapshots
+    save       save_snapshot + save_latest
+    append     append_rollback_log of a result with rollback events
+    fetch      fetch_sources against a local stub of both APIs
+    cycle      main.run_cycle end to end against the stub
+
+--locations scales the corpus synthetically by cloning records under new
+ids, to find where each stage stops keeping up. All writes go to a temporary
+directory. Baselines are stored per location count in benchmarks/baselines.json;
+--check fails if any stage's p50 regresses past BASELINE_TOLERANCE.
+
+Usage: python -m benchmarks.bench_cycle [--locations N] [--pairs N] [--iterations N]
+                                        [--save-baseline] [--check] [--json PATH]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import replace
+from pathlib import Path
+from typing import Callable, Optional
+
+from src import main as cycle_main
+from src.detector import detect_rollbacks
+from src.companies import current_company
+from src.fetchers.http import close_session, set_validators
+from src.ingest import fetch_sources
+from src.models import OverflowRecord, Snapshot
+from src.deltastore import DELTA_SUFFIX
+from src.replay import list_days, list_snapshot_paths
+from src.snapstore import MANIFEST_SUFFIX
+from src.storage import append_rollback_log, load_snapshot, save_latest, save_snapshot
+
+from .stub_server import StubServer
+
+
+BASELINES_FILE = Path(__file__).parent / "baselines.json"
+BASELINE_TOLERANCE = 1.5  # p50 may grow by this factor before --check fails
+BASELINE_NOISE_MS = 2.0  # ... and by at least this much, to ignore timer noise
+ROLLBACK_RATE = 0.01  # Fraction of records regressed in synthetic pairs
+
+
+def _snapshot_json(path: str) -> bytes:
+    """Read a stored snapshot as the JSON the "json" backend would have written."""
+    if path.endswith(".json") and not path.endswith((MANIFEST_SUFFIX, DELTA_SUFFIX)):
+        return Path(path).read_bytes()
+    return json.dumps(load_snapshot(path).to_dict(), indent=2).encode()
+
+
+def load_corpus(max_pairs: int) -> list[tuple[bytes, bytes]]:
+    """Read up to max_pairs + 1 raw NSOH and matching Thames snapshots.
+
+    Snapshots stored by other backends, or archived, are re-encoded as JSON.
+
+    Returns:
+        List of (nsoh JSON bytes, thames JSON bytes), oldest first. Empty
+        snapshots (failed fetches) are skipped.
+    """
+    corpus = []
+    for day in list_days():
+        thames = dict(list_snapshot_paths(day, "thames"))
+        for time_key, path in list_snapshot_paths(day, "nsoh"):
+            if time_key not in thames:
+                continue
+            raw = _snapshot_json(path)
+            if b'"location_id"' not in raw:
+                continue
+            corpus.append((raw, _snapshot_json(thames[time_key])))
+            if len(corpus) > max_pairs:
+                return corpus
+    return corpus
+
+
+def scale_records(records: list[OverflowRecord], locations: int) -> list[OverflowRecord]:
+    """Clone records under suffixed ids until there are `locations` of them."""
+    if not records or locations <= len(records):
+        return records[:locations] if records else []
+
+    scaled = list(records)
+    copy = 1
+    while len(scaled) < locations:
+        for record in records:
+            if len(scaled) >= locations:
+                break
+            scaled.append(replace(record, location_id=f"{record.location_id}-{copy}"))
+        copy += 1
+    return scaled
+
+
+def scale_snapshot(snapshot: Snapshot, locations: Optional[int]) -> Snapshot:
+    if locations is None:
+        return snapshot
+    return replace(snapshot, records=scale_records(snapshot.records, locations))
+
+
+def regress(snapshot: Snapshot, rate: float = ROLLBACK_RATE) -> Snapshot:
+    """Copy a snapshot with LastUpdated pushed back on a fraction of records."""
+    step = max(int(1 / rate), 1) if rate > 0 else 0
+    records = [
+        replace(r, last_updated=r.last_updated - 3_600_000)
+        if step and i % step == 0 and r.last_updated is not None else r
+        for i, r in enumerate(snapshot.records)
+    ]
+    return replace(snapshot, records=records)
+
+
+def advance(records: list[OverflowRecord], ms: int) -> list[OverflowRecord]:
+    """Move LastUpdated forward on every record, as NSOH does each poll."""
+    return [
+        replace(r, last_updated=r.last_updated + ms) if r.last_updated is not None else r
+        for r in records
+    ]
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure(
+    name: str,
+    run: Callable[[int], int],
+    iterations: int,
+    prepare: Optional[Callable[[int], None]] = None,
+) -> dict:
+    """Time a stage and trace its allocations.
+
+    Args:
+        name: Stage name.
+        run: Runs iteration i of the stage and returns the records processed.
+        iterations: Number of timed iterations; one more traced run follows.
+        prepare: Untimed setup run before iteration i.
+
+    Returns:
+        Stage statistics.
+    """
+    samples = []
+    items = 0
+    for i in range(iterations):
+        if prepare is not None:
+            prepare(i)
+        start = time.perf_counter()
+        items += run(i)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    # Allocation tracing slows code down, so it gets a separate run
+    if prepare is not None:
+        prepare(iterations)
+    tracemalloc.start()
+    run(iterations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_s = sum(samples) / 1000
+    return {
+        "stage": name,
+        "iterations": iterations,
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(percentile(samples, 0.95), 3),
+        "max_ms": round(max(samples), 3),
+        "records_per_s": round(items / total_s) if total_s else None,
+        "peak_alloc_kib": round(peak / 1024),
+    }
+
+
+@contextlib.contextmanager
+def _in_temp_dir():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="nsoh-bench-") as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def _stub_company(stub: StubServer):
+    """Get the default company with its endpoints pointed at the stub server."""
+    close_session()
+    set_validators({})
+    try:
+        yield replace(current_company(), truth_url=stub.thames_url, nsoh_url=stub.arcgis_url)
+    finally:
+        close_session()
+        set_validators({})
+
+
+def run_benchmarks(locations: Optional[int], pairs: int, iterations: int) -> list[dict]:
+    """Run every stage.
+
+    Args:
+        locations: Scale snapshots to this many locations, or use the
+            corpus as-is if None.
+        pairs: Consecutive corpus snapshot pairs to replay.
+        iterations: Timed iterations of the fetch and cycle stages.
+
+    Returns:
+        Statistics per stage.
+    """
+    corpus = load_corpus(pairs)
+    if len(corpus) < 2:
+        raise RuntimeError("Need at least two non-empty NSOH snapshots in data/snapshots")
+
+    # Scaled corpus, re-encoded so decode measures the scaled size
+    raw_nsoh = []
+    for nsoh_raw, _ in corpus:
+        snapshot = scale_snapshot(Snapshot.from_dict(json.loads(nsoh_raw)), locations)
+        raw_nsoh.append(json.dumps(snapshot.to_dict()).encode())
+    nsoh = [Snapshot.from_dict(json.loads(raw)) for raw in raw_nsoh]
+    thames = [
+        scale_snapshot(Snapshot.from_dict(json.loads(raw)), locations) for _, raw in corpus
+    ]
+    regressed = [regress(s) for s in nsoh[1:]]
+    n_pairs = len(regressed)
+    size = len(nsoh[0].records)
+
+    results = []
+
+    results.append(measure(
+        "decode",
+        lambda i: len(Snapshot.from_dict(json.loads(raw_nsoh[i % len(raw_nsoh)])).records),
+        len(raw_nsoh),
+    ))
+
+    detections = []
+
+    def detect(i: int) -> int:
+        result = detect_rollbacks(nsoh[i % n_pairs], regressed[i % n_pairs], thames[i % n_pairs + 1])
+        detections.append(result)
+        return len(regressed[i % n_pairs].records)
+
+    results.append(measure("detect", detect, n_pairs))
+
+    with _in_temp_dir():
+        def save(i: int) -> int:
+            snapshot = replace(nsoh[i % len(nsoh)], timestamp=f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}+00:00")
+            save_snapshot(snapshot)
+            save_latest(snapshot)
+            return len(snapshot.records)
+
+        results.append(measure("save", save, len(nsoh)))
+
+        with_events = [r for r in detections if r.rollbacks_detected] or detections
+        results.append(measure(
+            "append",
+            lambda i: (append_rollback_log(with_events[i % len(with_events)]),
+                       with_events[i % len(with_events)].rollbacks_detected)[1],
+            max(iterations, len(with_events)),
+        ))
+
+    base_nsoh = nsoh[-1].records
+    base_thames = thames[-1].records
+
+    with StubServer(base_nsoh, base_thames) as stub, _stub_company(stub) as company:
+        def next_poll(i: int):
+            stub.set_data(advance(base_nsoh, (i + 1) * 1000), base_thames)
+
+        def fetch(i: int) -> int:
+            thames_snapshot, nsoh_snapshot = fetch_sources(company=company)
+            return len(nsoh_snapshot.records) + len(thames_snapshot.records)
+
+        results.append(measure("fetch", fetch, iterations, prepare=next_poll))
+
+        with _in_temp_dir(), contextlib.redirect_stdout(io.StringIO()):
+            state = cycle_main.CycleState(company=company)
+            stub.set_data(base_nsoh, base_thames)
+            cycle_main.run_cycle(state)  # Baseline
+
+            def cycle(i: int) -> int:
+                cycle_main.run_cycle(state)
+                return size
+
+            results.append(measure("cycle", cycle, iterations, prepare=next_poll))
+
+    return results
+
+
+def print_results(results: list[dict], locations: int):
+    print(f"Locations: {locations}")
+    print(f"{'stage':<8} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'records/s':>12} {'peak KiB':>10}")
+    for r in results:
+        print(
+            f"{r['stage']:<8} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} {r['max_ms']:>10.2f} "
+            f"{r['records_per_s'] or 0:>12} {r['peak_alloc_kib']:>10}"
+        )
+
+
+def _machine() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def load_baselines() -> dict:
+    if not BASELINES_FILE.exists():
+        return {}
+    with open(BASELINES_FILE, "r") as f:
+        return json.load(f)
+
+
+def save_baseline(results: list[dict], locations: int):
+    baselines = load_baselines()
+    baselines[str(locations)] = {
+        "machine": _machine(),
+        "stages": {r["stage"]: {k: v for k, v in r.items() if k != "stage"} for r in results},
+    }
+    with open(BASELINES_FILE, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def check_baseline(results: list[dict], locations: int) -> list[str]:
+    """Compare results against the stored baseline.
+
+    Returns:
+        One message per regressed stage; empty if none regressed.
+    """
+    baseline = load_baselines().get(str(locations))
+    if baseline is None:
+        return [f"No baseline stored for {locations} locations (run with --save-baseline)"]
+
+    if baseline["machine"] != _machine():
+        print(f"WARNING: baseline was recorded on {baseline['machine']}; timings may not compare")
+
+    regressions = []
+    for r in results:
+        expected = baseline["stages"].get(r["stage"])
+        if expected is None:
+            continue
+        limit = max(expected["p50_ms"] * BASELINE_TOLERANCE, expected["p50_ms"] + BASELINE_NOISE_MS)
+        if r["p50_ms"] > limit:
+            regressions.append(
+                f"{r['stage']}: p50 {r['p50_ms']:.2f} ms > {limit:.2f} ms "
+                f"(baseline {expected['p50_ms']:.2f} ms)"
+            )
+    return regressions
+
+
+def main() -> int:
+    """Run the cycle benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locations", type=int, default=None, help="scale snapshots to N locations")
+    parser.add_argument("--pairs", type=int, default=20, help="corpus snapshot pairs to replay")
+    parser.add_argument("--iterations", type=int, default=10, help="fetch/cycle iterations")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as the baseline")
+    parser.add_argument("--check", action="store_true", help="fail if slower than the baseline")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    # Paths in the corpus and baselines are relative to the project root
+    os.chdir(Path(__file__).resolve().parent.parent)
+
+    results = run_benchmarks(args.locations, args.pairs, args.iterations)
+    locations = args.locations or len(Snapshot.from_dict(json.loads(load_corpus(0)[0][0])).records)
+    print_results(results, locations)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"locations": locations, "machine": _machine(), "stages": results}, f, indent=2)
+
+    if args.save_baseline:
+        save_baseline(results, locations)
+        print(f"Baseline saved to {BASELINES_FILE}")
+
+    if args.check:
+        regressions = check_baseline(results, locations)
+        if regressions:
+            print("\nREGRESSION:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print("\nNo regressions against the baseline.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Benchmark of truth-API timestamp conversion.
+
+Converts the timestamps of the stored Thames snapshots, rendered as the API
+serves them, with the original parser (datetime.fromisoformat and float
+milliseconds) and with fetchers/timestamps.py, cold (empty memo, as on the
+first poll) and warm (as on every later poll). Also counts timestamps the
+float route gets wrong by a millisecond, using microsecond forms.
+
+Usage: python -m benchmarks.bench_timestamps [--snapshots N] [--iterations N]
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from src.fetchers.thames import parse_item
+from src.fetchers.timestamps import clear_cache, iso_to_ms
+from src.replay import list_days, list_snapshot_paths
+from src.storage import load_snapshot
+
+from .bench_cycle import measure
+from .stub_server import _thames_item
+
+
+def legacy_iso_to_ms(iso_string: Optional[str]) -> Optional[int]:
+    """The original fetchers.thames.parse_iso_timestamp."""
+    if not iso_string:
+        return None
+    try:
+        dt = datetime.fromisoformat(iso_string.replace("Z", "+00:00"))
+        return int(dt.timestamp() * 1000)
+    except (ValueError, AttributeError):
+        return None
+
+
+def load_items(max_snapshots: int) -> list[list[dict]]:
+    """Render stored Thames snapshots as API items, oldest first."""
+    responses = []
+    for day in list_days():
+        for _, path in list_snapshot_paths(day, "thames"):
+            if len(responses) >= max_snapshots:
+                return responses
+            snapshot = load_snapshot(path)
+            responses.append([_thames_item(r) for r in snapshot.records])
+    return responses
+
+
+def _timestamps(items: list[dict]) -> list[Optional[str]]:
+    return [
+        item.get(key)
+        for item in items
+        for key in ("statusChanged", "statusChanged", "mostRecentDischargeAlertStart",
+                    "mostRecentDischargeAlertStop")
+    ]
+
+
+def count_float_errors(samples: int = 100_000) -> tuple[int, int]:
+    """Count timestamps with microseconds that a route truncates wrongly.
+
+    Returns:
+        (legacy errors, new errors) out of samples.
+    """
+    rng = random.Random(0)
+    legacy_errors = new_errors = 0
+    for _ in range(samples):
+        us = rng.randrange(1_500_000_000_000_000, 1_900_000_000_000_000)
+        seconds, micros = divmod(us, 1_000_000)
+        iso = datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        iso = f"{iso}.{micros:06d}Z"
+        ms = us // 1000
+        legacy_errors += legacy_iso_to_ms(iso) != ms
+        new_errors += iso_to_ms(iso) != ms
+    clear_cache()
+    return legacy_errors, new_errors
+
+
+def main() -> int:
+    """Run the timestamp benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--snapshots", type=int, default=20, help="stored Thames snapshots to convert")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    os.chdir(Path(__file__).resolve().parent.parent)
+    responses = load_items(args.snapshots)
+    if not responses:
+        print("No Thames snapshots in data/snapshots")
+        return 1
+    batches = [_timestamps(items) for items in responses]
+
+    def convert(func):
+        def run(i: int) -> int:
+            batch = batches[i % len(batches)]
+            for value in batch:
+                func(value)
+            return len(batch)
+        return run
+
+    def parse_items(i: int) -> int:
+        items = responses[i % len(responses)]
+        for item in items:
+            parse_item(item)
+        return len(items)
+
+    results = [
+        measure("legacy", convert(legacy_iso_to_ms), args.iterations),
+        measure("cold", convert(iso_to_ms), args.iterations, prepare=lambda i: clear_cache()),
+        measure("warm", convert(iso_to_ms), args.iterations),
+        measure("items", parse_items, args.iterations),
+    ]
+
+    print(f"Timestamps per response: {len(batches[0])}")
+    print(f"{'stage':<8} {'p50 ms':>10} {'p95 ms':>10} {'per second':>12}")
+    for r in results:
+        print(f"{r['stage']:<8} {r['p50_ms']:>10.3f} {r['p95_ms']:>10.3f} {r['records_per_s'] or 0:>12}")
+
+    legacy_errors, new_errors = count_float_errors()
+    print(f"\nOff-by-1ms conversions of 100000 microsecond timestamps: "
+          f"legacy {legacy_errors}, new {new_errors}")
+    return 0 if new_errors == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""Local stand-in for the Thames Water and NSOH ArcGIS endpoints.
+
+Serves the same response shapes as the real APIs from in-memory records:
+Thames items with ISO timestamps, and ArcGIS feature pages honouring
+returnCountOnly, resultOffset/resultRecordCount, outFields, returnGeometry
+and "Field > TIMESTAMP '...'" clauses joined by OR in where. Responses carry an ETag (answering If-None-Match with 304)
+and are gzip-compressed when the client accepts it. Bodies are cached per
+query, so the server is not the bottleneck being measured.
+"""
+
+import gzip
+import json
+import re
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qsl, urlparse
+
+from src.config import THAMES_STATUS_MAP
+from src.models import OverflowRecord
+
+
+THAMES_PATH = "/thames"
+ARCGIS_PATH = "/arcgis/query"
+
+_TIMESTAMP_CLAUSE = re.compile(r"(\w+) > TIMESTAMP '([^']+)'")
+
+_THAMES_STATUS_NAMES = {}
+for _name, _value in THAMES_STATUS_MAP.items():
+    _THAMES_STATUS_NAMES.setdefault(_value, _name)
+
+
+def _iso(ms: Optional[int]) -> Optional[str]:
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _feature(record: OverflowRecord) -> dict:
+    return {
+        "attributes": {
+            "OBJECTID": abs(hash(record.location_id)) % 10**9,
+            "Id": record.location_id,
+            "Company": "Thames Water",
+            "Status": record.status,
+            "StatusStart": record.status_start,
+            "LatestEventStart": record.latest_event_start,
+            "LatestEventEnd": record.latest_event_end,
+            "LastUpdated": record.last_updated,
+            "ReceivingWaterCourse": "River Thames",
+            "Latitude": 51.5,
+            "Longitude": -0.1,
+        },
+        "geometry": {"x": -11131.9, "y": 6711542.5},
+    }
+
+
+def _thames_item(record: OverflowRecord) -> dict:
+    return {
+        "uniqueId": record.location_id,
+        "alertStatus": _THAMES_STATUS_NAMES.get(record.status, "Offline"),
+        "statusChanged": _iso(record.status_start),
+        "mostRecentDischargeAlertStart": _iso(record.latest_event_start),
+        "mostRecentDischargeAlertStop": _iso(record.latest_event_end),
+    }
+
+
+def _matches(where: str) -> Optional[list[tuple[str, int]]]:
+    """Parse a where clause into (field, ms) lower bounds, or None for all rows."""
+    clauses = _TIMESTAMP_CLAUSE.findall(where)
+    if not clauses:
+        return None
+    return [
+        (name, int(datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+                   .replace(tzinfo=timezone.utc).timestamp() * 1000))
+        for name, value in clauses
+    ]
+
+
+class StubServer:
+    """Threaded HTTP server serving the current stub data."""
+
+    def __init__(self, nsoh: list[OverflowRecord], thames: list[OverflowRecord]):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._cache: dict[tuple, tuple[bytes, bytes]] = {}  # query -> (raw, gzipped)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.set_data(nsoh, thames)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server._handle(self)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def thames_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}{THAMES_PATH}"
+
+    @property
+    def arcgis_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}{ARCGIS_PATH}"
+
+    def set_data(self, nsoh: list[OverflowRecord], thames: list[OverflowRecord]):
+        """Replace the served records; cached bodies and ETags are invalidated."""
+        features = [_feature(r) for r in nsoh]
+        items = [_thames_item(r) for r in thames]
+        with self._lock:
+            self._features = features
+            self._items = items
+            self._version += 1
+            self._cache.clear()
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _body(self, path: str, query: dict) -> tuple[int, tuple[bytes, bytes]]:
+        key = (path, tuple(sorted(query.items())))
+        with self._lock:
+            version = self._version
+            cached = self._cache.get(key)
+            features = self._features
+            items = self._items
+        if cached is not None:
+            return version, cached
+
+        bounds = _matches(query.get("where", "1=1"))
+        if bounds is not None:
+            features = [
+                f for f in features
+                if any((f["attributes"].get(name) or 0) > ms for name, ms in bounds)
+            ]
+
+        if path == THAMES_PATH:
+            body = {"meta": {"totalRecordCount": len(items)}, "items": items}
+        elif query.get("returnCountOnly") == "true":
+            body = {"count": len(features)}
+        else:
+            offset = int(query.get("resultOffset", 0))
+            count = int(query.get("resultRecordCount", 1000))
+            page = features[offset: offset + count]
+
+            out_fields = query.get("outFields", "*")
+            with_geometry = query.get("returnGeometry", "true") != "false"
+            if out_fields != "*" or not with_geometry:
+                keep = None if out_fields == "*" else out_fields.split(",")
+                page = [
+                    {
+                        "attributes": (
+                            f["attributes"] if keep is None
+                            else {k: f["attributes"].get(k) for k in keep}
+                        ),
+                        **({"geometry": f["geometry"]} if with_geometry else {}),
+                    }
+                    for f in page
+                ]
+            body = {
+                "objectIdFieldName": "OBJECTID",
+                "geometryType": "esriGeometryPoint",
+                "spatialReference": {"wkid": 102100, "latestWkid": 3857},
+                "features": page,
+                "exceededTransferLimit": offset + count < len(features),
+            }
+
+        raw = json.dumps(body).encode()
+        bodies = (raw, gzip.compress(raw, compresslevel=1))
+        with self._lock:
+            if version == self._version:
+                self._cache[key] = bodies
+        return version, bodies
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        url = urlparse(handler.path)
+        if url.path not in (THAMES_PATH, ARCGIS_PATH):
+            handler.send_error(404)
+            return
+
+        query = dict(parse_qsl(url.query))
+        version, (raw, gzipped) = self._body(url.path, query)
+        etag = f'"{version}-{hash(raw) & 0xffffffff:x}"'
+
+        with self._lock:
+            self.requests += 1
+
+        if handler.headers.get("If-None-Match") == etag:
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        headers = {"Content-Type": "application/json", "ETag": etag}
+        if "gzip" in handler.headers.get("Accept-Encoding", ""):
+            raw = gzipped
+            headers["Content-Encoding"] = "gzip"
+
+        handler.send_response(200)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(raw)))
+        handler.end_headers()
+        handler.wfile.write(raw)
+
+        with self._lock:
+            self.bytes_sent += len(raw)
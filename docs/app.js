@@ -63,6 +63,23 @@ async function fetchJSON(path) {
     }
 }
 
+async function fetchJSONLines(path) {
+    try {
+        const response = await fetch(`${BASE_URL}/${path}`);
+        if (!response.ok) {
+            return null;
+        }
+        const text = await response.text();
+        return text
+            .split('\n')
+            .filter(line => line.trim())
+            .map(line => JSON.parse(line));
+    } catch (error) {
+        console.error(`Failed to fetch ${path}:`, error);
+        return null;
+    }
+}
+
 function formatTimestamp(isoString) {
     if (!isoString) return '-';
     const date = new Date(isoString);
@@ -187,28 +204,68 @@ function renderRollbackTable(event) {
 
     html += '</tbody></table></div>';
 
-    if (!showAll) {
-        html += `<p class="table-note">Showing ${maxInitialRows} of ${events.length} affected locations.</p>`;
+    // Rollups keep only the first rows of each entry; rollbacks_detected has the full count
+    const totalEvents = Math.max(event.rollbacks_detected ?? 0, events.length);
+    if (displayEvents.length < totalEvents) {
+        html += `<p class="table-note">Showing ${displayEvents.length} of ${totalEvents} affected locations.</p>`;
     }
 
     return html;
 }
 
-async function loadRollbackLog() {
-    const container = document.getElementById('rollback-list');
-    const data = await fetchJSON('rollbacks/rollback_log.json');
+// Pre-aggregated rollups: summary counts plus the most recent log entries.
+// The hash in rollups/index.json busts caches only when a file changed.
+async function fetchRollups() {
+    const index = await fetchJSON('rollups/index.json');
+    if (!index || !index['summary.json'] || !index['recent.json']) {
+        return null;
+    }
 
-    if (!data || data.length === 0) {
-        container.innerHTML = '<p class="no-data">No rollbacks detected yet.</p>';
-        return [];
+    const [summary, recent] = await Promise.all([
+        fetchJSON(`rollups/summary.json?v=${index['summary.json'].hash}`),
+        fetchJSON(`rollups/recent.json?v=${index['recent.json'].hash}`)
+    ]);
+    if (!summary || !recent) {
+        return null;
     }
 
+    return { summary, entries: recent.entries };
+}
+
+// Fallback for data without rollups: download and summarise the whole log
+async function fetchFullLog() {
+    // Append-only log, one entry per line; fall back to a JSON array export
+    const data = (await fetchJSONLines('rollbacks/rollback_log.jsonl'))
+        ?? (await fetchJSON('rollbacks/rollback_log.json'))
+        ?? [];
+
     // Sort by timestamp descending (most recent first)
-    const sorted = [...data].sort((a, b) =>
+    const entries = [...data].sort((a, b) =>
         new Date(b.timestamp) - new Date(a.timestamp)
     );
+    const datasetLevel = entries.filter(r => r.is_dataset_level).length;
+
+    return {
+        summary: {
+            total_rollbacks: entries.length,
+            dataset_level: datasetLevel,
+            row_level: entries.length - datasetLevel
+        },
+        entries
+    };
+}
 
-    container.innerHTML = sorted.map((event, index) => {
+async function loadRollbackLog() {
+    const container = document.getElementById('rollback-list');
+    const rollbacks = (await fetchRollups()) ?? (await fetchFullLog());
+    const entries = rollbacks.entries;
+
+    if (entries.length === 0) {
+        container.innerHTML = '<p class="no-data">No rollbacks detected yet.</p>';
+        return rollbacks;
+    }
+
+    container.innerHTML = entries.map((event, index) => {
         const badgeClass = event.is_dataset_level ? 'badge-dataset' : 'badge-row';
         const badgeText = event.is_dataset_level ? 'Dataset' : 'Row';
         const isExpanded = index === 0; // Expand most recent by default
@@ -242,7 +299,12 @@ async function loadRollbackLog() {
         });
     });
 
-    return sorted;
+    if (rollbacks.summary.total_rollbacks > entries.length) {
+        container.insertAdjacentHTML('beforeend',
+            `<p class="table-note">Showing the ${entries.length} most recent of ${rollbacks.summary.total_rollbacks} rollbacks.</p>`);
+    }
+
+    return rollbacks;
 }
 
 function updateSummary(rollbacks, latest) {
@@ -251,10 +313,11 @@ function updateSummary(rollbacks, latest) {
     const rowEl = document.getElementById('row-level');
     const lastCheckEl = document.getElementById('last-check');
 
-    if (rollbacks && rollbacks.length > 0) {
-        totalEl.textContent = rollbacks.length;
-        datasetEl.textContent = rollbacks.filter(r => r.is_dataset_level).length;
-        rowEl.textContent = rollbacks.filter(r => !r.is_dataset_level).length;
+    const summary = rollbacks ? rollbacks.summary : null;
+    if (summary && summary.total_rollbacks > 0) {
+        totalEl.textContent = summary.total_rollbacks;
+        datasetEl.textContent = summary.dataset_level;
+        rowEl.textContent = summary.row_level;
     } else {
         totalEl.textContent = '0';
         datasetEl.textContent = '0';
@@ -0,0 +1,180 @@
+"""Compressed day archives of snapshot history.
+
+A finished day folder is folded (by src.compact) into two files:
+
+    data/snapshots/<date>.archive.gz        one gzip member per snapshot
+    data/snapshots/<date>.archive.idx.json  name, offset, length and base
+                                            flag of each member
+
+Each member holds the snapshot encoded as a deltastore delta against the
+previous snapshot of its source, with a base every DELTA_KEYFRAME_INTERVAL
+snapshots. Members are independent gzip streams, so one snapshot is
+rebuilt by decompressing only its members back to the nearest base.
+Members are compressed with a fixed mtime, so re-compacting the same day
+gives the same bytes.
+
+Archived snapshots are addressed as "<archive path>#<source>_<HH-MM-SS>",
+which storage.load_snapshot accepts like any other snapshot path.
+"""
+
+import gzip
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from .config import DELTA_KEYFRAME_INTERVAL
+from .deltastore import apply_delta, encode_delta
+from .models import Snapshot
+
+
+ARCHIVE_SUFFIX = ".archive.gz"
+ARCHIVE_INDEX_SUFFIX = ".archive.idx.json"
+
+
+def archive_path(snapshots_dir: str, day: str) -> Path:
+    """Get the archive file for a day."""
+    return Path(snapshots_dir) / f"{day}{ARCHIVE_SUFFIX}"
+
+
+def _index_path(path: Path) -> Path:
+    return path.with_name(path.name[: -len(ARCHIVE_SUFFIX)] + ARCHIVE_INDEX_SUFFIX)
+
+
+def is_archived(path: str) -> bool:
+    """Check whether a snapshot path points into a day archive."""
+    return f"{ARCHIVE_SUFFIX}#" in str(path)
+
+
+def list_archived_days(snapshots_dir: str) -> list[str]:
+    """List the days that have an archive, oldest first."""
+    root = Path(snapshots_dir)
+    if not root.exists():
+        return []
+    return sorted(p.name[: -len(ARCHIVE_SUFFIX)] for p in root.glob(f"*{ARCHIVE_SUFFIX}"))
+
+
+def _load_index(path: Path) -> list[dict]:
+    with open(_index_path(path), "r") as f:
+        return json.load(f)["members"]
+
+
+def archived_sources(path: Path) -> list[str]:
+    """List the sources with snapshots in an archive."""
+    return sorted({member["name"].split("_", 1)[0] for member in _load_index(path)})
+
+
+def copy_archive(path: Path, snapshots_dir: str) -> Path:
+    """Copy a day archive and its index into another snapshots directory.
+
+    Returns:
+        Path of the copy.
+    """
+    copy = archive_path(snapshots_dir, path.name[: -len(ARCHIVE_SUFFIX)])
+    shutil.copyfile(path, copy)
+    shutil.copyfile(_index_path(path), _index_path(copy))
+    return copy
+
+
+def list_archived(path: Path, source: str) -> list[tuple[str, str]]:
+    """List the snapshots of one source in an archive, in capture order.
+
+    Returns:
+        List of (HH-MM-SS, snapshot path).
+    """
+    found = []
+    for member in _load_index(path):
+        member_source, time = member["name"].split("_", 1)
+        if member_source == source:
+            found.append((time, f"{path}#{member['name']}"))
+    return sorted(found)
+
+
+def write_archive(path: Path, snapshots: Iterable[tuple[str, Snapshot]]) -> int:
+    """Write snapshots to a day archive, replacing any existing one.
+
+    Args:
+        path: Archive path (see archive_path).
+        snapshots: (name, snapshot) of one day, each source in capture
+            order; names are "<source>_<HH-MM-SS>" as in the day folder.
+
+    Returns:
+        Number of snapshots archived.
+    """
+    members = []
+    chains: dict[str, tuple[Optional[tuple], int]] = {}  # source -> (state, since base)
+    tmp = path.with_name(path.name + ".tmp")
+
+    with open(tmp, "wb") as f:
+        for name, snapshot in snapshots:
+            state, since_base = chains.get(snapshot.source, (None, 0))
+            base = state is None or since_base + 1 >= DELTA_KEYFRAME_INTERVAL
+            delta, records, order = encode_delta(snapshot, state, base)
+            chains[snapshot.source] = ((records, order), 0 if delta["base"] else since_base + 1)
+
+            line = json.dumps(delta, separators=(",", ":")).encode()
+            member = gzip.compress(line, mtime=0)
+            members.append({
+                "name": name,
+                "offset": f.tell(),
+                "length": len(member),
+                "base": delta["base"],
+            })
+            f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+
+    index_tmp = _index_path(path).with_suffix(".tmp")
+    with open(index_tmp, "w") as f:
+        json.dump({"day": path.name[: -len(ARCHIVE_SUFFIX)], "members": members}, f, indent=1)
+
+    os.replace(tmp, path)
+    os.replace(index_tmp, _index_path(path))
+    return len(members)
+
+
+def _read_members(path: Path, members: list[dict]) -> Iterator[dict]:
+    with open(path, "rb") as f:
+        for member in members:
+            f.seek(member["offset"])
+            yield json.loads(gzip.decompress(f.read(member["length"])))
+
+
+def iter_archived(path: Path, source: str) -> Iterator[Snapshot]:
+    """Stream every snapshot of one source in an archive, in capture order."""
+    members = [m for m in _load_index(path) if m["name"].split("_", 1)[0] == source]
+    state = None
+    for delta in _read_members(path, members):
+        snapshot, records, order = apply_delta(delta, state)
+        state = (records, order)
+        yield snapshot
+
+
+def load_archived_snapshot(snapshot_path: str) -> Snapshot:
+    """Rebuild one archived snapshot.
+
+    Args:
+        snapshot_path: "<archive path>#<source>_<HH-MM-SS>".
+
+    Returns:
+        The snapshot exactly as it was archived.
+
+    Raises:
+        KeyError: If the archive has no such snapshot.
+    """
+    path, name = snapshot_path.rsplit("#", 1)
+    path = Path(path)
+    source = name.split("_", 1)[0]
+    members = [m for m in _load_index(path) if m["name"].split("_", 1)[0] == source]
+
+    target = next((i for i, m in enumerate(members) if m["name"] == name), None)
+    if target is None:
+        raise KeyError(f"{name} is not in {path}")
+    start = next(i for i in range(target, -1, -1) if members[i]["base"])
+
+    state = None
+    for delta in _read_members(path, members[start: target + 1]):
+        snapshot, records, order = apply_delta(delta, state)
+        state = (records, order)
+    return snapshot
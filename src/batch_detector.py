@@ -0,0 +1,279 @@
+"""Vectorized rollback detection over aligned snapshot arrays.
+
+Each snapshot is aligned once against a stable LocationIndex, turning its
+records into NumPy arrays keyed by location position. Comparing two aligned
+snapshots is then a handful of array operations, and RollbackEvent objects
+are only built for the flagged rows, via the same detect_record_rollback used
+by the per-record path, so results are identical to detect_rollbacks.
+Columnar snapshot views are aligned straight from their memory-mapped
+columns, without building a record per row.
+
+NumPy is in requirements.txt but stays optional: without it, detection
+falls back to detect_rollbacks.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+from .columnar import ColumnarSnapshot
+from .detector import build_comparison_result, detect_record_rollback, detect_rollbacks
+from .models import Snapshot, OverflowRecord, ComparisonResult
+
+SnapshotLike = Union[Snapshot, ColumnarSnapshot]
+
+
+class LocationIndex:
+    """Stable mapping of location_id to array position.
+
+    Positions are assigned on first sight and never change, so every snapshot
+    aligned against the same index can be compared position by position.
+    """
+
+    def __init__(self):
+        self._positions: dict[str, int] = {}
+        # Columnar id table bytes -> positions of its entries
+        self._table_positions: dict[bytes, "np.ndarray"] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def positions(self, location_ids: Iterable[str]) -> list[int]:
+        """Get the position of each location id, assigning new ones."""
+        positions = self._positions
+        return [positions.setdefault(lid, len(positions)) for lid in location_ids]
+
+    def table_positions(self, view: ColumnarSnapshot) -> "np.ndarray":
+        """Get the positions of a columnar view's id table entries.
+
+        Consecutive snapshots usually share an identical id table, so the
+        result is cached by the table's raw bytes.
+        """
+        key = view.id_table_key()
+        cached = self._table_positions.get(key)
+        if cached is None:
+            cached = np.asarray(self.positions(view.id_table()), dtype=np.int64)
+            self._table_positions[key] = cached
+        return cached
+
+
+@dataclass
+class AlignedSnapshot:
+    """A snapshot with its per-row values as arrays aligned to a LocationIndex."""
+
+    records: Sequence[OverflowRecord]  # Record list or columnar view
+    index: LocationIndex
+    rows: "np.ndarray"  # Location position of each row
+    last_updated: "np.ndarray"  # Per row, 0 where null
+    last_updated_valid: "np.ndarray"  # Per row, False where null
+    _by_location: "np.ndarray"  # Row of each location position, -1 if absent
+
+    def by_location(self) -> "np.ndarray":
+        """Get the row of every location position, -1 if absent.
+
+        Padded to the current size of the index, which may have grown since
+        this snapshot was aligned.
+        """
+        missing = len(self.index) - len(self._by_location)
+        if missing > 0:
+            self._by_location = np.concatenate(
+                [self._by_location, np.full(missing, -1, dtype=np.int64)]
+            )
+        return self._by_location
+
+
+def _align_columnar(view: ColumnarSnapshot, index: LocationIndex):
+    """Get rows, last_updated and validity arrays from a columnar view."""
+    rows = index.table_positions(view)[np.frombuffer(view.location_rows(), dtype=np.int32)]
+    last_updated = np.frombuffer(view.column("last_updated"), dtype=np.int64)
+    nulls = np.unpackbits(
+        np.frombuffer(view.null_bitmap("last_updated"), dtype=np.uint8),
+        count=len(view),
+        bitorder="little",
+    )
+    return rows, last_updated, nulls == 0
+
+
+def _align_records(records: list[OverflowRecord], index: LocationIndex):
+    """Get rows, last_updated and validity arrays from a record list."""
+    rows = np.fromiter(
+        index.positions(r.location_id for r in records), dtype=np.int64, count=len(records)
+    )
+    values = [r.last_updated for r in records]
+    valid = np.fromiter((v is not None for v in values), dtype=bool, count=len(values))
+    last_updated = np.fromiter(
+        (v if v is not None else 0 for v in values), dtype=np.int64, count=len(values)
+    )
+    return rows, last_updated, valid
+
+
+def align_snapshot(snapshot: SnapshotLike, index: LocationIndex) -> AlignedSnapshot:
+    """Align a snapshot against a location index.
+
+    Args:
+        snapshot: Snapshot, or a columnar view (kept open while aligned).
+        index: Shared location index; new locations are added to it.
+
+    Returns:
+        AlignedSnapshot ready for batched comparison.
+    """
+    if isinstance(snapshot, ColumnarSnapshot):
+        records = snapshot
+        rows, last_updated, valid = _align_columnar(snapshot, index)
+    else:
+        records = snapshot.records
+        rows, last_updated, valid = _align_records(records, index)
+
+    # Duplicate ids resolve to their last row, as in the per-record dict lookup
+    by_location = np.full(len(index), -1, dtype=np.int64)
+    np.maximum.at(by_location, rows, np.arange(len(records), dtype=np.int64))
+
+    return AlignedSnapshot(
+        records=records,
+        index=index,
+        rows=rows,
+        last_updated=last_updated,
+        last_updated_valid=valid,
+        _by_location=by_location,
+    )
+
+
+def rollback_mask(previous: AlignedSnapshot, current: AlignedSnapshot) -> "np.ndarray":
+    """Flag the current rows whose LastUpdated went backwards.
+
+    Args:
+        previous: Previous aligned NSOH snapshot.
+        current: Current aligned NSOH snapshot (same index).
+
+    Returns:
+        Boolean array, one entry per current row.
+    """
+    if len(previous.rows) == 0:
+        return np.zeros(len(current.rows), dtype=bool)
+
+    previous_rows = previous.by_location()[current.rows]
+    has_previous = previous_rows >= 0
+    previous_rows = np.where(has_previous, previous_rows, 0)
+
+    return (
+        has_previous
+        & current.last_updated_valid
+        & previous.last_updated_valid[previous_rows]
+        & (current.last_updated < previous.last_updated[previous_rows])
+    )
+
+
+def detect_rollbacks_aligned(
+    previous: AlignedSnapshot,
+    current: AlignedSnapshot,
+    thames: Optional[AlignedSnapshot] = None,
+    detection_time: Optional[str] = None,
+) -> ComparisonResult:
+    """Detect rollbacks between two aligned NSOH snapshots.
+
+    Args:
+        previous: Previous aligned NSOH snapshot.
+        current: Current aligned NSOH snapshot.
+        thames: Current aligned Thames Water snapshot for context.
+        detection_time: ISO timestamp to record as the detection time.
+            Defaults to now.
+
+    Returns:
+        ComparisonResult identical to detect_rollbacks on the same snapshots.
+    """
+    if detection_time is None:
+        detection_time = datetime.now(timezone.utc).isoformat()
+
+    flagged = np.flatnonzero(rollback_mask(previous, current))
+
+    previous_by_location = previous.by_location()
+    thames_by_location = thames.by_location() if thames is not None else None
+
+    rollback_events = []
+    for row in flagged.tolist():
+        position = current.rows[row]
+        thames_record = None
+        if thames_by_location is not None and position < len(thames_by_location):
+            thames_row = thames_by_location[position]
+            if thames_row >= 0:
+                thames_record = thames.records[thames_row]
+
+        rollback_events.append(detect_record_rollback(
+            previous=previous.records[previous_by_location[position]],
+            current=current.records[row],
+            thames_record=thames_record,
+            detection_time=detection_time,
+        ))
+
+    return build_comparison_result(detection_time, len(current.records), rollback_events)
+
+
+def detect_rollbacks_batched(
+    previous_nsoh: Snapshot,
+    current_nsoh: Snapshot,
+    current_thames: Optional[Snapshot] = None,
+    detection_time: Optional[str] = None,
+) -> ComparisonResult:
+    """Drop-in batched equivalent of detect_rollbacks.
+
+    Falls back to detect_rollbacks when NumPy is not installed.
+    """
+    if np is None:
+        return detect_rollbacks(previous_nsoh, current_nsoh, current_thames, detection_time)
+
+    index = LocationIndex()
+    previous = align_snapshot(previous_nsoh, index)
+    current = align_snapshot(current_nsoh, index)
+    thames = align_snapshot(current_thames, index) if current_thames else None
+
+    return detect_rollbacks_aligned(previous, current, thames, detection_time)
+
+
+SnapshotPair = tuple[SnapshotLike, Optional[SnapshotLike]]
+
+
+def detect_history(
+    pairs: Iterable[Union[SnapshotLike, SnapshotPair]],
+    index: Optional[LocationIndex] = None,
+) -> Iterator[ComparisonResult]:
+    """Detect rollbacks over every consecutive pair of NSOH snapshots.
+
+    Each snapshot is aligned exactly once and reused as the baseline for the
+    next one. The detection time of each result is the current snapshot's
+    capture timestamp.
+
+    Args:
+        pairs: NSOH snapshots (or columnar views) in capture order, or
+            (nsoh, thames) tuples to attach Thames context.
+        index: Location index to share, e.g. across calls for the same layer.
+
+    Yields:
+        One ComparisonResult per consecutive pair.
+    """
+    if index is None:
+        index = LocationIndex()
+
+    previous = None
+    for item in pairs:
+        nsoh, thames = item if isinstance(item, tuple) else (item, None)
+
+        if np is None:
+            if isinstance(nsoh, ColumnarSnapshot):
+                nsoh = nsoh.to_snapshot()
+            if isinstance(thames, ColumnarSnapshot):
+                thames = thames.to_snapshot()
+            if previous is not None:
+                yield detect_rollbacks(previous, nsoh, thames, nsoh.timestamp)
+            previous = nsoh
+            continue
+
+        current = align_snapshot(nsoh, index)
+        if previous is not None:
+            aligned_thames = align_snapshot(thames, index) if thames else None
+            yield detect_rollbacks_aligned(previous, current, aligned_thames, nsoh.timestamp)
+        previous = current
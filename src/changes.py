@@ -0,0 +1,367 @@
+"""Change feed: what moved between consecutive snapshots of each source.
+
+Every new NSOH or truth API snapshot is diffed against the previous one of
+its source in a single merge pass over records sorted by location id. The
+resulting ChangeSet lists, per kind, the locations that changed:
+
+    added, removed         [location_id, ...] that appeared or disappeared
+    status                 [location_id, before, after] status flips
+    event_start            [location_id, before, after] LatestEventStart moves
+    event_end              [location_id, before, after] LatestEventEnd moves
+    last_updated_forward   {step ms: [location_id, ...]} LastUpdated moves forward
+    last_updated_backward  [location_id, before, after] LastUpdated moves back,
+                           or is cleared
+    last_updated_set       [location_id, after] LastUpdated set where it was not
+
+NSOH moves LastUpdated forward at almost every location on each refresh,
+mostly by the same step. Grouping forward moves by step keeps them
+lossless given the previous values, at a fraction of the size of listing
+each one. Change sets are appended, one JSON line per source per cycle, to
+data/changes/YYYY-MM-DD.jsonl, dated by the later snapshot. Empty kinds
+are left out. A new snapshot gets a line even where nothing moved; a poll
+answered 304 Not Modified saves no snapshot and gets none. Each line names
+the snapshot it was diffed against, so gaps are explicit.
+
+Finished days are gzipped to YYYY-MM-DD.jsonl.gz by src.compact, alongside
+the snapshot archives. A line appended to a compacted day, e.g. by a cycle
+committed late, goes to a new JSONL file and is read after the gzipped ones.
+
+Usage: python -m src.changes [--day YYYY-MM-DD] [--source thames|nsoh] [--location ID]
+                             [--rebuild] [--company KEY]
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from . import commit, metrics
+from .archive import archive_path, iter_archived
+from .companies import data_path, get_company, use_company
+from .config import CHANGES_DIR, COMPANIES, DEFAULT_COMPANY, SNAPSHOTS_DIR
+from .models import OverflowRecord, Snapshot
+from .replay import list_days, list_snapshot_paths
+from .storage import load_snapshot
+
+
+# Kinds listing [location_id, before, after]
+MOVE_KINDS = ("status", "event_start", "event_end", "last_updated_backward")
+
+# Every kind, in feed order
+CHANGE_KINDS = (
+    "added", "removed", "status", "event_start", "event_end",
+    "last_updated_forward", "last_updated_backward", "last_updated_set",
+)
+
+SOURCES = ("thames", "nsoh")
+
+
+@dataclass(slots=True)
+class ChangeSet:
+    """Changes between two consecutive snapshots of one source."""
+
+    source: str
+    timestamp: str  # The later snapshot
+    previous_timestamp: str  # The snapshot it was diffed against
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    status: list[list] = field(default_factory=list)
+    event_start: list[list] = field(default_factory=list)
+    event_end: list[list] = field(default_factory=list)
+    last_updated_forward: dict[int, list[str]] = field(default_factory=dict)  # Step ms -> ids
+    last_updated_backward: list[list] = field(default_factory=list)
+    last_updated_set: list[list] = field(default_factory=list)
+
+    def counts(self) -> dict[str, int]:
+        """Get the number of locations of each kind."""
+        counts = {kind: len(getattr(self, kind)) for kind in CHANGE_KINDS}
+        counts["last_updated_forward"] = sum(map(len, self.last_updated_forward.values()))
+        return counts
+
+    def for_location(self, location_id: str) -> list[tuple[str, list]]:
+        """Get one location's changes as (kind, values after the location id)."""
+        found = [(kind, []) for kind in ("added", "removed") if location_id in getattr(self, kind)]
+        for kind in (*MOVE_KINDS, "last_updated_set"):
+            found.extend((kind, entry[1:]) for entry in getattr(self, kind) if entry[0] == location_id)
+        found.extend(
+            ("last_updated_forward", [step])
+            for step, location_ids in self.last_updated_forward.items()
+            if location_id in location_ids
+        )
+        return found
+
+    def to_dict(self) -> dict:
+        data = {
+            "source": self.source,
+            "timestamp": self.timestamp,
+            "previous_timestamp": self.previous_timestamp,
+        }
+        for kind in CHANGE_KINDS:
+            if getattr(self, kind):
+                data[kind] = getattr(self, kind)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChangeSet":
+        lists = {kind: list(data.get(kind, [])) for kind in CHANGE_KINDS if kind != "last_updated_forward"}
+        return cls(
+            source=data["source"],
+            timestamp=data["timestamp"],
+            previous_timestamp=data["previous_timestamp"],
+            last_updated_forward={
+                int(step): location_ids for step, location_ids in data.get("last_updated_forward", {}).items()
+            },
+            **lists,
+        )
+
+
+def _location_key(record: OverflowRecord) -> str:
+    return record.location_id
+
+
+def _compare(changes: ChangeSet, before: OverflowRecord, after: OverflowRecord):
+    location_id = after.location_id
+    if before.status != after.status:
+        changes.status.append([location_id, before.status, after.status])
+    if before.latest_event_start != after.latest_event_start:
+        changes.event_start.append([location_id, before.latest_event_start, after.latest_event_start])
+    if before.latest_event_end != after.latest_event_end:
+        changes.event_end.append([location_id, before.latest_event_end, after.latest_event_end])
+
+    old, new = before.last_updated, after.last_updated
+    if old == new:
+        return
+    if old is None:
+        changes.last_updated_set.append([location_id, new])
+    elif new is not None and new > old:
+        changes.last_updated_forward.setdefault(new - old, []).append(location_id)
+    else:
+        changes.last_updated_backward.append([location_id, old, new])
+
+
+def diff_snapshots(previous: Snapshot, current: Snapshot) -> ChangeSet:
+    """Diff two consecutive snapshots of a source.
+
+    Both record lists are sorted by location id and walked together once.
+    A location id repeated within a snapshot is paired in order.
+
+    Args:
+        previous: Earlier snapshot.
+        current: Later snapshot of the same source.
+
+    Returns:
+        The changes, each kind in location id order.
+    """
+    start = time.perf_counter()
+    changes = ChangeSet(
+        source=current.source,
+        timestamp=current.timestamp,
+        previous_timestamp=previous.timestamp,
+    )
+
+    before = sorted(previous.records, key=_location_key)
+    after = sorted(current.records, key=_location_key)
+    i = j = 0
+    while i < len(before) and j < len(after):
+        old, new = before[i], after[j]
+        if old.location_id < new.location_id:
+            changes.removed.append(old.location_id)
+            i += 1
+        elif old.location_id > new.location_id:
+            changes.added.append(new.location_id)
+            j += 1
+        else:
+            _compare(changes, old, new)
+            i += 1
+            j += 1
+    changes.removed.extend(record.location_id for record in before[i:])
+    changes.added.extend(record.location_id for record in after[j:])
+
+    metrics.observe("diff_seconds", time.perf_counter() - start, source=current.source)
+    return changes
+
+
+def _day(timestamp: str) -> str:
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).strftime("%Y-%m-%d")
+
+
+def _encode(changes: ChangeSet) -> bytes:
+    return (json.dumps(changes.to_dict(), separators=(",", ":")) + "\n").encode()
+
+
+def append_changes(changes: ChangeSet):
+    """Append a change set to the feed.
+
+    Args:
+        changes: Output of diff_snapshots.
+    """
+    start = time.perf_counter()
+    line = _encode(changes)
+    commit.append_file(data_path(CHANGES_DIR) / f"{_day(changes.timestamp)}.jsonl", line)
+    metrics.record_write("changes", time.perf_counter() - start, len(line))
+
+
+def _feed_paths(day: str) -> tuple[Path, Path]:
+    """Get a day's (gzipped, JSONL) feed paths, in reading order."""
+    path = data_path(CHANGES_DIR) / f"{day}.jsonl"
+    return path.with_name(path.name + ".gz"), path
+
+
+def _read_lines(path: Path) -> list[bytes]:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rb") as f:
+        return f.readlines()
+
+
+def list_change_days() -> list[str]:
+    """List the days that have a change feed, oldest first."""
+    folder = data_path(CHANGES_DIR)
+    if not folder.exists():
+        return []
+    paths = [*folder.glob("*.jsonl"), *folder.glob("*.jsonl.gz")]
+    return sorted({p.name.split(".", 1)[0] for p in paths})
+
+
+def iter_changes(day: Optional[str] = None, source: Optional[str] = None) -> Iterator[ChangeSet]:
+    """Stream change sets in feed order.
+
+    Args:
+        day: Only this day (YYYY-MM-DD); defaults to every day.
+        source: Only this source.
+
+    Yields:
+        ChangeSets, oldest first.
+    """
+    for name in [day] if day else list_change_days():
+        for path in _feed_paths(name):
+            if not path.exists():
+                continue
+            for line in _read_lines(path):
+                changes = ChangeSet.from_dict(json.loads(line))
+                if source is None or changes.source == source:
+                    yield changes
+
+
+def _iter_history(source: str, snapshots_dir: str) -> Iterator[Snapshot]:
+    """Stream every saved snapshot of a source, in capture order."""
+    for day in list_days(snapshots_dir):
+        if (Path(snapshots_dir) / day).is_dir():
+            for _, path in list_snapshot_paths(day, source, snapshots_dir):
+                yield load_snapshot(path)
+        else:
+            yield from iter_archived(archive_path(snapshots_dir, day), source)
+
+
+def rebuild_changes() -> int:
+    """Rebuild the change feed from the snapshot history.
+
+    Every day with at least one change set is rewritten, gzipped if it
+    was compacted; other feed days are left as they are.
+
+    Returns:
+        Number of change sets written.
+    """
+    snapshots_dir = str(data_path(SNAPSHOTS_DIR))
+    days: dict[str, list[ChangeSet]] = {}
+    for source in SOURCES:
+        previous = None
+        for snapshot in _iter_history(source, snapshots_dir):
+            if previous is not None:
+                changes = diff_snapshots(previous, snapshot)
+                days.setdefault(_day(changes.timestamp), []).append(changes)
+            previous = snapshot
+
+    with commit.transaction():
+        for day, feed in days.items():
+            # Sources interleaved by time, truth API first, as a live cycle writes them
+            feed.sort(key=lambda c: (c.timestamp, SOURCES.index(c.source)))
+            data = b"".join(map(_encode, feed))
+            compacted, path = _feed_paths(day)
+            if compacted.exists():
+                commit.write_file(compacted, gzip.compress(data, mtime=0))
+                if path.exists():
+                    commit.write_file(path, b"")
+            else:
+                commit.write_file(path, data)
+    return sum(map(len, days.values()))
+
+
+def compact_changes(before: Optional[str] = None) -> list[tuple[str, int, int]]:
+    """Gzip every finished day of the change feed.
+
+    A day's JSONL is appended to its gzipped feed, then removed. Lines
+    already in the gzipped feed are skipped, so compaction interrupted
+    before the removal can be run again.
+
+    Args:
+        before: Only days before this date (YYYY-MM-DD); defaults to today, UTC.
+
+    Returns:
+        (day, JSONL bytes, gzipped bytes) per compacted day.
+    """
+    folder = data_path(CHANGES_DIR)
+    if before is None:
+        before = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not folder.exists():
+        return []
+
+    compacted = []
+    for path in sorted(folder.glob("*.jsonl")):
+        day = path.stem
+        if day >= before:
+            continue
+        gzipped, _ = _feed_paths(day)
+        lines = _read_lines(gzipped) if gzipped.exists() else []
+        seen = set(lines)
+        lines.extend(line for line in _read_lines(path) if line not in seen)
+        data = gzip.compress(b"".join(lines), mtime=0)
+        commit.write_file(gzipped, data)
+        size = path.stat().st_size
+        path.unlink()
+        compacted.append((day, size, len(data)))
+    return compacted
+
+
+def _summary(changes: ChangeSet) -> str:
+    counts = changes.counts()
+    parts = [f"+{counts.pop('added')} -{counts.pop('removed')}"]
+    parts.extend(f"{kind} {n}" for kind, n in counts.items() if n)
+    return "  ".join(parts)
+
+
+def main() -> int:
+    """Print the change feed."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--day", help="only this day (YYYY-MM-DD)")
+    parser.add_argument("--source", choices=SOURCES, help="only this source")
+    parser.add_argument("--location", help="only this location id")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the feed from the snapshot history")
+    parser.add_argument("--company", default=DEFAULT_COMPANY, choices=list(COMPANIES))
+    args = parser.parse_args()
+
+    with use_company(get_company(args.company)):
+        if args.rebuild:
+            print(f"Wrote {rebuild_changes()} change sets")
+            return 0
+
+        shown = 0
+        for changes in iter_changes(args.day, args.source):
+            if args.location is None:
+                print(f"{changes.timestamp}  {changes.source:<6}  {_summary(changes)}")
+                shown += 1
+                continue
+            for kind, values in changes.for_location(args.location):
+                detail = "".join(f"  {value}" for value in values)
+                print(f"{changes.timestamp}  {changes.source:<6}  {kind}{detail}")
+                shown += 1
+    print(f"{shown} line(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
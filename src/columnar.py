@@ -0,0 +1,362 @@
+"""Compact columnar snapshot format with memory-mapped, zero-copy reads.
+
+A snapshot is laid out as fixed-width little-endian columns so it can be
+memory-mapped and read without JSON parsing or building a record per row:
+
+    magic        8 bytes  b"NSOHCOL1"
+    header_len   uint32, then a JSON header (timestamp, source, counts, ...)
+    id_offsets   int64[n_ids + 1]   offsets into id_bytes
+    id_bytes     utf-8 location ids (the interned id table)
+    location     int32[n]           index into the id table per row
+    <column>     int64[n]           one array per INT_COLUMNS entry
+    nulls        uint8[ceil(n / 8)] null bitmap per INT_COLUMNS entry
+
+Every section starts on an 8-byte boundary. Null values are stored as 0 with
+their bit set in the column's null bitmap.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from pathlib import Path
+from typing import Iterator, Optional
+
+from . import commit
+from .models import OverflowRecord, Snapshot
+
+
+MAGIC = b"NSOHCOL1"
+COLUMNAR_SUFFIX = ".col"
+
+INT_COLUMNS = (
+    "status",
+    "status_start",
+    "latest_event_start",
+    "latest_event_end",
+    "last_updated",
+)
+
+_NATIVE_LITTLE = sys.byteorder == "little"
+
+
+def _pad(length: int) -> int:
+    """Get the number of padding bytes to reach an 8-byte boundary."""
+    return -length % 8
+
+
+def _layout(data_start: int, count: int, n_ids: int, id_bytes_len: int) -> dict:
+    """Compute the byte offset of every section after the header."""
+    offsets = {}
+    pos = data_start
+
+    offsets["id_offsets"] = pos
+    pos += 8 * (n_ids + 1)
+    offsets["id_bytes"] = pos
+    pos += id_bytes_len + _pad(id_bytes_len)
+    offsets["location"] = pos
+    pos += 4 * count + _pad(4 * count)
+
+    for name in INT_COLUMNS:
+        offsets[name] = pos
+        pos += 8 * count
+
+    bitmap_len = (count + 7) // 8
+    for name in INT_COLUMNS:
+        offsets[f"nulls:{name}"] = pos
+        pos += bitmap_len + _pad(bitmap_len)
+
+    offsets["end"] = pos
+    return offsets
+
+
+def write_columnar(snapshot: Snapshot, path: str) -> str:
+    """Write a snapshot in the columnar format.
+
+    Args:
+        snapshot: The snapshot to write.
+        path: Destination file path.
+
+    Returns:
+        The path written.
+
+    Raises:
+        ValueError: If a record's source differs from the snapshot's.
+    """
+    count = len(snapshot.records)
+
+    # Intern location ids
+    id_index: dict[str, int] = {}
+    location = []
+    for record in snapshot.records:
+        if record.source != snapshot.source:
+            raise ValueError(
+                f"Record {record.location_id} has source {record.source!r}, "
+                f"expected {snapshot.source!r}"
+            )
+        location.append(id_index.setdefault(record.location_id, len(id_index)))
+
+    encoded_ids = [location_id.encode() for location_id in id_index]
+    id_offsets = [0]
+    for encoded in encoded_ids:
+        id_offsets.append(id_offsets[-1] + len(encoded))
+    id_bytes = b"".join(encoded_ids)
+
+    header = json.dumps({
+        "timestamp": snapshot.timestamp,
+        "source": snapshot.source,
+        "fetch_started": snapshot.fetch_started,
+        "fetch_finished": snapshot.fetch_finished,
+        "fetch_duration_ms": snapshot.fetch_duration_ms,
+        "full_sweep_at": snapshot.full_sweep_at,
+        "count": count,
+        "n_ids": len(encoded_ids),
+        "id_bytes_len": len(id_bytes),
+    }).encode()
+    data_start = len(MAGIC) + 4 + len(header)
+    data_start += _pad(data_start)
+    layout = _layout(data_start, count, len(encoded_ids), len(id_bytes))
+
+    buf = bytearray(layout["end"])
+    buf[: len(MAGIC)] = MAGIC
+    struct.pack_into("<I", buf, len(MAGIC), len(header))
+    buf[len(MAGIC) + 4: len(MAGIC) + 4 + len(header)] = header
+
+    struct.pack_into(f"<{len(id_offsets)}q", buf, layout["id_offsets"], *id_offsets)
+    buf[layout["id_bytes"]: layout["id_bytes"] + len(id_bytes)] = id_bytes
+    struct.pack_into(f"<{count}i", buf, layout["location"], *location)
+
+    for name in INT_COLUMNS:
+        values = [getattr(record, name) for record in snapshot.records]
+        struct.pack_into(
+            f"<{count}q", buf, layout[name], *(v if v is not None else 0 for v in values)
+        )
+        bitmap_start = layout[f"nulls:{name}"]
+        for i, value in enumerate(values):
+            if value is None:
+                buf[bitmap_start + i // 8] |= 1 << (i % 8)
+
+    commit.write_file(path, bytes(buf))
+
+    return path
+
+
+class ColumnarSnapshot:
+    """Read-only, memory-mapped view of a columnar snapshot.
+
+    Columns are exposed as memoryviews over the mapped file, so reading a
+    column copies nothing; with NumPy available, ``numpy.frombuffer`` over a
+    column gives an int64 array without copying either. Call close() (or use
+    the view as a context manager) once every column view is released.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._mmap)
+
+        if bytes(self._buf[: len(MAGIC)]) != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a columnar snapshot")
+
+        (header_len,) = struct.unpack_from("<I", self._buf, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(bytes(self._buf[header_start: header_start + header_len]))
+
+        self.timestamp: str = header["timestamp"]
+        self.source: str = header["source"]
+        self.fetch_started: Optional[str] = header.get("fetch_started")
+        self.fetch_finished: Optional[str] = header.get("fetch_finished")
+        self.fetch_duration_ms: Optional[float] = header.get("fetch_duration_ms")
+        self.full_sweep_at: Optional[str] = header.get("full_sweep_at")
+        self._count: int = header["count"]
+        self._n_ids: int = header["n_ids"]
+
+        data_start = header_start + header_len
+        data_start += _pad(data_start)
+        layout = _layout(data_start, self._count, self._n_ids, header["id_bytes_len"])
+
+        self._id_offsets = self._int_view(layout["id_offsets"], self._n_ids + 1, "q")
+        self._id_bytes = self._buf[layout["id_bytes"]: layout["id_bytes"] + header["id_bytes_len"]]
+        self._location = self._int_view(layout["location"], self._count, "i")
+        self._columns = {
+            name: self._int_view(layout[name], self._count, "q") for name in INT_COLUMNS
+        }
+        bitmap_len = (self._count + 7) // 8
+        self._nulls = {
+            name: self._buf[layout[f"nulls:{name}"]: layout[f"nulls:{name}"] + bitmap_len]
+            for name in INT_COLUMNS
+        }
+        self._ids: list[Optional[str]] = [None] * self._n_ids
+
+    def _int_view(self, offset: int, length: int, fmt: str):
+        size = struct.calcsize(fmt)
+        raw = self._buf[offset: offset + size * length]
+        if _NATIVE_LITTLE:
+            return raw.cast(fmt)
+        # Big-endian hosts get a byte-swapped copy instead of a view
+        return list(struct.unpack(f"<{length}{fmt}", raw))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> "ColumnarSnapshot":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def column(self, name: str):
+        """Get the raw int64 values of a column (nulls read as 0)."""
+        return self._columns[name]
+
+    def null_bitmap(self, name: str) -> memoryview:
+        """Get the null bitmap of a column (bit i set = row i is null)."""
+        return self._nulls[name]
+
+    def is_null(self, name: str, index: int) -> bool:
+        """Check whether a column value is null."""
+        return bool(self._nulls[name][index // 8] & (1 << (index % 8)))
+
+    def value(self, name: str, index: int) -> Optional[int]:
+        """Get a single column value, None if null."""
+        if self.is_null(name, index):
+            return None
+        return self._columns[name][index]
+
+    def location_rows(self):
+        """Get the id-table index of every row (int32 values)."""
+        return self._location
+
+    def id_table(self) -> list[str]:
+        """Get the interned location id table, in table order."""
+        return [self._id_string(i) for i in range(self._n_ids)]
+
+    def id_table_key(self) -> bytes:
+        """Get raw bytes identifying the id table, for caching alignments."""
+        return self._id_offsets.tobytes() + self._id_bytes.tobytes()
+
+    def _id_string(self, id_index: int) -> str:
+        location_id = self._ids[id_index]
+        if location_id is None:
+            start = self._id_offsets[id_index]
+            end = self._id_offsets[id_index + 1]
+            location_id = sys.intern(bytes(self._id_bytes[start:end]).decode())
+            self._ids[id_index] = location_id
+        return location_id
+
+    def location_id(self, index: int) -> str:
+        """Get the location id of a row, decoding it from the id table once."""
+        return self._id_string(self._location[index])
+
+    def __getitem__(self, index: int) -> OverflowRecord:
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return OverflowRecord(
+            location_id=self.location_id(index),
+            source=self.source,
+            **{name: self.value(name, index) for name in INT_COLUMNS},
+        )
+
+    def __iter__(self) -> Iterator[OverflowRecord]:
+        for i in range(self._count):
+            yield self[i]
+
+    def to_snapshot(self) -> Snapshot:
+        """Materialise the view as a regular Snapshot."""
+        return Snapshot(
+            timestamp=self.timestamp,
+            source=self.source,
+            records=list(self),
+            fetch_started=self.fetch_started,
+            fetch_finished=self.fetch_finished,
+            fetch_duration_ms=self.fetch_duration_ms,
+            full_sweep_at=self.full_sweep_at,
+        )
+
+    def close(self):
+        """Release the column views and unmap the file."""
+        for name in ("_id_offsets", "_location"):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        for views in (getattr(self, "_columns", {}), getattr(self, "_nulls", {})):
+            for view in views.values():
+                if isinstance(view, memoryview):
+                    view.release()
+        if getattr(self, "_id_bytes", None) is not None:
+            self._id_bytes.release()
+        if self._buf is not None:
+            self._buf.release()
+            self._buf = None
+            self._mmap.close()
+            self._file.close()
+
+
+def open_columnar(path: str) -> ColumnarSnapshot:
+    """Memory-map a columnar snapshot.
+
+    Args:
+        path: Path to a columnar snapshot file.
+
+    Returns:
+        A zero-copy view of the snapshot.
+
+    Raises:
+        ValueError: If the file is not a columnar snapshot.
+    """
+    return ColumnarSnapshot(path)
+
+
+def load_columnar(path: str) -> Snapshot:
+    """Load a columnar snapshot as a regular Snapshot."""
+    with open_columnar(path) as view:
+        return view.to_snapshot()
+
+
+def json_to_columnar(json_path: str, columnar_path: Optional[str] = None) -> str:
+    """Convert a JSON snapshot file to the columnar format.
+
+    Args:
+        json_path: Source JSON snapshot.
+        columnar_path: Destination, defaults to the source with a .col suffix.
+
+    Returns:
+        Path of the columnar file.
+    """
+    if columnar_path is None:
+        columnar_path = str(Path(json_path).with_suffix(COLUMNAR_SUFFIX))
+
+    with open(json_path, "r") as f:
+        snapshot = Snapshot.from_dict(json.load(f))
+
+    return write_columnar(snapshot, columnar_path)
+
+
+def columnar_to_json(columnar_path: str, json_path: Optional[str] = None) -> str:
+    """Convert a columnar snapshot file back to the JSON format.
+
+    Args:
+        columnar_path: Source columnar snapshot.
+        json_path: Destination, defaults to the source with a .json suffix.
+
+    Returns:
+        Path of the JSON file.
+    """
+    if json_path is None:
+        json_path = str(Path(columnar_path).with_suffix(".json"))
+
+    snapshot = load_columnar(columnar_path)
+    with open(json_path, "w") as f:
+        json.dump(snapshot.to_dict(), f, indent=2)
+
+    return json_path
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.columnar to-col|to-json <file>...
+    command, *paths = sys.argv[1:]
+    convert = json_to_columnar if command == "to-col" else columnar_to_json
+    for path in paths:
+        print(convert(path))
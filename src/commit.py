@@ -0,0 +1,319 @@
+"""Crash-safe file writes, published together once per cycle.
+
+Files are written with write_file (whole files) or append_file (logs).
+Inside a transaction() neither touches its target. Each write is staged in
+its own file under COMMIT_STAGING_DIR/<transaction>/ and fsync'd. When the
+transaction ends, a journal listing every staged write is fsync'd. The
+journal is the commit point:
+
+    - a crash before it leaves every target as the previous cycle wrote it
+    - a crash after it is finished by recover() on the next start
+
+Once the journal is on disk, each staged file is renamed over its target
+and each staged append is written at the offset recorded for it. Appends
+are idempotent, so a roll-forward can be repeated. A reader never sees a
+truncated file, or one cycle's latest snapshot next to another's comparison.
+
+Modules caching what they wrote register on_abort callbacks to forget it
+when a transaction is discarded, so the cache never runs ahead of disk.
+
+write_file skips a file whose content is unchanged, so state that did not
+change is not rewritten every cycle. Outside a transaction, write_file
+replaces its file through a fsync'd temp file and append_file appends and
+fsyncs at once; a torn append is repaired by the log's own index check.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from . import metrics
+from .companies import data_path
+from .config import COMMIT_STAGING_DIR
+
+
+JOURNAL_FILE = "journal.json"
+
+_local = threading.local()
+
+# Path -> (size, mtime_ns, content digest) of files as last published or
+# compared, so an unchanged file is usually recognised without reading it
+_published: dict[str, tuple[int, int, bytes]] = {}
+
+
+class _Transaction:
+    """Writes staged on one thread, waiting to be published."""
+
+    def __init__(self, root: Path):
+        self.root = root  # Staging folder, created on the first write
+        self.ops: list[dict] = []  # Journal entries, in write order
+        self.staged: dict[str, Path] = {}  # Target -> its latest staged file
+        self.ends: dict[str, int] = {}  # Target -> its size after staged appends
+        self.aborted: list[Callable[[], None]] = []  # Run if the writes are discarded
+
+    def stage(self, data: bytes) -> Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{len(self.ops)}.pending"
+        _write_synced(path, data)
+        return path
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _write_synced(path: Path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remember(path: Path, digest: bytes):
+    st = os.stat(path)
+    _published[str(path)] = (st.st_size, st.st_mtime_ns, digest)
+
+
+def _unchanged(path: Path, data: bytes) -> bool:
+    """Check whether a file already holds exactly this content."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if st.st_size != len(data):
+        return False
+
+    digest = _digest(data)
+    known = _published.get(str(path))
+    if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+        return known[2] == digest
+
+    with open(path, "rb") as f:
+        same = f.read() == data
+    if same:
+        _remember(path, digest)
+    return same
+
+
+def _apply_append(path: Path, offset: int, data: bytes):
+    """Write staged appended data at its offset, unless already there."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        size = os.fstat(fd).st_size
+        if size >= offset + len(data):
+            return
+        if size > offset:
+            # A torn earlier attempt
+            os.ftruncate(fd, offset)
+            size = offset
+        os.pwrite(fd, data, size)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _roll_forward(root: Path, ops: list[dict]):
+    """Apply a committed transaction's writes, then remove its staging folder."""
+    folders = set()
+    for op in ops:
+        staged = root / op["staged"]
+        target = Path(op["path"])
+        if op["op"] == "append":
+            _apply_append(target, op["offset"], staged.read_bytes())
+        elif staged.exists():
+            # A missing staged file was renamed before a crash
+            os.replace(staged, target)
+            folders.add(target.parent)
+            _remember(target, bytes.fromhex(op["digest"]))
+
+    for folder in folders:
+        _fsync_dir(folder)
+    shutil.rmtree(root)
+
+
+def _abort(tx: _Transaction):
+    """Discard a transaction's staged writes."""
+    shutil.rmtree(tx.root, ignore_errors=True)
+    for callback in reversed(tx.aborted):
+        callback()
+
+
+def _commit(tx: _Transaction):
+    if not tx.ops:
+        shutil.rmtree(tx.root, ignore_errors=True)
+        return
+
+    start = time.perf_counter()
+    journal = tx.root / JOURNAL_FILE
+    tmp = journal.with_name(JOURNAL_FILE + ".tmp")
+    try:
+        _write_synced(tmp, json.dumps({"ops": tx.ops}, separators=(",", ":")).encode())
+        os.replace(tmp, journal)
+        _fsync_dir(tx.root)
+    except BaseException:
+        _abort(tx)
+        raise
+
+    _roll_forward(tx.root, tx.ops)
+    metrics.observe("commit_seconds", time.perf_counter() - start)
+    metrics.incr("committed_files_total", len(tx.ops))
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """Stage this thread's writes and publish them together on exit.
+
+    Writes go to the company bound to this thread when the transaction
+    starts. If the block raises, or the journal cannot be written, every
+    staged write is discarded and the on_abort callbacks are run. A
+    transaction started inside another joins it.
+    """
+    if getattr(_local, "tx", None) is not None:
+        yield
+        return
+
+    name = f"{time.time_ns():020d}-{os.getpid()}-{threading.get_ident()}"
+    tx = _Transaction(data_path(COMMIT_STAGING_DIR) / name)
+    _local.tx = tx
+    try:
+        yield
+    except BaseException:
+        _abort(tx)
+        raise
+    else:
+        _commit(tx)
+    finally:
+        _local.tx = None
+
+
+def on_abort(callback: Callable[[], None]):
+    """Run a callback if this thread's transaction is discarded.
+
+    Callbacks run in reverse order of registration. Outside a transaction
+    writes are published at once, so the callback is never run.
+
+    Args:
+        callback: Undoes in-memory state describing staged writes.
+    """
+    tx: Optional[_Transaction] = getattr(_local, "tx", None)
+    if tx is not None:
+        tx.aborted.append(callback)
+
+
+def write_file(path, data: bytes) -> bool:
+    """Replace a file's content atomically, unless it is unchanged.
+
+    Args:
+        path: Destination path; its folder is created if needed.
+        data: The complete new content.
+
+    Returns:
+        True if the file is written, False if it already held data.
+    """
+    tx: Optional[_Transaction] = getattr(_local, "tx", None)
+    path = Path(path)
+    key = str(path)
+    if (tx is None or key not in tx.staged) and _unchanged(path, data):
+        metrics.incr("unchanged_files_skipped_total")
+        return False
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if tx is None:
+        tmp = path.with_name(path.name + ".tmp")
+        _write_synced(tmp, data)
+        os.replace(tmp, path)
+        _fsync_dir(path.parent)
+        _remember(path, _digest(data))
+        return True
+
+    staged = tx.stage(data)
+    tx.staged[key] = staged
+    tx.ops.append({"op": "replace", "path": key, "staged": staged.name, "digest": _digest(data).hex()})
+    return True
+
+
+def append_file(path, data: bytes) -> int:
+    """Append to a file, after any appends already staged for it.
+
+    Args:
+        path: Destination path; its folder is created if needed.
+        data: Bytes to append.
+
+    Returns:
+        Offset in the file at which data will start.
+    """
+    tx: Optional[_Transaction] = getattr(_local, "tx", None)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if tx is None:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            offset = os.fstat(fd).st_size
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return offset
+
+    key = str(path)
+    offset = tx.ends.get(key)
+    if offset is None:
+        offset = path.stat().st_size if path.exists() else 0
+
+    staged = tx.stage(data)
+    tx.ops.append({"op": "append", "path": key, "offset": offset, "staged": staged.name})
+    tx.ends[key] = offset + len(data)
+    return offset
+
+
+def file_size(path) -> int:
+    """Get the size a file will have once this thread's writes are published."""
+    tx: Optional[_Transaction] = getattr(_local, "tx", None)
+    key = str(path)
+    if tx is not None:
+        if key in tx.ends:
+            return tx.ends[key]
+        if key in tx.staged:
+            return tx.staged[key].stat().st_size
+    return os.path.getsize(path)
+
+
+def recover() -> int:
+    """Finish or discard the current company's interrupted transactions.
+
+    Committed transactions are rolled forward in the order they began;
+    uncommitted ones are discarded. Must run before the first write, e.g.
+    when a process starts.
+
+    Returns:
+        Number of transactions rolled forward.
+    """
+    staging = data_path(COMMIT_STAGING_DIR)
+    if not staging.exists():
+        return 0
+
+    finished = 0
+    for root in sorted(p for p in staging.iterdir() if p.is_dir()):
+        journal = root / JOURNAL_FILE
+        if not journal.exists():
+            shutil.rmtree(root)
+            continue
+        with open(journal, "r") as f:
+            ops = json.load(f)["ops"]
+        _roll_forward(root, ops)
+        finished += 1
+    return finished
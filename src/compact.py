@@ -0,0 +1,168 @@
+"""Compaction of finished snapshot days into day archives.
+
+Folds every day folder before today (UTC) into a compressed archive (see
+src.archive), verifies that each snapshot rebuilds exactly from it, then
+removes the folder. Folders written by any backend can be compacted. A
+folder for a day that already has an archive, e.g. from a cycle committed
+late or running across midnight, is merged into it. The current day is
+never touched, so the working tree keeps at most one day of
+uncompressed snapshots however long the history grows. The change feed's
+finished days are gzipped in the same run (see src.changes).
+
+Usage: python -m src.compact [--company KEY]... [--before YYYY-MM-DD] [--keep]
+"""
+
+import argparse
+import heapq
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .archive import (
+    archive_path,
+    archived_sources,
+    copy_archive,
+    iter_archived,
+    list_archived,
+    write_archive,
+)
+from .changes import compact_changes
+from .companies import data_path, load_companies, use_company
+from .config import COMPANIES, SNAPSHOTS_DIR
+from .models import Snapshot
+from .replay import SNAPSHOT_NAME, list_snapshot_paths
+from .storage import load_snapshot
+
+
+def _sources(folder: Path) -> list[str]:
+    names = (SNAPSHOT_NAME.match(p.name) for p in folder.iterdir())
+    return sorted({match["source"] for match in names if match})
+
+
+def _load_source(
+    day: str,
+    source: str,
+    snapshots_dir: str,
+    previous: Optional[Path],
+) -> Iterator[tuple[str, Snapshot]]:
+    """Stream a source's snapshots in a day folder, merged with those in a previous archive.
+
+    A snapshot in both is taken from the folder.
+    """
+    loose = list_snapshot_paths(day, source, snapshots_dir)
+    merged = ((time, load_snapshot(path)) for time, path in loose)
+    if previous is not None:
+        times = {time for time, _ in loose}
+        archived = zip((time for time, _ in list_archived(previous, source)), iter_archived(previous, source))
+        merged = heapq.merge(
+            merged,
+            ((time, snapshot) for time, snapshot in archived if time not in times),
+            key=lambda item: item[0],
+        )
+    for time, snapshot in merged:
+        yield f"{source}_{time}", snapshot
+
+
+def _load_day(
+    day: str,
+    sources: list[str],
+    snapshots_dir: str,
+    previous: Optional[Path],
+) -> Iterator[tuple[str, Snapshot]]:
+    for source in sources:
+        yield from _load_source(day, source, snapshots_dir, previous)
+
+
+def _folder_size(folder: Path) -> int:
+    return sum(p.stat().st_size for p in folder.rglob("*") if p.is_file())
+
+
+def compact_day(day: str, snapshots_dir: str, keep: bool = False) -> tuple[int, int, int]:
+    """Fold one day folder into its archive, keeping any snapshots already in it.
+
+    Args:
+        day: Day folder name (YYYY-MM-DD).
+        snapshots_dir: Root snapshots directory.
+        keep: Keep the folder after archiving it.
+
+    Returns:
+        (snapshots archived, folder bytes, archive bytes).
+
+    Raises:
+        ValueError: If a snapshot does not rebuild exactly from the archive;
+            the folder is then left in place.
+    """
+    folder = Path(snapshots_dir) / day
+    path = archive_path(snapshots_dir, day)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # The archive is replaced, so merge from (and verify against) a copy
+        previous = copy_archive(path, scratch) if path.exists() else None
+        sources = _sources(folder)
+        if previous is not None:
+            sources = sorted(set(sources).union(archived_sources(previous)))
+        count = write_archive(path, _load_day(day, sources, snapshots_dir, previous))
+
+        # Verify against a second read, one snapshot at a time
+        for source in sources:
+            originals = (snapshot for _, snapshot in _load_source(day, source, snapshots_dir, previous))
+            for original, rebuilt in zip(originals, iter_archived(path, source), strict=True):
+                if rebuilt != original:
+                    raise ValueError(f"Snapshot {source} at {original.timestamp} did not rebuild exactly")
+
+    size = _folder_size(folder)
+    if not keep:
+        shutil.rmtree(folder)
+    return count, size, path.stat().st_size
+
+
+def compact(
+    snapshots_dir: Optional[str] = None,
+    before: Optional[str] = None,
+    keep: bool = False,
+) -> list[tuple[str, int, int, int]]:
+    """Compact every finished day folder.
+
+    Args:
+        snapshots_dir: Root snapshots directory; defaults to the current
+            company's.
+        before: Only days before this date (YYYY-MM-DD); defaults to today, UTC.
+        keep: Keep the folders after archiving them.
+
+    Returns:
+        (day, snapshots, folder bytes, archive bytes) per compacted day.
+    """
+    root = Path(snapshots_dir) if snapshots_dir else data_path(SNAPSHOTS_DIR)
+    if before is None:
+        before = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not root.exists():
+        return []
+
+    days = sorted(p.name for p in root.iterdir() if p.is_dir() and p.name < before)
+    return [(day, *compact_day(day, str(root), keep)) for day in days]
+
+
+def main() -> int:
+    """Compact finished snapshot days for each company."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--company", action="append", choices=list(COMPANIES),
+                        help="company to compact (repeatable; default all)")
+    parser.add_argument("--before", help="only days before this date (default today, UTC)")
+    parser.add_argument("--keep", action="store_true", help="keep day folders after archiving")
+    args = parser.parse_args()
+
+    for company in load_companies(args.company):
+        with use_company(company):
+            for day, count, size, archived in compact(before=args.before, keep=args.keep):
+                print(f"[{company.key}] {day}: {count} snapshots, {size / 1e6:.1f} MB -> {archived / 1e6:.2f} MB")
+            for day, size, gzipped in compact_changes(before=args.before):
+                print(f"[{company.key}] {day}: change feed, {size / 1e6:.1f} MB -> {gzipped / 1e6:.2f} MB")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Registry of tracked water companies and their storage namespaces.
+
+Each company pairs a truth API (the company's own discharge status feed)
+with its storm overflow layer on NSOH, and is tracked independently: its own
+snapshots, baseline, rollback log, rollups and episodes. DEFAULT_COMPANY
+keeps the original layout directly under DATA_DIR; every other company gets
+the same layout under COMPANIES_DIR/<key>/.
+
+Storage code resolves its directories with data_path(), which maps a
+configured directory into the namespace of the company bound to the current
+thread (see use_company and bind).
+"""
+
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, Optional, TypeVar
+
+from .config import COMPANIES, COMPANIES_DIR, DATA_DIR, DEFAULT_COMPANY
+
+
+T = TypeVar("T")
+
+
+@dataclass(slots=True)
+class Company:
+    """A (truth API, NSOH layer) pair."""
+
+    key: str
+    name: str
+    truth_api: str  # Parser for the truth API, see ingest.TRUTH_FETCHERS
+    truth_url: str
+    nsoh_url: str
+
+    @property
+    def data_dir(self) -> Path:
+        if self.key == DEFAULT_COMPANY:
+            return Path(DATA_DIR)
+        return Path(COMPANIES_DIR) / self.key
+
+
+def get_company(key: str) -> Company:
+    """Get a configured company.
+
+    Args:
+        key: Key in COMPANIES.
+
+    Returns:
+        The company.
+
+    Raises:
+        ValueError: If no company has this key.
+    """
+    try:
+        entry = COMPANIES[key]
+    except KeyError:
+        raise ValueError(f"Unknown company {key!r}; expected one of {', '.join(COMPANIES)}")
+
+    return Company(
+        key=key,
+        name=entry["name"],
+        truth_api=entry["truth_api"],
+        truth_url=entry["truth_url"],
+        nsoh_url=entry["nsoh_url"],
+    )
+
+
+def load_companies(keys: Optional[list[str]] = None) -> list[Company]:
+    """Get the companies to track.
+
+    Args:
+        keys: Company keys, or None for every configured company.
+
+    Returns:
+        Companies in the given (or configured) order.
+
+    Raises:
+        ValueError: If a key is unknown.
+    """
+    return [get_company(key) for key in (keys or COMPANIES)]
+
+
+_bound = threading.local()
+
+
+def current_company() -> Company:
+    """Get the company bound to this thread, or the default company."""
+    company = getattr(_bound, "company", None)
+    return company if company is not None else get_company(DEFAULT_COMPANY)
+
+
+@contextmanager
+def use_company(company: Company) -> Iterator[None]:
+    """Bind a company to this thread for the enclosed block."""
+    previous = getattr(_bound, "company", None)
+    _bound.company = company
+    try:
+        yield
+    finally:
+        _bound.company = previous
+
+
+def bind(company: Company, func: Callable[..., T]) -> Callable[..., T]:
+    """Wrap a function so that, on any thread, it runs bound to a company.
+
+    Used for writes that run on another thread, e.g. the daemon's
+    write-behind thread.
+    """
+    def bound(*args, **kwargs) -> T:
+        with use_company(company):
+            return func(*args, **kwargs)
+
+    return bound
+
+
+def data_path(directory: str) -> Path:
+    """Map a configured data directory into the current company's namespace.
+
+    Args:
+        directory: A directory under DATA_DIR, e.g. LATEST_DIR.
+
+    Returns:
+        The directory for the company bound to this thread.
+    """
+    return current_company().data_dir / Path(directory).relative_to(DATA_DIR)
@@ -7,13 +7,63 @@ NSOH_ARCGIS_URL = (
     "Thames_Water_Storm_Overflow_Activity_(Production)_view/FeatureServer/0/query"
 )
 
+# Tracked companies, each pairing a truth API with its NSOH storm overflow
+# layer. "truth_api" names the parser for the truth API (see
+# ingest.TRUTH_FETCHERS). DEFAULT_COMPANY's data stays directly under
+# DATA_DIR; every other company gets the same layout under COMPANIES_DIR/<key>.
+COMPANIES = {
+    "thames": {
+        "name": "Thames Water",
+        "truth_api": "thames",
+        "truth_url": THAMES_WATER_API_URL,
+        "nsoh_url": NSOH_ARCGIS_URL,
+    },
+}
+DEFAULT_COMPANY = "thames"
+COMPANY_WORKERS = 4  # Companies processed concurrently
+
 # Request settings
 REQUEST_TIMEOUT = 30  # seconds
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+RETRY_BASE_DELAY = 2  # seconds, doubled on each retry
+RETRY_MAX_DELAY = 30  # seconds, cap for a single backoff sleep
+HTTP_POOL_SIZE = 10  # Keep-alive connections per host
+CONDITIONAL_REQUESTS = True  # Send If-None-Match / If-Modified-Since
+HTTP_STREAM_CHUNK_SIZE = 64 * 1024  # bytes read at a time when streaming
+TIMESTAMP_CACHE_SIZE = 65536  # Memoised ISO timestamp conversions (fetchers/timestamps.py)
+# Per-host limits shared by every company: host -> (requests per second,
+# burst). Hosts not listed are not throttled.
+HTTP_RATE_LIMITS = {
+    "services2.arcgis.com": (10, 20),
+    "api.thameswater.co.uk": (5, 10),
+}
+
+# Daemon mode (python -m src.daemon)
+POLL_INTERVAL = 180  # seconds between cycle starts
+ADAPTIVE_POLLING = True  # Burst-poll around suspected rollbacks
+BURST_POLL_INTERVAL = 20  # seconds between cycle starts while bursting
+BURST_WINDOW = 600  # seconds of burst polling after the last trigger
+BURST_MAX_DURATION = 1800  # a single burst never lasts longer than this
+BURST_COOLDOWN = 1800  # seconds after a capped burst during which triggers are ignored
+BURST_THAMES_MIN_MOVES = 20  # Thames StatusStart changes in one poll that trigger a burst
+METRICS_PORT = None  # Serve Prometheus metrics at /metrics on this port when set
+METRICS_PREFIX = "nsoh_tracker_"  # Prefix of exported Prometheus metric names
 
 # ArcGIS pagination
 ARCGIS_PAGE_SIZE = 1000
+NSOH_PARALLEL_FETCH = True  # Count first, then fetch all pages concurrently
+NSOH_FETCH_WORKERS = 4  # Max concurrent page requests
+# Only the attributes parse_feature reads; geometry is never requested
+NSOH_OUT_FIELDS = "Id,Status,StatusStart,LatestEventStart,LatestEventEnd,LastUpdated"
+
+# Incremental NSOH fetch (see fetchers/nsoh.py): each poll fetches Id and
+# LastUpdated for every feature, and full attributes only for features
+# whose event timestamps moved forward. Falls back to a full sweep as needed.
+NSOH_INCREMENTAL = True
+NSOH_FULL_SWEEP_INTERVAL = 3600  # seconds between scheduled full sweeps
+NSOH_DELTA_OVERLAP = 3600  # seconds of lookback for late-published events
+NSOH_STAMP_FIELDS = "Id,LastUpdated"
+NSOH_DELTA_FIELDS = ("StatusStart", "LatestEventStart", "LatestEventEnd")
 
 # Status mappings
 THAMES_STATUS_MAP = {
@@ -28,14 +78,55 @@ NSOH_STATUS_MAP = {
     -1: "Offline",
 }
 
+# Detection baseline: "previous" compares against the previous NSOH snapshot,
+# "high_water_mark" against the highest LastUpdated ever seen per location
+DETECTION_BASELINE = "previous"
+
 # Data paths (relative to project root)
 DATA_DIR = "data"
 SNAPSHOTS_DIR = f"{DATA_DIR}/snapshots"
 ROLLBACKS_DIR = f"{DATA_DIR}/rollbacks"
 LATEST_DIR = f"{DATA_DIR}/latest"
+ROLLUPS_DIR = f"{DATA_DIR}/rollups"
+ROLLBACK_LOCATIONS_DIR = f"{ROLLBACKS_DIR}/locations"  # Per-location query postings
+EPISODES_DIR = f"{DATA_DIR}/episodes"
+CHANGES_DIR = f"{DATA_DIR}/changes"  # One change set per source per cycle, per day
+METRICS_DIR = f"{DATA_DIR}/metrics"  # One JSON line per cycle, per day
+COMPANIES_DIR = f"{DATA_DIR}/companies"  # Namespaces of non-default companies
+DAEMON_LOCK_FILE = f"{DATA_DIR}/daemon.lock"
+COMMIT_STAGING_DIR = f"{DATA_DIR}/.staging"  # Writes staged until their cycle commits
+
+# NSOH lag behind the truth API (see lag.py): histogram buckets per doubling
+# of the lag, so a percentile is reported at most ~19% above its true value
+LAG_BUCKETS_PER_DOUBLING = 4
+# Truth API changes first seen longer than this after they happened are
+# treated as history (e.g. re-stamped timestamps), not measured as lag
+LAG_MAX_CHANGE_AGE_MS = 24 * 3600 * 1000
+
+# Dashboard rollups
+ROLLUP_RECENT_ENTRIES = 20  # Log entries kept in rollups/recent.json
+ROLLUP_EVENTS_PER_ENTRY = 50  # Rollback events kept per recent entry
+ROLLUP_HOURLY_DAYS = 7  # Days of per-hour buckets kept
+
+# Snapshot storage backend: "json" (one file per snapshot), "dedup"
+# (content-addressed manifests plus a per-day record pack), "columnar"
+# (fixed-width binary columns, memory-mapped on read) or "delta" (per-cycle
+# changes since the previous snapshot; finished days are compacted into
+# day archives by python -m src.compact)
+SNAPSHOT_BACKEND = "delta"
+DELTA_KEYFRAME_INTERVAL = 48  # Snapshots per full base in a delta chain
 
 # File names
-ROLLBACK_LOG_FILE = "rollback_log.json"
+ROLLBACK_LOG_FILE = "rollback_log.jsonl"  # One ComparisonResult per line
+ROLLBACK_INDEX_FILE = "rollback_log.idx"  # Byte offset and length per entry
+ROLLBACK_TIME_INDEX_FILE = "rollback_log.tix"  # Detection time and running totals per entry
+ROLLBACK_LOCATION_SUMMARY_FILE = "rollback_log.locations.json"  # Rollbacks and first/last per location
+LEGACY_ROLLBACK_LOG_FILE = "rollback_log.json"  # JSON array (exports)
 LATEST_COMPARISON_FILE = "latest_comparison.json"
 THAMES_LATEST_FILE = "thames.json"
 NSOH_LATEST_FILE = "nsoh.json"
+HTTP_VALIDATORS_FILE = "http_validators.json"
+HIGH_WATER_MARKS_FILE = "nsoh_hwm.json"
+EPISODE_STATE_FILE = "episodes.json"  # Open episodes, in LATEST_DIR
+METRICS_LATEST_FILE = "metrics.json"  # Last cycle's metrics, in LATEST_DIR
+LAG_STATE_FILE = "lag.json"  # Per-location NSOH lag distributions, in LATEST_DIR
@@ -0,0 +1,321 @@
+"""Long-running polling daemon for the NSOH API Rollback Tracker.
+
+Runs the detection cycle for every tracked company every POLL_INTERVAL
+seconds in one process, with companies checked concurrently. The baseline
+snapshots, high-water marks and pooled HTTP connections stay in memory
+between cycles, and results are written to disk on a write-behind thread so
+persistence never delays the next poll.
+
+Cycle starts are scheduled on a fixed grid from the previous scheduled
+start, so they do not drift by the cycle's own duration. Cycles never
+overlap: if one overruns the interval, the ticks it missed are skipped
+rather than run back to back. A lock file keeps a second daemon from
+polling the same data directory.
+
+With adaptive polling, a cycle that sees an NSOH regression or a jump in
+truth API StatusStart values for any company switches to BURST_POLL_INTERVAL
+until every source has been quiet for BURST_WINDOW, so the onset and end of a short-lived
+rollback are resolved to within seconds. Bursts are capped at
+BURST_MAX_DURATION, followed by BURST_COOLDOWN at the normal interval.
+
+With a metrics port, counters and timings accumulated since startup are
+served in Prometheus text format at http://127.0.0.1:PORT/metrics.
+
+Usage: python -m src.daemon [--interval SECONDS] [--cycles N] [--no-adaptive]
+                            [--metrics-port PORT] [--company KEY ...]
+"""
+
+import argparse
+import fcntl
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from .config import (
+    DAEMON_LOCK_FILE,
+    POLL_INTERVAL,
+    ADAPTIVE_POLLING,
+    BURST_POLL_INTERVAL,
+    BURST_WINDOW,
+    BURST_MAX_DURATION,
+    BURST_COOLDOWN,
+    BURST_THAMES_MIN_MOVES,
+    METRICS_PORT,
+    COMPANIES,
+)
+from .companies import load_companies
+from .fetchers.http import close_session
+from .metrics import serve_metrics
+from .main import CycleState, Write, load_state, run_companies
+from .storage import ensure_directories
+
+
+class WriteBehind:
+    """Runs writes in submission order on a background thread."""
+
+    def __init__(self):
+        self._queue: queue.Queue[Optional[Write]] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, write: Write):
+        """Queue a write to run after every write submitted before it."""
+        self._queue.put(write)
+
+    def pending(self) -> int:
+        """Get the number of writes not yet finished."""
+        return self._queue.unfinished_tasks
+
+    def flush(self):
+        """Block until every submitted write has run."""
+        self._queue.join()
+
+    def close(self):
+        """Run the remaining writes and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            write = self._queue.get()
+            try:
+                if write is None:
+                    return
+                write()
+            except Exception as e:
+                print(f"  ERROR: write-behind failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+def burst_triggers(state: CycleState) -> list[str]:
+    """Get the reasons, if any, the last cycle warrants burst polling.
+
+    Args:
+        state: State after a cycle.
+
+    Returns:
+        Human-readable reasons; empty if both sources were quiet.
+    """
+    reasons = []
+    name = state.company.name
+
+    result = state.last_result
+    if result is not None and result.rollbacks_detected > 0:
+        reasons.append(f"NSOH regressed at {result.rollbacks_detected} {name} location(s)")
+    if state.thames_moves_back > 0:
+        reasons.append(f"{name} StatusStart moved back at {state.thames_moves_back} location(s)")
+    if state.thames_moves >= BURST_THAMES_MIN_MOVES:
+        reasons.append(f"{name} StatusStart changed at {state.thames_moves} locations")
+
+    return reasons
+
+
+class AdaptiveSchedule:
+    """Picks the poll interval, bursting for a bounded window after triggers.
+
+    Times are time.monotonic() seconds.
+    """
+
+    def __init__(
+        self,
+        interval: float = POLL_INTERVAL,
+        burst_interval: float = BURST_POLL_INTERVAL,
+        window: float = BURST_WINDOW,
+        max_duration: float = BURST_MAX_DURATION,
+        cooldown: float = BURST_COOLDOWN,
+    ):
+        self.base_interval = interval
+        self.burst_interval = min(burst_interval, interval)
+        self.window = window
+        self.max_duration = max_duration
+        self.cooldown = cooldown
+
+        self.burst_started: Optional[float] = None
+        self.burst_until: Optional[float] = None
+        self.cooldown_until: Optional[float] = None
+
+    @property
+    def bursting(self) -> bool:
+        return self.burst_started is not None
+
+    @property
+    def interval(self) -> float:
+        return self.burst_interval if self.bursting else self.base_interval
+
+    def observe(self, now: float, triggers: list[str]):
+        """Update the schedule after a cycle.
+
+        Args:
+            now: Time the cycle finished.
+            triggers: Reasons to burst, from burst_triggers.
+        """
+        if self.bursting:
+            if now - self.burst_started >= self.max_duration:
+                print(f"  Burst polling capped after {self.max_duration:g}s; cooling down")
+                self.burst_started = self.burst_until = None
+                self.cooldown_until = now + self.cooldown
+            elif now >= self.burst_until and not triggers:
+                print("  Sources quiet; back to the normal poll interval")
+                self.burst_started = self.burst_until = None
+
+        if not triggers:
+            return
+
+        if self.cooldown_until is not None and now < self.cooldown_until:
+            print(f"  Burst trigger ignored during cooldown: {'; '.join(triggers)}")
+            return
+
+        if not self.bursting:
+            print(f"  Burst polling every {self.burst_interval:g}s: {'; '.join(triggers)}")
+            self.burst_started = now
+            self.cooldown_until = None
+        self.burst_until = min(now + self.window, self.burst_started + self.max_duration)
+
+
+def acquire_lock(path: str = DAEMON_LOCK_FILE):
+    """Take the single-instance daemon lock.
+
+    Args:
+        path: Lock file path.
+
+    Returns:
+        The open lock file; the lock is held until it is closed.
+
+    Raises:
+        RuntimeError: If another daemon holds the lock.
+    """
+    ensure_directories()
+    lock_file = open(path, "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError(f"Another daemon holds {path}")
+
+    lock_file.truncate(0)
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    return lock_file
+
+
+def run_daemon(
+    interval: float = POLL_INTERVAL,
+    cycles: Optional[int] = None,
+    stop: Optional[threading.Event] = None,
+    adaptive: bool = ADAPTIVE_POLLING,
+    metrics_port: Optional[int] = METRICS_PORT,
+    companies: Optional[list[str]] = None,
+) -> int:
+    """Poll on a fixed schedule until stopped.
+
+    Args:
+        interval: Seconds between cycle starts.
+        cycles: Stop after this many cycles, or run until stopped.
+        stop: Set to stop after the current cycle.
+        adaptive: Burst-poll around suspected rollbacks.
+        metrics_port: Serve Prometheus metrics on this port, or not at all.
+        companies: Keys of the companies to track, or None for all.
+
+    Returns:
+        Exit code: 0 after a clean shutdown.
+    """
+    if stop is None:
+        stop = threading.Event()
+
+    tracked = load_companies(companies)
+    lock_file = acquire_lock()
+    writer = WriteBehind()
+    states = [load_state(company) for company in tracked]
+
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = serve_metrics(metrics_port)
+        print(f"Serving metrics at http://127.0.0.1:{metrics_server.server_address[1]}/metrics")
+
+    print(f"[{datetime.now(timezone.utc).isoformat()}] Daemon started for {', '.join(c.key for c in tracked)}, polling every {interval:g}s")
+
+    schedule = AdaptiveSchedule(interval=interval)
+    scheduled = time.monotonic()  # Scheduled start of the current cycle
+    completed = 0
+
+    try:
+        while not stop.is_set():
+            try:
+                run_companies(states, persist=writer.submit)
+            except Exception as e:
+                # Keep polling after unexpected errors; the next cycle retries
+                print(f"  ERROR: cycle failed: {e}")
+
+            completed += 1
+            if cycles is not None and completed >= cycles:
+                break
+
+            now = time.monotonic()
+            if adaptive:
+                schedule.observe(now, [r for state in states for r in burst_triggers(state)])
+
+            # Next start on the grid scheduled + k * interval, skipping missed ticks
+            step = schedule.interval
+            ticks = int((now - scheduled) // step) + 1
+            if ticks > 1:
+                print(f"  Cycle overran the poll interval, skipping {ticks - 1} poll(s)")
+            scheduled += ticks * step
+            stop.wait(max(scheduled - time.monotonic(), 0))
+    finally:
+        print(f"Stopping: flushing {writer.pending()} pending write(s)...")
+        writer.close()
+        close_session()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        lock_file.close()
+
+    return 0
+
+
+def main() -> int:
+    """Run the tracker as a long-running daemon."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="seconds between polls")
+    parser.add_argument("--cycles", type=int, default=None, help="stop after N cycles")
+    parser.add_argument("--no-adaptive", action="store_true", help="never burst-poll")
+    parser.add_argument(
+        "--metrics-port", type=int, default=METRICS_PORT, help="serve Prometheus metrics on PORT"
+    )
+    parser.add_argument(
+        "--company", action="append", choices=list(COMPANIES),
+        help="company to track (repeatable); defaults to all",
+    )
+    args = parser.parse_args()
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"Received signal {signum}, stopping after the current cycle...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    try:
+        return run_daemon(
+            interval=args.interval,
+            cycles=args.cycles,
+            stop=stop,
+            adaptive=ADAPTIVE_POLLING and not args.no_adaptive,
+            metrics_port=args.metrics_port,
+            companies=args.company,
+        )
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Per-cycle delta snapshots, small enough to commit every few minutes.
+
+Each snapshot is saved as a one-line JSON file holding only what changed
+since the previous snapshot of the same source in the same day folder:
+
+    data/snapshots/<date>/<source>_<time>.delta.json
+
+    {"timestamp": ..., "source": ..., "fetch_*": ..., "base": false,
+     "changed": {location_id: {field: value, ...}}, "added": [record, ...],
+     "removed": [location_id, ...], "order": [location_id, ...]}
+
+"order" is only present when the record order is not the previous order
+less the removed records plus the added ones. The first snapshot of a
+source in a folder, and every DELTA_KEYFRAME_INTERVAL-th after it, is a
+base holding all records ({"base": true, "records": [...]}), so loading
+one reads at most DELTA_KEYFRAME_INTERVAL files.
+
+Finished days are folded into a compressed archive by src.archive.
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+
+from . import commit
+from .config import DELTA_KEYFRAME_INTERVAL
+from .models import OverflowRecord, Snapshot
+
+
+DELTA_SUFFIX = ".delta.json"
+
+_HEADER_FIELDS = ("timestamp", "source", "fetch_started", "fetch_finished", "fetch_duration_ms", "full_sweep_at")
+
+
+class _Head:
+    """Records of the last delta snapshot written for a source in a folder."""
+
+    __slots__ = ("path", "records", "order", "since_base")
+
+    def __init__(self, path: Path, records: dict[str, dict], order: list[str], since_base: int):
+        self.path = path
+        self.records = records  # location_id -> record dict
+        self.order = order
+        self.since_base = since_base  # Deltas written since the last base
+
+
+# (folder, source) -> head, so consecutive saves don't re-read the chain
+_heads: dict[tuple[str, str], _Head] = {}
+
+
+def is_delta(path: str) -> bool:
+    """Check whether a snapshot path points at a delta snapshot."""
+    return str(path).endswith(DELTA_SUFFIX)
+
+
+def encode_delta(
+    snapshot: Snapshot,
+    previous: Optional[tuple[dict[str, dict], list[str]]],
+    base: bool,
+) -> tuple[dict, dict[str, dict], list[str]]:
+    """Encode a snapshot against the records of the one before it.
+
+    Args:
+        snapshot: Snapshot to encode.
+        previous: (records by location id, order) of the previous snapshot.
+        base: Encode all records instead of a delta.
+
+    Returns:
+        (delta dict, records by location id, order) of this snapshot.
+    """
+    records = {}
+    order = []
+    for record in snapshot.records:
+        data = record.to_dict()
+        records[data["location_id"]] = data
+        order.append(data["location_id"])
+
+    delta = {name: getattr(snapshot, name) for name in _HEADER_FIELDS}
+    if base or previous is None or len(records) != len(order):
+        # Repeated location ids can't be keyed by id, so they are kept whole
+        delta["base"] = True
+        delta["records"] = [record.to_dict() for record in snapshot.records]
+        return delta, records, order
+
+    previous_records, previous_order = previous
+    changed = {}
+    added = []
+    for location_id in order:
+        data = records[location_id]
+        before = previous_records.get(location_id)
+        if before is None:
+            added.append(data)
+        elif before != data:
+            changed[location_id] = {k: v for k, v in data.items() if before.get(k) != v}
+
+    removed = list(dict.fromkeys(i for i in previous_order if i not in records))
+    gone = set(removed)
+    expected = [location_id for location_id in previous_order if location_id not in gone]
+    expected.extend(data["location_id"] for data in added)
+
+    delta["base"] = False
+    delta["changed"] = changed
+    delta["added"] = added
+    delta["removed"] = removed
+    if expected != order:
+        delta["order"] = order
+    return delta, records, order
+
+
+def apply_delta(
+    delta: dict,
+    previous: Optional[tuple[dict[str, dict], list[str]]],
+) -> tuple[Snapshot, dict[str, dict], list[str]]:
+    """Rebuild a snapshot from its delta and the records of the one before it.
+
+    Args:
+        delta: Decoded delta file.
+        previous: (records by location id, order) of the previous snapshot;
+            ignored for a base.
+
+    Returns:
+        (snapshot, records by location id, order).
+
+    Raises:
+        ValueError: If the delta is not a base and previous is None.
+    """
+    header = {name: delta.get(name) for name in _HEADER_FIELDS}
+
+    if delta["base"]:
+        rows = delta["records"]
+        records = {data["location_id"]: data for data in rows}
+        order = [data["location_id"] for data in rows]
+    else:
+        if previous is None:
+            raise ValueError(f"Delta snapshot at {delta['timestamp']} has no base")
+        previous_records, previous_order = previous
+        records = dict(previous_records)
+        for location_id in delta["removed"]:
+            del records[location_id]
+        for location_id, fields in delta["changed"].items():
+            records[location_id] = {**records[location_id], **fields}
+        for data in delta["added"]:
+            records[data["location_id"]] = data
+
+        order = delta.get("order")
+        if order is None:
+            gone = set(delta["removed"])
+            order = [location_id for location_id in previous_order if location_id not in gone]
+            order.extend(data["location_id"] for data in delta["added"])
+        rows = [records[location_id] for location_id in order]
+
+    snapshot = Snapshot(records=[OverflowRecord.from_dict(data) for data in rows], **header)
+    return snapshot, records, order
+
+
+def _chain(folder: Path, source: str, until: Path) -> list[Path]:
+    """Get the delta files from the last base up to and including until."""
+    paths = sorted(p for p in folder.glob(f"{source}_*{DELTA_SUFFIX}") if p.name <= until.name)
+    for i in range(len(paths) - 1, -1, -1):
+        with open(paths[i], "r") as f:
+            # The flag is near the start; avoid decoding a whole base to find it
+            if '"base":true' in f.read(512):
+                return paths[i:]
+    return paths
+
+
+def _replay_chain(paths: list[Path]) -> tuple[Optional[Snapshot], Optional[tuple[dict[str, dict], list[str]]]]:
+    snapshot = None
+    state = None
+    for path in paths:
+        with open(path, "r") as f:
+            snapshot, records, order = apply_delta(json.load(f), state)
+        state = (records, order)
+    return snapshot, state
+
+
+def _head(folder: Path, source: str, path: Path) -> Optional[_Head]:
+    """Get the last delta snapshot saved before path, loading it if needed."""
+    head = _heads.get((str(folder), source))
+    if head is not None and head.path.name < path.name:
+        return head
+
+    earlier = sorted(p for p in folder.glob(f"{source}_*{DELTA_SUFFIX}") if p.name < path.name)
+    if not earlier:
+        return None
+    chain = _chain(folder, source, earlier[-1])
+    _, state = _replay_chain(chain)
+    records, order = state
+    return _Head(earlier[-1], records, order, len(chain) - 1)
+
+
+def save_delta_snapshot(snapshot: Snapshot, path: str) -> str:
+    """Save a snapshot as a delta against the previous one in its folder.
+
+    Args:
+        snapshot: The snapshot to save.
+        path: Where to write the delta. Its folder holds the chain.
+
+    Returns:
+        Path where the delta was saved.
+    """
+    path = Path(path)
+    folder = path.parent
+    head = _head(folder, snapshot.source, path)
+
+    base = head is None or head.since_base + 1 >= DELTA_KEYFRAME_INTERVAL
+    previous = None if head is None else (head.records, head.order)
+    delta, records, order = encode_delta(snapshot, previous, base)
+
+    commit.write_file(path, json.dumps(delta, separators=(",", ":")).encode())
+
+    since_base = 0 if delta["base"] else head.since_base + 1
+    key = (str(folder), snapshot.source)
+    _heads[key] = _Head(path, records, order, since_base)
+    # Never published: the next save reads the chain from disk
+    commit.on_abort(lambda: _heads.pop(key, None))
+    return str(path)
+
+
+def load_delta_snapshot(path: str) -> Snapshot:
+    """Rebuild a snapshot from its delta and those before it back to a base.
+
+    Args:
+        path: Path to the delta file.
+
+    Returns:
+        The snapshot exactly as it was saved.
+    """
+    path = Path(path)
+    source = path.name.split("_", 1)[0]
+    snapshot, _ = _replay_chain(_chain(path.parent, source, path))
+    return snapshot
@@ -1,8 +1,11 @@
 """Rollback detection logic for comparing NSOH snapshots."""
 
+import time
 from datetime import datetime, timezone
 from typing import Optional
 
+from . import metrics
+from .hwm import HighWaterMarks
 from .models import Snapshot, OverflowRecord, RollbackEvent, ComparisonResult
 
 
@@ -56,10 +59,51 @@ def detect_record_rollback(
     )
 
 
+def build_comparison_result(
+    detection_time: str,
+    total_locations: int,
+    rollback_events: list[RollbackEvent],
+) -> ComparisonResult:
+    """Summarise detected rollback events into a ComparisonResult.
+
+    Args:
+        detection_time: ISO timestamp of detection.
+        total_locations: Number of locations in the current snapshot.
+        rollback_events: Detected rollbacks.
+
+    Returns:
+        ComparisonResult with percentage and dataset-level classification.
+    """
+    rollbacks_detected = len(rollback_events)
+
+    rollback_percentage = 0.0
+    if total_locations > 0:
+        rollback_percentage = (rollbacks_detected / total_locations) * 100
+
+    # Dataset-level rollback if more than 50% of locations affected
+    is_dataset_level = rollback_percentage > 50
+
+    return ComparisonResult(
+        timestamp=detection_time,
+        total_locations=total_locations,
+        rollbacks_detected=rollbacks_detected,
+        rollback_percentage=round(rollback_percentage, 2),
+        is_dataset_level=is_dataset_level,
+        rollback_events=rollback_events,
+    )
+
+
+def _record_detection(result: ComparisonResult, baseline: str, start: float):
+    metrics.observe("detect_seconds", time.perf_counter() - start, baseline=baseline)
+    metrics.set_gauge("locations_checked", result.total_locations)
+    metrics.set_gauge("rollbacks_detected", result.rollbacks_detected)
+
+
 def detect_rollbacks(
     previous_nsoh: Snapshot,
     current_nsoh: Snapshot,
     current_thames: Optional[Snapshot] = None,
+    detection_time: Optional[str] = None,
 ) -> ComparisonResult:
     """Compare NSOH snapshots to detect rollbacks.
 
@@ -67,11 +111,15 @@ def detect_rollbacks(
         previous_nsoh: Previous NSOH snapshot.
         current_nsoh: Current NSOH snapshot.
         current_thames: Current Thames Water snapshot for context.
+        detection_time: ISO timestamp to record as the detection time.
+            Defaults to now.
 
     Returns:
         ComparisonResult with all detected rollbacks.
     """
-    detection_time = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    if detection_time is None:
+        detection_time = datetime.now(timezone.utc).isoformat()
     rollback_events = []
 
     # Build lookup maps
@@ -101,21 +149,97 @@ def detect_rollbacks(
         if event:
             rollback_events.append(event)
 
-    total_locations = len(current_nsoh.records)
-    rollbacks_detected = len(rollback_events)
+    result = build_comparison_result(
+        detection_time, len(current_nsoh.records), rollback_events
+    )
+    _record_detection(result, "previous", start)
+    return result
 
-    rollback_percentage = 0.0
-    if total_locations > 0:
-        rollback_percentage = (rollbacks_detected / total_locations) * 100
 
-    # Dataset-level rollback if more than 50% of locations affected
-    is_dataset_level = rollback_percentage > 50
+def detect_rollbacks_against_marks(
+    marks: HighWaterMarks,
+    current_nsoh: Snapshot,
+    current_thames: Optional[Snapshot] = None,
+    detection_time: Optional[str] = None,
+) -> ComparisonResult:
+    """Compare an NSOH snapshot against per-location high-water marks.
 
-    return ComparisonResult(
-        timestamp=detection_time,
-        total_locations=total_locations,
-        rollbacks_detected=rollbacks_detected,
-        rollback_percentage=round(rollback_percentage, 2),
-        is_dataset_level=is_dataset_level,
-        rollback_events=rollback_events,
+    A rollback occurs when the current LastUpdated is OLDER than the highest
+    LastUpdated ever observed for the location. Unlike detect_rollbacks this
+    catches multi-step regressions, and it keeps reporting a location until
+    NSOH catches up again. The "previous" fields of each event describe the
+    record at its high-water mark.
+
+    Args:
+        marks: High-water marks built from earlier snapshots.
+        current_nsoh: Current NSOH snapshot.
+        current_thames: Current Thames Water snapshot for context.
+        detection_time: ISO timestamp to record as the detection time.
+            Defaults to now.
+
+    Returns:
+        ComparisonResult with all detected rollbacks.
+    """
+    start = time.perf_counter()
+    if detection_time is None:
+        detection_time = datetime.now(timezone.utc).isoformat()
+    rollback_events = []
+
+    thames_by_id = {}
+    if current_thames:
+        thames_by_id = {r.location_id: r for r in current_thames.records}
+
+    for current_record in current_nsoh.records:
+        mark = marks.get(current_record.location_id)
+        if mark is None or mark.max_last_updated is None:
+            continue
+
+        curr_last_updated = current_record.last_updated
+        if curr_last_updated is None or curr_last_updated >= mark.max_last_updated:
+            continue
+
+        thames_record = thames_by_id.get(current_record.location_id)
+        rollback_events.append(RollbackEvent(
+            location_id=current_record.location_id,
+            detected_at=detection_time,
+            previous_status_start=mark.status_start,
+            current_status_start=current_record.status_start,
+            previous_last_updated=mark.max_last_updated,
+            current_last_updated=curr_last_updated,
+            thames_status_start=thames_record.status_start if thames_record else None,
+            status_changed=mark.status != current_record.status,
+        ))
+
+    result = build_comparison_result(
+        detection_time, len(current_nsoh.records), rollback_events
     )
+    _record_detection(result, "high_water_mark", start)
+    return result
+
+
+def count_status_start_moves(previous: Snapshot, current: Snapshot) -> tuple[int, int]:
+    """Count locations whose StatusStart changed between two snapshots.
+
+    Args:
+        previous: Earlier snapshot of a source.
+        current: Later snapshot of the same source.
+
+    Returns:
+        Tuple of (locations whose StatusStart changed, of which moved backwards).
+    """
+    previous_starts = {r.location_id: r.status_start for r in previous.records}
+
+    moved = 0
+    moved_back = 0
+    for record in current.records:
+        if record.location_id not in previous_starts:
+            continue
+        before = previous_starts[record.location_id]
+        after = record.status_start
+        if before == after:
+            continue
+        moved += 1
+        if before is not None and after is not None and after < before:
+            moved_back += 1
+
+    return moved, moved_back
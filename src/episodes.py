@@ -0,0 +1,504 @@
+"""Rollback episodes: onset, duration and recovery per location and incident.
+
+A RollbackEvent is a single pairwise observation. The EpisodeTracker links
+them: the first event for a location opens an episode, which stays open
+until NSOH's LastUpdated for that location is back at or above its value
+before the rollback. A dataset-level ComparisonResult also opens an
+incident, which recovers when the last of its episodes does.
+
+Open episodes are kept in data/latest/episodes.json. Closed episodes and
+incidents are appended to data/episodes/{episodes,incidents}.jsonl, each
+with a fixed-width .idx of (start ms, end ms, offset, length) per line, so a
+time-range query reads only the index and the matching lines.
+
+Usage: python -m src.episodes [--since ISO] [--until ISO] [--location ID] [--incidents]
+                              [--company KEY]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .config import COMPANIES, DEFAULT_COMPANY, EPISODES_DIR, LATEST_DIR, EPISODE_STATE_FILE
+from . import commit, metrics
+from .companies import data_path, get_company, use_company
+from .models import ComparisonResult, Snapshot
+
+
+# Index entry: start ms, end ms, byte offset and length of one line
+_INDEX_ENTRY = struct.Struct("<qqQQ")
+
+EPISODE_KINDS = ("episodes", "incidents")
+
+
+def _to_ms(timestamp: str) -> int:
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return int(dt.timestamp() * 1000)
+
+
+@dataclass(slots=True)
+class Episode:
+    """A stretch of time during which one location's NSOH data was rolled back."""
+
+    episode_id: int
+    location_id: str
+    onset_after: Optional[str]  # Last compared poll before the rollback
+    detected_at: str  # First poll that saw the rollback
+    baseline_last_updated: Optional[int]  # LastUpdated before the rollback (ms)
+    lowest_last_updated: Optional[int]  # Lowest LastUpdated seen while rolled back
+    max_depth_ms: int  # Largest regression below the baseline
+    max_thames_lag_ms: Optional[int]  # Largest Thames StatusStart - NSOH StatusStart
+    observations: int  # Polls at which NSOH was still behind
+    last_stale_at: str  # Last poll at which NSOH was still behind
+    recovered_at: Optional[str] = None  # First poll back at or above the baseline
+    incident_id: Optional[int] = None  # Dataset-level incident, if any
+
+    def to_dict(self) -> dict:
+        return {
+            "episode_id": self.episode_id,
+            "location_id": self.location_id,
+            "onset_after": self.onset_after,
+            "detected_at": self.detected_at,
+            "baseline_last_updated": self.baseline_last_updated,
+            "lowest_last_updated": self.lowest_last_updated,
+            "max_depth_ms": self.max_depth_ms,
+            "max_thames_lag_ms": self.max_thames_lag_ms,
+            "observations": self.observations,
+            "last_stale_at": self.last_stale_at,
+            "recovered_at": self.recovered_at,
+            "incident_id": self.incident_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Episode":
+        return cls(**data)
+
+    def duration_seconds(self, now: Optional[str] = None) -> float:
+        """Get the time from detection to recovery (or now, if still open)."""
+        end = self.recovered_at or now or datetime.now(timezone.utc).isoformat()
+        return (_to_ms(end) - _to_ms(self.detected_at)) / 1000
+
+
+@dataclass(slots=True)
+class Incident:
+    """A dataset-level rollback: more than half the locations at once."""
+
+    incident_id: int
+    onset_after: Optional[str]
+    detected_at: str
+    total_locations: int
+    peak_locations: int  # Most locations rolled back in a single poll
+    peak_percentage: float
+    episode_ids: list[int] = field(default_factory=list)
+    recovered_at: Optional[str] = None  # When its last episode recovered
+
+    def to_dict(self) -> dict:
+        return {
+            "incident_id": self.incident_id,
+            "onset_after": self.onset_after,
+            "detected_at": self.detected_at,
+            "total_locations": self.total_locations,
+            "peak_locations": self.peak_locations,
+            "peak_percentage": self.peak_percentage,
+            "episode_ids": list(self.episode_ids),
+            "recovered_at": self.recovered_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Incident":
+        return cls(**data)
+
+
+@dataclass
+class EpisodeTracker:
+    """Open episodes and incident, updated once per comparison."""
+
+    updated_at: Optional[str] = None  # Timestamp of the last result applied
+    next_episode_id: int = 1
+    next_incident_id: int = 1
+    open_episodes: dict[str, Episode] = field(default_factory=dict)
+    open_incident: Optional[Incident] = None
+
+    def update(
+        self,
+        result: ComparisonResult,
+        current_nsoh: Snapshot,
+    ) -> tuple[list[Episode], list[Incident]]:
+        """Fold a comparison result into the open episodes.
+
+        Work is proportional to the rollback events plus the open episodes;
+        while an episode is open the snapshot is scanned once, keeping only
+        the open episodes' values.
+
+        Args:
+            result: The cycle's comparison result.
+            current_nsoh: The NSOH snapshot the result was detected on.
+
+        Returns:
+            Tuple of (episodes, incidents) that recovered at this result.
+        """
+        now = result.timestamp
+
+        incident = None
+        if result.is_dataset_level:
+            incident = self.open_incident
+            if incident is None:
+                incident = Incident(
+                    incident_id=self.next_incident_id,
+                    onset_after=self.updated_at,
+                    detected_at=now,
+                    total_locations=result.total_locations,
+                    peak_locations=0,
+                    peak_percentage=0.0,
+                )
+                self.next_incident_id += 1
+                self.open_incident = incident
+            if result.rollbacks_detected > incident.peak_locations:
+                incident.peak_locations = result.rollbacks_detected
+                incident.peak_percentage = result.rollback_percentage
+
+        for event in result.rollback_events:
+            episode = self.open_episodes.get(event.location_id)
+            if episode is None:
+                episode = Episode(
+                    episode_id=self.next_episode_id,
+                    location_id=event.location_id,
+                    onset_after=self.updated_at,
+                    detected_at=now,
+                    baseline_last_updated=event.previous_last_updated,
+                    lowest_last_updated=None,
+                    max_depth_ms=0,
+                    max_thames_lag_ms=None,
+                    observations=0,
+                    last_stale_at=now,
+                    incident_id=incident.incident_id if incident else None,
+                )
+                self.next_episode_id += 1
+                self.open_episodes[event.location_id] = episode
+                if incident is not None:
+                    incident.episode_ids.append(episode.episode_id)
+
+            if event.thames_status_start is not None and event.current_status_start is not None:
+                lag = event.thames_status_start - event.current_status_start
+                if episode.max_thames_lag_ms is None or lag > episode.max_thames_lag_ms:
+                    episode.max_thames_lag_ms = lag
+
+        closed_episodes = []
+        if self.open_episodes:
+            open_ids = self.open_episodes.keys()
+            current = {
+                r.location_id: r.last_updated for r in current_nsoh.records if r.location_id in open_ids
+            }
+
+            for location_id, episode in list(self.open_episodes.items()):
+                value = current.get(location_id)
+                if value is None:
+                    # Missing from this snapshot: still unknown, keep it open
+                    continue
+
+                baseline = episode.baseline_last_updated
+                if baseline is None or value >= baseline:
+                    episode.recovered_at = now
+                    closed_episodes.append(episode)
+                    del self.open_episodes[location_id]
+                    continue
+
+                episode.observations += 1
+                episode.last_stale_at = now
+                if episode.lowest_last_updated is None or value < episode.lowest_last_updated:
+                    episode.lowest_last_updated = value
+                episode.max_depth_ms = max(episode.max_depth_ms, baseline - value)
+
+        closed_incidents = []
+        open_incident = self.open_incident
+        if open_incident is not None and not any(
+            e.incident_id == open_incident.incident_id for e in self.open_episodes.values()
+        ):
+            open_incident.recovered_at = now
+            closed_incidents.append(open_incident)
+            self.open_incident = None
+
+        self.updated_at = now
+        return closed_episodes, closed_incidents
+
+    def to_dict(self) -> dict:
+        return {
+            "updated_at": self.updated_at,
+            "next_episode_id": self.next_episode_id,
+            "next_incident_id": self.next_incident_id,
+            "open_episodes": [e.to_dict() for e in self.open_episodes.values()],
+            "open_incident": self.open_incident.to_dict() if self.open_incident else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "EpisodeTracker":
+        incident = data.get("open_incident")
+        return cls(
+            updated_at=data.get("updated_at"),
+            next_episode_id=data.get("next_episode_id", 1),
+            next_incident_id=data.get("next_incident_id", 1),
+            open_episodes={
+                e["location_id"]: Episode.from_dict(e) for e in data.get("open_episodes", [])
+            },
+            open_incident=Incident.from_dict(incident) if incident else None,
+        )
+
+
+def load_episode_tracker() -> EpisodeTracker:
+    """Load the open episodes, starting empty if none were saved."""
+    path = data_path(LATEST_DIR) / EPISODE_STATE_FILE
+    if not path.exists():
+        return EpisodeTracker()
+
+    with open(path, "r") as f:
+        return EpisodeTracker.from_dict(json.load(f))
+
+
+def save_episode_tracker(tracker: EpisodeTracker):
+    """Save the open episodes."""
+    data_path(LATEST_DIR).mkdir(parents=True, exist_ok=True)
+    path = data_path(LATEST_DIR) / EPISODE_STATE_FILE
+
+    commit.write_file(path, json.dumps(tracker.to_dict(), separators=(",", ":")).encode())
+
+
+def _store_paths(kind: str) -> tuple[Path, Path]:
+    return data_path(EPISODES_DIR) / f"{kind}.jsonl", data_path(EPISODES_DIR) / f"{kind}.idx"
+
+
+def _span_ms(record: dict) -> tuple[int, int]:
+    return _to_ms(record["detected_at"]), _to_ms(record["recovered_at"])
+
+
+def rebuild_episode_index(kind: str):
+    """Rebuild a store's index by scanning it, dropping a torn last line."""
+    log_path, index_path = _store_paths(kind)
+
+    entries = []
+    offset = 0
+    if log_path.exists():
+        with open(log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entries.append(_INDEX_ENTRY.pack(*_span_ms(json.loads(line)), offset, len(line)))
+                offset += len(line)
+        if log_path.stat().st_size != offset:
+            os.truncate(log_path, offset)
+
+    with open(index_path, "wb") as f:
+        f.write(b"".join(entries))
+
+
+def _ensure_index(kind: str):
+    log_path, index_path = _store_paths(kind)
+    log_size = log_path.stat().st_size if log_path.exists() else 0
+    index_size = index_path.stat().st_size if index_path.exists() else 0
+
+    expected_size = 0
+    if index_size and index_size % _INDEX_ENTRY.size == 0:
+        with open(index_path, "rb") as f:
+            f.seek(index_size - _INDEX_ENTRY.size)
+            _, _, offset, length = _INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size))
+            expected_size = offset + length
+
+    if index_size % _INDEX_ENTRY.size or expected_size != log_size:
+        rebuild_episode_index(kind)
+
+
+def append_closed(kind: str, records: list[dict]):
+    """Append recovered episodes or incidents to their store.
+
+    Args:
+        kind: "episodes" or "incidents".
+        records: to_dict() of each, with recovered_at set.
+    """
+    if not records:
+        return
+
+    start = time.perf_counter()
+    data_path(EPISODES_DIR).mkdir(parents=True, exist_ok=True)
+    log_path, index_path = _store_paths(kind)
+    _ensure_index(kind)
+
+    lines = [(json.dumps(record, separators=(",", ":")) + "\n").encode() for record in records]
+    offset = commit.append_file(log_path, b"".join(lines))
+    index = []
+    for record, line in zip(records, lines):
+        index.append(_INDEX_ENTRY.pack(*_span_ms(record), offset, len(line)))
+        offset += len(line)
+    commit.append_file(index_path, b"".join(index))
+
+    size = sum(map(len, lines)) + _INDEX_ENTRY.size * len(index)
+    metrics.record_write(kind, time.perf_counter() - start, size)
+
+
+def save_episodes(tracker: EpisodeTracker, episodes: list[Episode], incidents: list[Incident]):
+    """Replace the open episodes and both closed stores, e.g. after a replay.
+
+    Args:
+        tracker: Tracker holding the open episodes.
+        episodes: Every closed episode, in recovery order.
+        incidents: Every closed incident, in recovery order.
+    """
+    with commit.transaction():
+        for kind, closed in (("episodes", episodes), ("incidents", incidents)):
+            log_path, index_path = _store_paths(kind)
+            lines = []
+            index = []
+            offset = 0
+            for item in closed:
+                record = item.to_dict()
+                line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+                index.append(_INDEX_ENTRY.pack(*_span_ms(record), offset, len(line)))
+                lines.append(line)
+                offset += len(line)
+            commit.write_file(log_path, b"".join(lines))
+            commit.write_file(index_path, b"".join(index))
+        save_episode_tracker(tracker)
+
+
+def iter_closed(
+    kind: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> Iterator[dict]:
+    """Stream recovered episodes or incidents overlapping a time range.
+
+    Only the index is scanned; matching lines are read by offset.
+
+    Args:
+        kind: "episodes" or "incidents".
+        since: Range start (ISO timestamp), unbounded if None.
+        until: Range end (ISO timestamp), unbounded if None.
+
+    Yields:
+        Stored records in recovery order.
+    """
+    log_path, index_path = _store_paths(kind)
+    if not log_path.exists():
+        return
+    _ensure_index(kind)
+
+    since_ms = _to_ms(since) if since else None
+    until_ms = _to_ms(until) if until else None
+
+    with open(index_path, "rb") as index_file, open(log_path, "rb") as log_file:
+        for start_ms, end_ms, offset, length in _INDEX_ENTRY.iter_unpack(index_file.read()):
+            if since_ms is not None and end_ms < since_ms:
+                continue
+            if until_ms is not None and start_ms >= until_ms:
+                continue
+            log_file.seek(offset)
+            yield json.loads(log_file.read(length))
+
+
+def query_episodes(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    location_id: Optional[str] = None,
+) -> list[Episode]:
+    """Get every episode, recovered or still open, overlapping a time range.
+
+    Args:
+        since: Range start (ISO timestamp), unbounded if None.
+        until: Range end (ISO timestamp), unbounded if None.
+        location_id: Only this location.
+
+    Returns:
+        Episodes in detection order.
+    """
+    episodes = [Episode.from_dict(e) for e in iter_closed("episodes", since, until)]
+
+    until_ms = _to_ms(until) if until else None
+    for episode in load_episode_tracker().open_episodes.values():
+        if until_ms is None or _to_ms(episode.detected_at) < until_ms:
+            episodes.append(episode)
+
+    if location_id is not None:
+        episodes = [e for e in episodes if e.location_id == location_id]
+    return sorted(episodes, key=lambda e: (_to_ms(e.detected_at), e.episode_id))
+
+
+def stale_seconds(
+    episodes: list[Episode],
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> float:
+    """Sum the time episodes were open, clipped to a range.
+
+    Args:
+        episodes: Episodes as returned by query_episodes.
+        since: Range start (ISO timestamp), unbounded if None.
+        until: Range end (ISO timestamp), defaults to now.
+
+    Returns:
+        Location-seconds of staleness within the range.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    range_start = _to_ms(since) if since else None
+    range_end = _to_ms(until or now)
+
+    total_ms = 0
+    for episode in episodes:
+        start = _to_ms(episode.detected_at)
+        end = _to_ms(episode.recovered_at or now)
+        if range_start is not None:
+            start = max(start, range_start)
+        end = min(end, range_end)
+        total_ms += max(end - start, 0)
+
+    return total_ms / 1000
+
+
+def main() -> int:
+    """Print rollback episodes for a time range."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--since", help="range start, ISO timestamp")
+    parser.add_argument("--until", help="range end, ISO timestamp")
+    parser.add_argument("--location", help="only this location id")
+    parser.add_argument("--incidents", action="store_true", help="list dataset-level incidents")
+    parser.add_argument("--company", default=DEFAULT_COMPANY, choices=list(COMPANIES))
+    args = parser.parse_args()
+
+    with use_company(get_company(args.company)):
+        return _report(args)
+
+
+def _report(args: argparse.Namespace) -> int:
+    if args.incidents:
+        incidents = [Incident.from_dict(i) for i in iter_closed("incidents", args.since, args.until)]
+        open_incident = load_episode_tracker().open_incident
+        if open_incident is not None:
+            incidents.append(open_incident)
+        for incident in incidents:
+            print(
+                f"#{incident.incident_id}  {incident.detected_at} -> {incident.recovered_at or 'open'}  "
+                f"peak {incident.peak_locations}/{incident.total_locations} ({incident.peak_percentage}%)"
+            )
+        print(f"{len(incidents)} incident(s)")
+        return 0
+
+    episodes = query_episodes(args.since, args.until, args.location)
+    for episode in episodes:
+        print(
+            f"#{episode.episode_id}  {episode.location_id}  {episode.detected_at} -> "
+            f"{episode.recovered_at or 'open'}  {episode.duration_seconds():.0f}s  "
+            f"depth {episode.max_depth_ms / 1000:.0f}s"
+        )
+
+    locations = len({e.location_id for e in episodes})
+    total = stale_seconds(episodes, args.since, args.until)
+    print(f"{len(episodes)} episode(s) at {locations} location(s); {total:.0f} location-seconds stale")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""Shared HTTP transport for the API fetchers.
+
+Provides a pooled keep-alive session with compression, conditional GETs
+using ETag/Last-Modified validators, jittered exponential backoff, per-host
+rate limits shared by every caller, and streaming parsing of large JSON
+arrays.
+"""
+
+import json
+import random
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+from urllib.parse import urlencode, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..config import (
+    REQUEST_TIMEOUT,
+    MAX_RETRIES,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    HTTP_POOL_SIZE,
+    HTTP_STREAM_CHUNK_SIZE,
+    HTTP_RATE_LIMITS,
+)
+from .. import metrics
+from .jsonstream import iter_json_array
+
+
+T = TypeVar("T")
+
+
+class NotModified(Exception):
+    """Raised when a conditional request returns 304 Not Modified."""
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Cache key -> {"etag": ..., "last_modified": ...}, sent with conditional requests
+_validators: dict[str, dict] = {}
+# Cache key -> validators of a response received since, None if it had none.
+# Only sent once accepted, i.e. once the data they describe is saved.
+_received: dict[str, Optional[dict]] = {}
+_validators_lock = threading.Lock()
+
+_buckets: dict[str, "TokenBucket"] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Get the shared HTTP session, creating it on first use."""
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+            })
+            _session = session
+        return _session
+
+
+def close_session():
+    """Close the shared HTTP session and its pooled connections."""
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_validators(urls: Optional[Iterable[str]] = None) -> dict[str, dict]:
+    """Get a copy of the accepted conditional request validators.
+
+    Args:
+        urls: Only include requests to these URLs (any query string).
+    """
+    with _validators_lock:
+        validators = dict(_validators)
+    if urls is None:
+        return validators
+
+    return {key: validators[key] for key in _matching(validators, urls)}
+
+
+def set_validators(validators: dict[str, dict]):
+    """Replace the conditional request validators (e.g. loaded from disk)."""
+    with _validators_lock:
+        _validators.clear()
+        _validators.update(validators)
+        _received.clear()
+
+
+def update_validators(validators: dict[str, dict]):
+    """Add conditional request validators, keeping those for other URLs."""
+    with _validators_lock:
+        _validators.update(validators)
+
+
+def _matching(keys: Iterable[str], urls: Iterable[str]) -> list[str]:
+    urls = set(urls)
+    return [key for key in keys if key.split("?", 1)[0] in urls]
+
+
+def _replace_validators(validators: dict[str, Optional[dict]]) -> dict[str, Optional[dict]]:
+    """Set or (for None) remove validators, returning those they replace."""
+    replaced = {}
+    for key, value in validators.items():
+        replaced[key] = _validators.pop(key, None)
+        if value is not None:
+            _validators[key] = value
+    return replaced
+
+
+def accept_validators(urls: Iterable[str]) -> dict[str, Optional[dict]]:
+    """Start sending the validators received from some URLs.
+
+    Call once the responses they describe are saved. Until then conditional
+    requests keep sending the previous validators, so data from a cycle
+    that failed is fetched again rather than answered with 304.
+
+    Args:
+        urls: Accept responses from these URLs (any query string).
+
+    Returns:
+        The validators replaced, None where there were none, for
+        restore_validators.
+    """
+    with _validators_lock:
+        received = {key: _received.pop(key) for key in _matching(list(_received), urls)}
+        return _replace_validators(received)
+
+
+def restore_validators(replaced: dict[str, Optional[dict]]):
+    """Go back to the validators accept_validators replaced.
+
+    Args:
+        replaced: What accept_validators returned.
+    """
+    with _validators_lock:
+        _replace_validators(replaced)
+
+
+def discard_validators(urls: Iterable[str]):
+    """Forget the validators received from some URLs and not yet accepted.
+
+    Args:
+        urls: Discard responses from these URLs (any query string).
+    """
+    with _validators_lock:
+        for key in _matching(list(_received), urls):
+            del _received[key]
+
+
+class TokenBucket:
+    """Request rate limit: `rate` per second on average, up to `burst` at once."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how long to wait before using it.
+
+        Tokens may go negative; each caller waits its turn in arrival order.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(-self._tokens / self.rate, 0)
+
+
+def _throttle(host: str):
+    """Wait for the host's rate limit, if it has one."""
+    hostname = host.split(":", 1)[0]
+    limit = HTTP_RATE_LIMITS.get(hostname)
+    if limit is None:
+        return
+
+    with _buckets_lock:
+        bucket = _buckets.get(hostname)
+        if bucket is None:
+            bucket = _buckets[hostname] = TokenBucket(*limit)
+
+    delay = bucket.reserve()
+    if delay > 0:
+        metrics.observe("http_throttle_seconds", delay, host=host)
+        time.sleep(delay)
+
+
+def _cache_key(url: str, params: Optional[dict]) -> str:
+    if not params:
+        return url
+    return f"{url}?{urlencode(sorted(params.items()))}"
+
+
+def backoff_delay(attempt: int) -> float:
+    """Get the sleep before retrying, using exponential backoff with full jitter.
+
+    Args:
+        attempt: Zero-based index of the attempt that just failed.
+
+    Returns:
+        Delay in seconds.
+    """
+    ceiling = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def _request(
+    url: str,
+    params: Optional[dict],
+    conditional: bool,
+    read: Callable[[requests.Response], T],
+) -> T:
+    """GET a URL with retries and read the streamed response.
+
+    Args:
+        url: Request URL.
+        params: Query string parameters.
+        conditional: Send the accepted validators for this URL and raise
+            NotModified if the server answers 304.
+        read: Reads the response body. The whole request is retried if it
+            fails, so it must not have side effects.
+
+    Returns:
+        The result of read.
+
+    Raises:
+        NotModified: If conditional and the resource is unchanged.
+        requests.RequestException: If the request fails after retries.
+        ValueError: If the body is malformed on every attempt.
+    """
+    session = get_session()
+    key = _cache_key(url, params)
+    host = urlparse(url).netloc
+
+    headers = {}
+    if conditional:
+        with _validators_lock:
+            cached = _validators.get(key, {})
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    last_exception = None
+
+    for attempt in range(MAX_RETRIES):
+        _throttle(host)
+        start = time.perf_counter()
+        try:
+            response = session.get(
+                url,
+                params=params,
+                timeout=REQUEST_TIMEOUT,
+                headers=headers,
+                stream=True,
+            )
+            with response:
+                if response.status_code == 304:
+                    metrics.incr("http_attempts_total", host=host, outcome="not_modified")
+                    with _validators_lock:
+                        # Unchanged since the data already saved
+                        _received.pop(key, None)
+                    raise NotModified(url)
+                response.raise_for_status()
+                data = read(response)
+                # Bytes read off the wire, before decompression
+                metrics.incr("http_received_bytes_total", response.raw.tell(), host=host)
+        except (requests.RequestException, ValueError) as e:
+            metrics.incr("http_attempts_total", host=host, outcome="error")
+            last_exception = e
+            if attempt < MAX_RETRIES - 1:
+                metrics.incr("http_retries_total", host=host)
+                time.sleep(backoff_delay(attempt))
+            continue
+        finally:
+            metrics.observe("http_attempt_seconds", time.perf_counter() - start, host=host)
+
+        metrics.incr("http_attempts_total", host=host, outcome="ok")
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        with _validators_lock:
+            _received[key] = {"etag": etag, "last_modified": last_modified} if etag or last_modified else None
+
+        return data
+
+    raise last_exception
+
+
+def get_json(url: str, params: Optional[dict] = None, conditional: bool = False) -> dict:
+    """GET a JSON document with retries.
+
+    Args:
+        url: Request URL.
+        params: Query string parameters.
+        conditional: Send the validators from the previous response for this
+            URL and raise NotModified if the server answers 304.
+
+    Returns:
+        Parsed JSON response.
+
+    Raises:
+        NotModified: If conditional and the resource is unchanged.
+        requests.RequestException: If the request fails after retries.
+    """
+    host = urlparse(url).netloc
+
+    def read(response: requests.Response) -> dict:
+        content = response.content
+        metrics.incr("http_decoded_bytes_total", len(content), host=host)
+        with metrics.timer("http_parse_seconds", host=host):
+            return json.loads(content)
+
+    return _request(url, params, conditional, read)
+
+
+def get_json_items(
+    url: str,
+    key: str,
+    parse: Callable[[dict], T],
+    params: Optional[dict] = None,
+    conditional: bool = False,
+) -> list[T]:
+    """GET a JSON object and parse the elements of one array member as they arrive.
+
+    Only the parsed results and one element at a time are held in memory,
+    never the whole response body.
+
+    Args:
+        url: Request URL.
+        key: Name of the top-level array member, e.g. "features".
+        parse: Converts one element.
+        params: Query string parameters.
+        conditional: Send the validators from the previous response for this
+            URL and raise NotModified if the server answers 304.
+
+    Returns:
+        One parse result per element, in response order.
+
+    Raises:
+        NotModified: If conditional and the resource is unchanged.
+        requests.RequestException: If the request fails after retries.
+        ValueError: If the response is malformed on every attempt.
+    """
+    host = urlparse(url).netloc
+
+    def read(response: requests.Response) -> list[T]:
+        waited = 0.0
+        size = 0
+
+        def chunks() -> Iterator[bytes]:
+            nonlocal waited, size
+            stream = response.iter_content(chunk_size=HTTP_STREAM_CHUNK_SIZE)
+            while True:
+                wait_start = time.perf_counter()
+                chunk = next(stream, None)
+                waited += time.perf_counter() - wait_start
+                if chunk is None:
+                    return
+                size += len(chunk)
+                yield chunk
+
+        # Parse time is the body read minus time spent waiting on the network
+        start = time.perf_counter()
+        results = [parse(item) for item in iter_json_array(chunks(), key)]
+        metrics.observe("http_parse_seconds", time.perf_counter() - start - waited, host=host)
+        metrics.incr("http_decoded_bytes_total", size, host=host)
+        return results
+
+    return _request(url, params, conditional, read)
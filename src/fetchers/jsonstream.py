@@ -0,0 +1,134 @@
+"""Incremental parsing of large JSON arrays from a byte stream.
+
+ArcGIS and Thames Water responses are a JSON object with one large array
+member ("features" / "items"). iter_json_array yields the elements of that
+array one at a time as chunks arrive, so the full response body and its
+parsed tree are never held in memory at once.
+"""
+
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SCALAR_END = re.compile(r"[,\]} \t\n\r]")
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Text buffer over a stream of UTF-8 byte chunks."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder("utf-8")().decode
+        self._eof = False
+        self.buf = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Append the next chunk to the buffer.
+
+        Consumed text is dropped first, so positions are reset to the start
+        of the buffer.
+
+        Returns:
+            False if the stream is exhausted.
+        """
+        if self._eof:
+            return False
+
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+
+        for chunk in self._chunks:
+            text = self._decode(chunk)
+            if text:
+                self.buf += text
+                return True
+
+        self.buf += self._decode(b"", final=True)
+        self._eof = True
+        return False
+
+    def peek(self) -> str:
+        """Skip whitespace and get the next character, "" at end of input."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consume the next character, which must be one of chars."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON stream, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        if self.peek() not in '{["':
+            # A number or literal may continue in the next chunk, so wait
+            # until the delimiter after it has arrived
+            while not _SCALAR_END.search(self.buf, self.pos) and self.fill():
+                pass
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            self.pos = end
+            return value
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """Stream the elements of one array member of a top-level JSON object.
+
+    Other members are decoded and discarded. The whole document is read, so
+    malformed input anywhere raises.
+
+    Args:
+        chunks: UTF-8 encoded JSON document, in chunks of any size.
+        key: Name of the array member to stream.
+
+    Yields:
+        Each element of the array, in order. Nothing if the member is
+        missing or not an array.
+
+    Raises:
+        ValueError: If the document is not a well-formed JSON object.
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+
+    if reader.peek() == "}":
+        return
+
+    while True:
+        name = reader.value()
+        reader.expect(":")
+
+        if name == key and reader.peek() == "[":
+            reader.pos += 1
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            reader.value()
+
+        if reader.expect(",}") == "}":
+            break
+
+    if reader.peek():
+        raise ValueError("Unexpected data after JSON document")
@@ -1,6 +1,21 @@
-"""NSOH ArcGIS FeatureServer client for fetching storm overflow data."""
+"""NSOH ArcGIS FeatureServer client for fetching storm overflow data.
 
-import time
+Given the previous snapshot, fetch_nsoh_data fetches incrementally. NSOH
+re-stamps LastUpdated on every feature at each refresh, so Id and
+LastUpdated are still fetched for every feature (the stamp query). That is
+what rollback detection compares. Full attributes are fetched only for
+features whose event timestamps moved past the previous snapshot's (the
+delta query), and merged into the previous snapshot's records.
+
+A full sweep re-fetches everything:
+- every NSOH_FULL_SWEEP_INTERVAL, to pick up backwards changes the delta
+  query cannot see
+- whenever the stamps show an added or removed feature, or a LastUpdated
+  going backwards, so a rollback is recorded with its real attributes
+- whenever the delta query fails
+"""
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Optional
 
@@ -8,52 +23,92 @@ import requests
 
 from ..config import (
     NSOH_ARCGIS_URL,
-    REQUEST_TIMEOUT,
-    MAX_RETRIES,
-    RETRY_DELAY,
     ARCGIS_PAGE_SIZE,
+    NSOH_PARALLEL_FETCH,
+    NSOH_FETCH_WORKERS,
+    NSOH_OUT_FIELDS,
+    NSOH_INCREMENTAL,
+    NSOH_FULL_SWEEP_INTERVAL,
+    NSOH_DELTA_OVERLAP,
+    NSOH_DELTA_FIELDS,
+    NSOH_STAMP_FIELDS,
 )
+from .. import metrics
 from ..models import OverflowRecord, Snapshot
+from .http import get_json, get_json_items, NotModified
 
 
-def fetch_nsoh_page(offset: int = 0) -> dict:
-    """Fetch a single page of NSOH data.
+def fetch_nsoh_count(url: str = NSOH_ARCGIS_URL) -> int:
+    """Fetch the total number of features in the NSOH layer.
 
     Args:
-        offset: Record offset for pagination.
+        url: Query URL of the layer.
 
     Returns:
-        Raw JSON response from the API.
+        Feature count reported by the server.
 
     Raises:
         requests.RequestException: If the API request fails after retries.
     """
-    params = {
+    params = {"where": "1=1", "returnCountOnly": "true", "f": "json"}
+    data = get_json(url, params=params)
+    return int(data.get("count", 0))
+
+
+def _page_params(offset: int, out_fields: str = NSOH_OUT_FIELDS) -> dict:
+    return {
         "where": "1=1",
-        "outFields": "*",
+        "outFields": out_fields,
+        "returnGeometry": "false",
         "f": "json",
         "resultOffset": offset,
         "resultRecordCount": ARCGIS_PAGE_SIZE,
     }
 
-    last_exception = None
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.get(
-                NSOH_ARCGIS_URL,
-                params=params,
-                timeout=REQUEST_TIMEOUT,
-                headers={"Accept": "application/json"},
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            last_exception = e
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
+def fetch_nsoh_page(
+    offset: int = 0,
+    conditional: bool = False,
+    url: str = NSOH_ARCGIS_URL,
+) -> dict:
+    """Fetch a single page of NSOH data.
 
-    raise last_exception
+    Args:
+        offset: Record offset for pagination.
+        conditional: Raise NotModified if the page is unchanged since it
+            was last fetched.
+        url: Query URL of the layer.
+
+    Returns:
+        Raw JSON response from the API.
+
+    Raises:
+        NotModified: If conditional and the page is unchanged.
+        requests.RequestException: If the API request fails after retries.
+    """
+    return get_json(url, params=_page_params(offset), conditional=conditional)
+
+
+def _fetch_page_records(
+    url: str, offset: int, conditional: bool, out_fields: str = NSOH_OUT_FIELDS
+) -> Optional[list[Optional[OverflowRecord]]]:
+    """Fetch one page, parsing features as they stream in.
+
+    Returns:
+        One entry per feature (None where parse_feature rejected it), or
+        None if the page is unchanged.
+    """
+    try:
+        with metrics.timer("nsoh_page_seconds", offset=offset):
+            return get_json_items(
+                url,
+                "features",
+                parse_feature,
+                params=_page_params(offset, out_fields),
+                conditional=conditional,
+            )
+    except NotModified:
+        return None
 
 
 def parse_feature(feature: dict) -> Optional[OverflowRecord]:
@@ -82,37 +137,282 @@ def parse_feature(feature: dict) -> Optional[OverflowRecord]:
     )
 
 
-def fetch_nsoh_data() -> Snapshot:
-    """Fetch all current data from NSOH ArcGIS FeatureServer.
-
-    Handles pagination to retrieve all records.
+# A page is (offset, records) with one entry per feature, where records is
+# None if the page was unchanged since the previous conditional request.
+Page = tuple[int, Optional[list[Optional[OverflowRecord]]]]
 
-    Returns:
-        Snapshot containing all overflow records.
 
-    Raises:
-        requests.RequestException: If the API request fails after retries.
-    """
-    timestamp = datetime.now(timezone.utc).isoformat()
-    records = []
-    offset = 0
+def _fetch_pages_sequential(
+    url: str,
+    offset: int = 0,
+    conditional: bool = False,
+    out_fields: str = NSOH_OUT_FIELDS,
+) -> list[Page]:
+    """Fetch pages one after another until a short page is returned."""
+    pages = []
 
     while True:
-        data = fetch_nsoh_page(offset)
-        features = data.get("features", [])
+        records = _fetch_page_records(url, offset, conditional, out_fields)
+
+        if records is None:
+            # Unchanged, so it was a full page last time: keep walking
+            pages.append((offset, None))
+            offset += ARCGIS_PAGE_SIZE
+            continue
 
-        if not features:
+        if not records:
             break
 
-        for feature in features:
-            record = parse_feature(feature)
-            if record:
-                records.append(record)
+        pages.append((offset, records))
 
         # Check if there are more records
-        if len(features) < ARCGIS_PAGE_SIZE:
+        if len(records) < ARCGIS_PAGE_SIZE:
             break
 
         offset += ARCGIS_PAGE_SIZE
 
-    return Snapshot(timestamp=timestamp, source="nsoh", records=records)
+    return pages
+
+
+def _fetch_pages_parallel(
+    url: str, conditional: bool = False, out_fields: str = NSOH_OUT_FIELDS
+) -> list[Page]:
+    """Fetch every page window concurrently, returned in offset order.
+
+    The feature count is requested first so all offsets are known up front.
+    If the layer grew after the count was taken (the last page comes back
+    full), the remaining pages are walked sequentially.
+    """
+    count = fetch_nsoh_count(url)
+    offsets = list(range(0, count, ARCGIS_PAGE_SIZE))
+    pages = []
+
+    if offsets:
+        workers = min(NSOH_FETCH_WORKERS, len(offsets))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map() yields results in submission (offset) order
+            fetch_page = metrics.propagate(_fetch_page_records)
+            results = executor.map(
+                lambda offset: fetch_page(url, offset, conditional, out_fields), offsets
+            )
+            pages = [p for p in zip(offsets, results) if p[1] != []]
+
+        last_offset, last = pages[-1] if pages else (0, [])
+        # An unchanged last page still holds whatever the count says it does
+        last_size = count - last_offset if last is None else len(last)
+        if last_size < ARCGIS_PAGE_SIZE:
+            return pages
+
+    next_offset = len(offsets) * ARCGIS_PAGE_SIZE
+    return pages + _fetch_pages_sequential(url, next_offset, conditional, out_fields)
+
+
+def _fetch_layer(
+    url: str,
+    parallel: bool,
+    conditional: bool,
+    out_fields: str = NSOH_OUT_FIELDS,
+) -> list[OverflowRecord]:
+    """Fetch every feature of a layer, paginating as configured.
+
+    Raises:
+        NotModified: If conditional and every page is unchanged.
+    """
+    if parallel:
+        pages = _fetch_pages_parallel(url, conditional, out_fields)
+    else:
+        pages = _fetch_pages_sequential(url, conditional=conditional, out_fields=out_fields)
+
+    if conditional and pages and all(r is None for _, r in pages):
+        raise NotModified(url)
+
+    records = []
+    for offset, page_records in pages:
+        if page_records is None:
+            page_records = _fetch_page_records(url, offset, False, out_fields)
+        records.extend(r for r in page_records if r is not None)
+
+    return records
+
+
+def _delta_where(previous: Snapshot) -> str:
+    """Build the where clause matching features whose events moved forward.
+
+    Each field is compared against its highest value in the previous
+    snapshot, less NSOH_DELTA_OVERLAP for events that are published late.
+    """
+    attrs = {
+        "StatusStart": "status_start",
+        "LatestEventStart": "latest_event_start",
+        "LatestEventEnd": "latest_event_end",
+    }
+    clauses = []
+    for field in NSOH_DELTA_FIELDS:
+        values = [v for r in previous.records if (v := getattr(r, attrs[field])) is not None]
+        if not values:
+            continue
+        since = datetime.fromtimestamp(max(values) / 1000 - NSOH_DELTA_OVERLAP, timezone.utc)
+        clauses.append(f"{field} > TIMESTAMP '{since:%Y-%m-%d %H:%M:%S}'")
+
+    return " OR ".join(clauses) or "1=1"
+
+
+def _fetch_delta(url: str, previous: Snapshot) -> Optional[list[OverflowRecord]]:
+    """Fetch full attributes of the features that changed since a snapshot.
+
+    Returns:
+        The changed features, or None if there were too many for one page
+        or the server rejected the query.
+    """
+    params = {**_page_params(0), "where": _delta_where(previous)}
+    try:
+        data = get_json(url, params=params)
+    except (requests.RequestException, ValueError):
+        return None
+
+    # ArcGIS reports query errors in a 200 response
+    if "error" in data or data.get("exceededTransferLimit"):
+        return None
+
+    records = [parse_feature(feature) for feature in data.get("features", [])]
+    return [r for r in records if r is not None]
+
+
+def _merge(
+    previous: Snapshot,
+    stamps: list[OverflowRecord],
+    changed: list[OverflowRecord],
+) -> Optional[list[OverflowRecord]]:
+    """Apply fresh stamps and changed features to the previous records.
+
+    Returns:
+        Records in stamp order, or None if a full sweep is needed because a
+        feature was added or removed, or a LastUpdated went backwards.
+    """
+    cached = {r.location_id: r for r in previous.records}
+    if len(stamps) != len(cached):
+        return None
+
+    fresh = {r.location_id: r for r in changed}
+    records = []
+    for stamp in stamps:
+        before = cached.get(stamp.location_id)
+        if before is None:
+            # Added while another feature was removed
+            return None
+        record = fresh.get(stamp.location_id, before)
+
+        old = before.last_updated
+        if old is not None and (stamp.last_updated is None or stamp.last_updated < old):
+            return None
+
+        records.append(OverflowRecord(
+            location_id=record.location_id,
+            status=record.status,
+            status_start=record.status_start,
+            latest_event_start=record.latest_event_start,
+            latest_event_end=record.latest_event_end,
+            # All stamps come from one query, so they are mutually consistent
+            last_updated=stamp.last_updated,
+            source="nsoh",
+        ))
+
+    return records
+
+
+def _sweep_due(previous: Snapshot, timestamp: str) -> bool:
+    if previous.full_sweep_at is None:
+        return True
+    age = datetime.fromisoformat(timestamp) - datetime.fromisoformat(previous.full_sweep_at)
+    return age.total_seconds() >= NSOH_FULL_SWEEP_INTERVAL
+
+
+def _fetch_incremental(
+    url: str,
+    previous: Snapshot,
+    parallel: bool,
+    conditional: bool,
+) -> Optional[list[OverflowRecord]]:
+    """Fetch all stamps and the changed features, and merge them.
+
+    Returns:
+        The merged records, or None if a full sweep is needed.
+
+    Raises:
+        NotModified: If conditional and every stamp page is unchanged.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        delta = executor.submit(metrics.propagate(_fetch_delta), url, previous)
+        stamps = _fetch_layer(url, parallel, conditional, NSOH_STAMP_FIELDS)
+        changed = delta.result()
+
+    if changed is None:
+        metrics.incr("nsoh_full_sweeps_total", reason="delta_failed")
+        return None
+
+    records = _merge(previous, stamps, changed)
+    if records is None:
+        metrics.incr("nsoh_full_sweeps_total", reason="stamps_changed")
+        return None
+
+    metrics.set_gauge("nsoh_delta_records", len(changed))
+    return records
+
+
+def fetch_nsoh_data(
+    parallel: bool = NSOH_PARALLEL_FETCH,
+    timestamp: Optional[str] = None,
+    conditional: bool = False,
+    url: str = NSOH_ARCGIS_URL,
+    previous: Optional[Snapshot] = None,
+    incremental: bool = NSOH_INCREMENTAL,
+) -> Snapshot:
+    """Fetch all current data from an NSOH ArcGIS FeatureServer layer.
+
+    Handles pagination to retrieve all records.
+
+    Args:
+        parallel: Fetch all pages concurrently after a count query instead
+            of walking them one by one.
+        timestamp: Capture timestamp to stamp on the snapshot. Defaults to
+            the time the fetch started.
+        conditional: Raise NotModified if every page is unchanged since the
+            previous fetch. Pages that are unchanged while others changed are
+            re-requested in full.
+        url: Query URL of the layer.
+        previous: The last snapshot of this layer, to fetch incrementally
+            against.
+        incremental: Fetch incrementally when previous is given and no full
+            sweep is due.
+
+    Returns:
+        Snapshot containing all overflow records.
+
+    Raises:
+        NotModified: If conditional and the whole layer is unchanged.
+        requests.RequestException: If the API request fails after retries.
+    """
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).isoformat()
+
+    # A 304 only means "unchanged since the previous poll" if the same query
+    # was made at the previous poll
+    previous_full = previous is None or previous.full_sweep_at == previous.timestamp
+
+    records = None
+    if incremental and previous is not None:
+        if _sweep_due(previous, timestamp):
+            metrics.incr("nsoh_full_sweeps_total", reason="scheduled")
+        else:
+            records = _fetch_incremental(url, previous, parallel, conditional and not previous_full)
+            if records is not None:
+                return Snapshot(
+                    timestamp=timestamp,
+                    source="nsoh",
+                    records=records,
+                    full_sweep_at=previous.full_sweep_at,
+                )
+
+    records = _fetch_layer(url, parallel, conditional and previous_full)
+    return Snapshot(timestamp=timestamp, source="nsoh", records=records, full_sweep_at=timestamp)
+
@@ -1,30 +1,16 @@
 """Thames Water API client for fetching discharge status data."""
 
-import time
 from datetime import datetime, timezone
 from typing import Optional
 
-import requests
-
-from ..config import (
-    THAMES_WATER_API_URL,
-    THAMES_STATUS_MAP,
-    REQUEST_TIMEOUT,
-    MAX_RETRIES,
-    RETRY_DELAY,
-)
+from ..config import THAMES_WATER_API_URL, THAMES_STATUS_MAP
 from ..models import OverflowRecord, Snapshot
+from .http import get_json_items
+from .timestamps import iso_to_ms, iso_to_ms_many
 
 
-def parse_iso_timestamp(iso_string: Optional[str]) -> Optional[int]:
-    """Convert ISO 8601 timestamp to Unix milliseconds."""
-    if not iso_string:
-        return None
-    try:
-        dt = datetime.fromisoformat(iso_string.replace("Z", "+00:00"))
-        return int(dt.timestamp() * 1000)
-    except (ValueError, AttributeError):
-        return None
+# Kept for callers of the original name
+parse_iso_timestamp = iso_to_ms
 
 
 def parse_status(status_string: Optional[str]) -> int:
@@ -34,53 +20,62 @@ def parse_status(status_string: Optional[str]) -> int:
     return THAMES_STATUS_MAP.get(status_string, -1)
 
 
-def fetch_thames_water_data() -> Snapshot:
+def parse_item(item: dict) -> Optional[OverflowRecord]:
+    """Parse a Thames Water API item into an OverflowRecord.
+
+    Args:
+        item: Raw item from the API response.
+
+    Returns:
+        OverflowRecord or None if the item has no location id.
+    """
+    location_id = item.get("uniqueId", "")
+
+    if not location_id:
+        return None
+
+    status_start, event_start, event_end = iso_to_ms_many((
+        item.get("statusChanged"),
+        item.get("mostRecentDischargeAlertStart"),
+        item.get("mostRecentDischargeAlertStop"),
+    ))
+
+    return OverflowRecord(
+        location_id=location_id,
+        status=parse_status(item.get("alertStatus")),
+        status_start=status_start,
+        latest_event_start=event_start,
+        latest_event_end=event_end,
+        last_updated=status_start,  # The API has no separate update time
+        source="thames",
+    )
+
+
+def fetch_thames_water_data(
+    timestamp: Optional[str] = None,
+    conditional: bool = False,
+    url: str = THAMES_WATER_API_URL,
+) -> Snapshot:
     """Fetch current discharge status from Thames Water API.
 
+    Args:
+        timestamp: Capture timestamp to stamp on the snapshot. Defaults to
+            the time the response was received.
+        conditional: Raise NotModified if the data is unchanged since the
+            previous fetch.
+        url: API URL.
+
     Returns:
         Snapshot containing all overflow records.
 
     Raises:
+        NotModified: If conditional and the data is unchanged.
         requests.RequestException: If the API request fails after retries.
     """
-    last_exception = None
-
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.get(
-                THAMES_WATER_API_URL,
-                timeout=REQUEST_TIMEOUT,
-                headers={"Accept": "application/json"},
-            )
-            response.raise_for_status()
-            data = response.json()
-            break
-        except requests.RequestException as e:
-            last_exception = e
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
-    else:
-        raise last_exception
-
-    timestamp = datetime.now(timezone.utc).isoformat()
-    records = []
-
-    items = data.get("items", [])
-    for item in items:
-        record = OverflowRecord(
-            location_id=item.get("uniqueId", ""),
-            status=parse_status(item.get("alertStatus")),
-            status_start=parse_iso_timestamp(item.get("statusChanged")),
-            latest_event_start=parse_iso_timestamp(
-                item.get("mostRecentDischargeAlertStart")
-            ),
-            latest_event_end=parse_iso_timestamp(
-                item.get("mostRecentDischargeAlertStop")
-            ),
-            last_updated=parse_iso_timestamp(item.get("statusChanged")),
-            source="thames",
-        )
-        if record.location_id:
-            records.append(record)
+    items = get_json_items(url, "items", parse_item, conditional=conditional)
+
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).isoformat()
+    records = [record for record in items if record is not None]
 
     return Snapshot(timestamp=timestamp, source="thames", records=records)
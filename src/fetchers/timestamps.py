@@ -0,0 +1,85 @@
+"""ISO 8601 to Unix millisecond conversion for truth-API parsers.
+
+Timestamps dominate the cost of parsing a truth-API item, and the same
+strings recur from one poll to the next (most locations are unchanged), so
+conversions are memoised per string. A miss goes through
+datetime.fromisoformat, which in CPython is faster than any fixed-format
+parser written in Python.
+
+Milliseconds are computed with integer timedelta arithmetic, truncating any
+sub-millisecond digits. The float route (dt.timestamp() * 1000) is not
+guaranteed to: a product just below a whole millisecond truncates to the
+one before, which the detector would see as a 1 ms regression.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from ..config import TIMESTAMP_CACHE_SIZE
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MS = timedelta(milliseconds=1)
+
+_cache: dict[str, Optional[int]] = {}
+
+
+def _convert(iso_string: str) -> Optional[int]:
+    try:
+        dt = datetime.fromisoformat(iso_string)  # Accepts "Z" since Python 3.11
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.astimezone()  # Local time, as datetime.timestamp has it
+    return (dt - _EPOCH) // _ONE_MS
+
+
+def iso_to_ms(iso_string: Optional[str]) -> Optional[int]:
+    """Convert an ISO 8601 timestamp to Unix milliseconds.
+
+    Args:
+        iso_string: Timestamp, e.g. "2026-02-02T15:32:49Z".
+
+    Returns:
+        Milliseconds since the epoch, or None if missing or unparseable.
+    """
+    if not iso_string:
+        return None
+    try:
+        return _cache[iso_string]
+    except KeyError:
+        pass
+    except TypeError:
+        return None  # Not a string
+
+    if not isinstance(iso_string, str):
+        return None
+    ms = _convert(iso_string)
+    if len(_cache) >= TIMESTAMP_CACHE_SIZE:
+        _cache.clear()
+    _cache[iso_string] = ms
+    return ms
+
+
+def iso_to_ms_many(iso_strings: Iterable[Optional[str]]) -> list[Optional[int]]:
+    """Convert several ISO 8601 timestamps, e.g. all those of one item.
+
+    Args:
+        iso_strings: Timestamps; missing values may be None.
+
+    Returns:
+        Milliseconds since the epoch (or None) for each, in order.
+    """
+    cache = _cache
+    converted = []
+    for iso_string in iso_strings:
+        ms = cache.get(iso_string) if iso_string.__class__ is str else None
+        if ms is None:
+            ms = iso_to_ms(iso_string)
+        converted.append(ms)
+    return converted
+
+
+def clear_cache():
+    """Forget memoised conversions (e.g. after changing the local time zone)."""
+    _cache.clear()
@@ -0,0 +1,94 @@
+"""Persistent per-location high-water marks of NSOH LastUpdated.
+
+Keeps, for every location, the highest LastUpdated ever observed, when it was
+first seen, the record values at that point and the last few observed values.
+Used by detector.detect_rollbacks_against_marks as a baseline that catches
+regressions below any earlier value, not only the immediately previous one.
+"""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .models import Snapshot
+
+
+RECENT_VALUES = 5  # last_updated values kept per location
+
+
+@dataclass
+class LocationMark:
+    """High-water mark of a single location."""
+
+    max_last_updated: Optional[int]  # Unix timestamp in milliseconds
+    seen_at: Optional[str]  # Snapshot timestamp when the max was first seen
+    status: int  # Status at the high-water mark
+    status_start: Optional[int]  # StatusStart at the high-water mark
+    recent: list[int] = field(default_factory=list)  # Oldest first
+
+    def to_list(self) -> list:
+        return [self.max_last_updated, self.seen_at, self.status, self.status_start, self.recent]
+
+    @classmethod
+    def from_list(cls, data: list) -> "LocationMark":
+        max_last_updated, seen_at, status, status_start, recent = data
+        return cls(max_last_updated, seen_at, status, status_start, list(recent))
+
+
+@dataclass
+class HighWaterMarks:
+    """High-water marks for every location of an NSOH layer."""
+
+    updated_at: Optional[str] = None  # Timestamp of the last snapshot applied
+    marks: dict[str, LocationMark] = field(default_factory=dict)
+
+    def get(self, location_id: str) -> Optional[LocationMark]:
+        return self.marks.get(location_id)
+
+    def update(self, snapshot: Snapshot):
+        """Fold a new snapshot into the marks.
+
+        Args:
+            snapshot: NSOH snapshot, applied in capture order.
+        """
+        for record in snapshot.records:
+            value = record.last_updated
+            mark = self.marks.get(record.location_id)
+
+            if mark is None:
+                mark = LocationMark(None, None, record.status, record.status_start)
+                self.marks[record.location_id] = mark
+
+            if value is None:
+                continue
+
+            if mark.max_last_updated is None or value > mark.max_last_updated:
+                mark.max_last_updated = value
+                mark.seen_at = snapshot.timestamp
+                mark.status = record.status
+                mark.status_start = record.status_start
+
+            mark.recent.append(value)
+            del mark.recent[:-RECENT_VALUES]
+
+        self.updated_at = snapshot.timestamp
+
+    def to_dict(self) -> dict:
+        return {
+            "updated_at": self.updated_at,
+            "locations": {lid: m.to_list() for lid, m in self.marks.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HighWaterMarks":
+        return cls(
+            updated_at=data.get("updated_at"),
+            marks={
+                lid: LocationMark.from_list(m) for lid, m in data.get("locations", {}).items()
+            },
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "HighWaterMarks":
+        marks = cls()
+        marks.update(snapshot)
+        return marks
@@ -0,0 +1,131 @@
+"""Concurrent ingestion of a company's truth API and NSOH snapshots."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from .fetchers.thames import fetch_thames_water_data
+from .fetchers.nsoh import fetch_nsoh_data
+from . import metrics
+from .companies import Company, current_company
+from .fetchers.http import NotModified
+from .models import Snapshot
+
+
+# Truth API parsers by Company.truth_api. Each takes (timestamp, conditional,
+# url) and returns a Snapshot with source "thames", the truth source the
+# detector and storage expect.
+TRUTH_FETCHERS: dict[str, Callable[..., Snapshot]] = {
+    "thames": fetch_thames_water_data,
+}
+
+
+class FetchError(Exception):
+    """Raised when a source could not be fetched."""
+
+    def __init__(self, source: str, error: Exception, label: Optional[str] = None):
+        super().__init__(f"Failed to fetch {label or source} data: {error}")
+        self.source = source
+        self.error = error
+
+
+def source_label(source: str, company: Company) -> str:
+    """Get the display name of a source, e.g. "Thames Water" or "NSOH"."""
+    return company.name if source == "thames" else "NSOH"
+
+
+def truth_fetcher(company: Company) -> Callable[..., Snapshot]:
+    """Get the fetcher for a company's truth API.
+
+    Raises:
+        ValueError: If the company names an unknown truth API.
+    """
+    try:
+        return TRUTH_FETCHERS[company.truth_api]
+    except KeyError:
+        raise ValueError(f"{company.name}: unknown truth API {company.truth_api!r}")
+
+
+def _timed_fetch(
+    fetch: Callable[..., Snapshot], url: str, capture_time: str, conditional: bool
+) -> Optional[Snapshot]:
+    """Run a fetcher and record its start, end and latency on the snapshot.
+
+    Returns None if the source answered that nothing changed.
+    """
+    started = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+
+    try:
+        snapshot = fetch(timestamp=capture_time, conditional=conditional, url=url)
+    except NotModified:
+        return None
+
+    snapshot.fetch_duration_ms = round((time.perf_counter() - start) * 1000, 1)
+    snapshot.fetch_started = started
+    snapshot.fetch_finished = datetime.now(timezone.utc).isoformat()
+    return snapshot
+
+
+def fetch_sources(
+    conditional: bool = False,
+    company: Optional[Company] = None,
+    previous_nsoh: Optional[Snapshot] = None,
+) -> tuple[Optional[Snapshot], Optional[Snapshot]]:
+    """Fetch a company's truth API and NSOH layer concurrently.
+
+    Both snapshots are stamped with the same capture timestamp, so the
+    comparison window between them is the overlap of the two requests
+    rather than the sum of them.
+
+    Args:
+        conditional: Use conditional requests so unchanged sources are
+            reported without downloading them again.
+        company: Company to fetch; defaults to the one bound to this thread.
+        previous_nsoh: The company's last NSOH snapshot, to fetch
+            incrementally against.
+
+    Returns:
+        Tuple of (thames_snapshot, nsoh_snapshot), the first from the
+        truth API. With conditional
+        requests, a source that is unchanged since the last poll is None.
+
+    Raises:
+        FetchError: If either source fails after retries.
+        ValueError: If the company names an unknown truth API.
+    """
+    if company is None:
+        company = current_company()
+
+    capture_time = datetime.now(timezone.utc).isoformat()
+    fetchers = {
+        "thames": (truth_fetcher(company), company.truth_url),
+        "nsoh": (partial(fetch_nsoh_data, previous=previous_nsoh), company.nsoh_url),
+    }
+
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as executor:
+        timed_fetch = metrics.propagate(_timed_fetch)
+        futures = {
+            source: executor.submit(timed_fetch, fetch, url, capture_time, conditional)
+            for source, (fetch, url) in fetchers.items()
+        }
+
+        snapshots = {}
+        for source, future in futures.items():
+            try:
+                snapshots[source] = future.result()
+            except Exception as e:
+                metrics.incr("fetches_total", source=source, outcome="error")
+                raise FetchError(source, e, source_label(source, company)) from e
+
+            snapshot = snapshots[source]
+            if snapshot is None:
+                metrics.incr("fetches_total", source=source, outcome="not_modified")
+            else:
+                metrics.incr("fetches_total", source=source, outcome="ok")
+                metrics.observe("fetch_seconds", snapshot.fetch_duration_ms / 1000, source=source)
+                metrics.set_gauge("fetch_records", len(snapshot.records), source=source)
+
+    return snapshots["thames"], snapshots["nsoh"]
@@ -0,0 +1,327 @@
+"""Cross-source lag: how far NSOH trails the company's own feed.
+
+Each cycle joins the truth (Thames) snapshot with the NSOH snapshot by
+location and counts:
+
+    status_mismatches  locations whose status differs between the two
+    stale_rows         locations where NSOH's StatusStart is older than the
+                       truth API's, i.e. NSOH has not shown the latest change
+
+For every status change the truth API publishes, the ingestion lag is the
+time from the change (its StatusStart) to the first poll at which NSOH
+shows it, so it is measured to poll resolution. Changes older than
+LAG_MAX_CHANGE_AGE_MS when first seen (history, re-stamps) are not measured. Lags are folded into a per-location
+histogram with logarithmic buckets (LAG_BUCKETS_PER_DOUBLING per doubling),
+which gives p50/p95/max at any time without keeping or rescanning samples.
+
+Locations are keyed by a stable index, assigned in order of first sight
+and never reused. State is kept in data/latest/lag.json.
+
+Usage: python -m src.lag [--location ID] [--top N] [--company KEY]
+"""
+
+import argparse
+import json
+import math
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from . import commit, metrics
+from .companies import data_path, get_company, use_company
+from .config import (
+    COMPANIES,
+    DEFAULT_COMPANY,
+    LAG_BUCKETS_PER_DOUBLING,
+    LAG_MAX_CHANGE_AGE_MS,
+    LAG_STATE_FILE,
+    LATEST_DIR,
+)
+from .models import Snapshot
+
+
+def _to_ms(timestamp: str) -> int:
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return int(dt.timestamp() * 1000)
+
+
+def _bucket(ms: int) -> int:
+    """Histogram bucket of a lag: 0 below one second, then logarithmic."""
+    if ms < 1000:
+        return 0
+    return int(math.log2(ms / 1000) * LAG_BUCKETS_PER_DOUBLING) + 1
+
+
+def _bucket_upper_ms(bucket: int) -> int:
+    return math.ceil(1000 * 2 ** (bucket / LAG_BUCKETS_PER_DOUBLING))
+
+
+@dataclass(slots=True)
+class LagHistogram:
+    """Distribution of lag samples, in logarithmic buckets."""
+
+    count: int = 0
+    max_ms: int = 0
+    buckets: dict[int, int] = field(default_factory=dict)
+
+    def add(self, ms: int):
+        self.count += 1
+        self.max_ms = max(self.max_ms, ms)
+        bucket = _bucket(ms)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, q: float) -> Optional[int]:
+        """Get an upper bound on the q-quantile, in ms, or None if empty."""
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(_bucket_upper_ms(bucket), self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max_ms if self.count else None,
+        }
+
+    def to_list(self) -> list:
+        return [self.count, self.max_ms, sorted(self.buckets.items())]
+
+    @classmethod
+    def from_list(cls, data: list) -> "LagHistogram":
+        count, max_ms, buckets = data
+        return cls(count, max_ms, {bucket: n for bucket, n in buckets})
+
+
+@dataclass(slots=True)
+class LagReport:
+    """One cycle's comparison of NSOH against the truth API."""
+
+    timestamp: str
+    matched: int = 0  # Locations in both sources
+    truth_only: int = 0
+    nsoh_only: int = 0
+    status_mismatches: int = 0
+    stale_rows: int = 0
+    max_stale_ms: int = 0  # Age of the oldest change NSOH has not shown
+    caught_up: int = 0  # Changes NSOH showed for the first time this cycle
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "matched": self.matched,
+            "truth_only": self.truth_only,
+            "nsoh_only": self.nsoh_only,
+            "status_mismatches": self.status_mismatches,
+            "stale_rows": self.stale_rows,
+            "max_stale_ms": self.max_stale_ms,
+            "caught_up": self.caught_up,
+        }
+
+
+@dataclass
+class LagTracker:
+    """Per-location lag distributions, updated once per cycle."""
+
+    updated_at: Optional[str] = None
+    location_ids: list[str] = field(default_factory=list)  # Stable index -> id
+    # Per index: the truth StatusStart whose lag has been recorded, or that
+    # is not measured
+    settled: list[Optional[int]] = field(default_factory=list)
+    pending: dict[int, int] = field(default_factory=dict)  # Index -> change NSOH lacks
+    histograms: dict[int, LagHistogram] = field(default_factory=dict)  # Index -> lags
+    overall: LagHistogram = field(default_factory=LagHistogram)
+    _index: dict[str, int] = field(default_factory=dict, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._index = {location_id: i for i, location_id in enumerate(self.location_ids)}
+
+    def index_of(self, location_id: str) -> Optional[int]:
+        return self._index.get(location_id)
+
+    def _add_location(self, location_id: str) -> int:
+        i = len(self.location_ids)
+        self.location_ids.append(location_id)
+        self.settled.append(None)
+        self._index[location_id] = i
+        return i
+
+    def update(self, truth: Snapshot, nsoh: Snapshot) -> LagReport:
+        """Join a truth snapshot with an NSOH snapshot and fold in the lags.
+
+        Args:
+            truth: Current truth API (e.g. Thames) snapshot.
+            nsoh: Current NSOH snapshot.
+
+        Returns:
+            This cycle's counts.
+        """
+        now = max(truth.timestamp, nsoh.timestamp, key=_to_ms)
+        now_ms = _to_ms(now)
+        report = LagReport(timestamp=now)
+        truth_records = {r.location_id: r for r in truth.records}
+
+        for record in nsoh.records:
+            source = truth_records.get(record.location_id)
+            if source is None:
+                report.nsoh_only += 1
+                continue
+            report.matched += 1
+            if source.status != record.status:
+                report.status_mismatches += 1
+
+            i = self._index.get(record.location_id)
+            new = i is None
+            if new:
+                i = self._add_location(record.location_id)
+
+            changed_at = source.status_start
+            if changed_at is None:
+                continue
+            stale = record.status_start is None or record.status_start < changed_at
+            if stale:
+                report.stale_rows += 1
+                report.max_stale_ms = max(report.max_stale_ms, now_ms - changed_at)
+
+            if self.settled[i] == changed_at:
+                continue
+            previous = self.settled[i]
+            if self.pending.get(i) != changed_at and (
+                new
+                or (previous is not None and changed_at < previous)
+                or now_ms - changed_at > LAG_MAX_CHANGE_AGE_MS
+            ):
+                # Not a newly published change (a location seen for the
+                # first time, the truth API moving back, or history
+                # re-stamped): nothing to measure
+                self.settled[i] = changed_at
+                self.pending.pop(i, None)
+            elif stale:
+                self.pending[i] = changed_at
+            else:
+                self.settled[i] = changed_at
+                self.pending.pop(i, None)
+                lag_ms = max(now_ms - changed_at, 0)
+                histogram = self.histograms.get(i)
+                if histogram is None:
+                    histogram = self.histograms[i] = LagHistogram()
+                histogram.add(lag_ms)
+                self.overall.add(lag_ms)
+                report.caught_up += 1
+
+        report.truth_only = len(truth_records) - report.matched
+        self.updated_at = now
+
+        metrics.set_gauge("lag_status_mismatches", report.status_mismatches)
+        metrics.set_gauge("lag_stale_rows", report.stale_rows)
+        metrics.set_gauge("lag_max_stale_seconds", report.max_stale_ms / 1000)
+        metrics.incr("lag_changes_shown_total", report.caught_up)
+        return report
+
+    def location_summary(self, location_id: str) -> Optional[dict]:
+        """Get a location's lag p50/p95/max, or None if never seen."""
+        i = self._index.get(location_id)
+        if i is None:
+            return None
+        histogram = self.histograms.get(i) or LagHistogram()
+        return {"location_id": location_id, **histogram.summary()}
+
+    def to_dict(self) -> dict:
+        return {
+            "updated_at": self.updated_at,
+            "location_ids": self.location_ids,
+            "settled": self.settled,
+            "pending": {str(i): ms for i, ms in sorted(self.pending.items())},
+            "histograms": {str(i): h.to_list() for i, h in sorted(self.histograms.items())},
+            "overall": self.overall.to_list(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LagTracker":
+        return cls(
+            updated_at=data.get("updated_at"),
+            location_ids=list(data.get("location_ids", [])),
+            settled=list(data.get("settled", [])),
+            pending={int(i): ms for i, ms in data.get("pending", {}).items()},
+            histograms={
+                int(i): LagHistogram.from_list(h) for i, h in data.get("histograms", {}).items()
+            },
+            overall=LagHistogram.from_list(data["overall"]) if "overall" in data else LagHistogram(),
+        )
+
+
+def load_lag_tracker() -> LagTracker:
+    """Load the lag distributions, starting empty if none were saved."""
+    path = data_path(LATEST_DIR) / LAG_STATE_FILE
+    if not path.exists():
+        return LagTracker()
+
+    with open(path, "r") as f:
+        return LagTracker.from_dict(json.load(f))
+
+
+def save_lag_tracker(tracker: LagTracker):
+    """Save the lag distributions."""
+    data_path(LATEST_DIR).mkdir(parents=True, exist_ok=True)
+    path = data_path(LATEST_DIR) / LAG_STATE_FILE
+
+    commit.write_file(path, json.dumps(tracker.to_dict(), separators=(",", ":")).encode())
+
+
+def format_ms(ms: Optional[int]) -> str:
+    """Format a lag for display, e.g. "4m05s"."""
+    if ms is None:
+        return "-"
+    seconds = ms // 1000
+    if seconds < 60:
+        return f"{ms / 1000:.1f}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+def main() -> int:
+    """Print ingestion lag distributions."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--location", help="only this location id")
+    parser.add_argument("--top", type=int, default=20, help="locations to list, by p95 lag")
+    parser.add_argument("--company", default=DEFAULT_COMPANY, choices=list(COMPANIES))
+    args = parser.parse_args()
+
+    with use_company(get_company(args.company)):
+        tracker = load_lag_tracker()
+
+    def line(name: str, summary: dict) -> str:
+        return (
+            f"{name:<12} changes {summary['count']:>5}  p50 {format_ms(summary['p50_ms']):>7}  "
+            f"p95 {format_ms(summary['p95_ms']):>7}  max {format_ms(summary['max_ms']):>7}"
+        )
+
+    if args.location:
+        summary = tracker.location_summary(args.location)
+        if summary is None:
+            print(f"{args.location}: not seen")
+            return 1
+        print(line(args.location, summary))
+        return 0
+
+    print(f"Updated {tracker.updated_at or 'never'}, {len(tracker.location_ids)} locations")
+    print(line("all", tracker.overall.summary()))
+    ranked = sorted(
+        tracker.histograms.items(),
+        key=lambda item: (-(item[1].percentile(0.95) or 0), tracker.location_ids[item[0]]),
+    )
+    for i, histogram in ranked[: args.top]:
+        print(line(tracker.location_ids[i], histogram.summary()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,87 +1,437 @@
-"""Main entry point for the NSOH API Rollback Tracker."""
+"""Main entry point for the NSOH API Rollback Tracker.
 
+Usage: python -m src.main [--company KEY ...]
+"""
+
+import argparse
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from typing import Callable, Optional
 
-from .fetchers.thames import fetch_thames_water_data
-from .fetchers.nsoh import fetch_nsoh_data
-from .detector import detect_rollbacks
+from . import commit, metrics
+from .companies import Company, bind as bind_company, current_company, load_companies, use_company
+from .config import (
+    COMPANIES,
+    COMPANY_WORKERS,
+    CONDITIONAL_REQUESTS,
+    DETECTION_BASELINE,
+    NSOH_INCREMENTAL,
+)
+from .changes import append_changes, diff_snapshots
+from .ingest import fetch_sources, source_label, FetchError
+from .fetchers.http import (
+    accept_validators,
+    discard_validators,
+    get_validators,
+    restore_validators,
+    update_validators,
+)
+from .detector import (
+    detect_rollbacks,
+    detect_rollbacks_against_marks,
+    count_status_start_moves,
+    build_comparison_result,
+)
+from .episodes import EpisodeTracker, append_closed, load_episode_tracker, save_episode_tracker
+from .hwm import HighWaterMarks
+from .lag import LagTracker, format_ms, load_lag_tracker, save_lag_tracker
+from .models import ComparisonResult, Snapshot
+from .rollups import update_rollups
 from .storage import (
     save_snapshot,
     save_latest,
     load_latest,
     append_rollback_log,
     save_latest_comparison,
+    load_http_validators,
+    save_http_validators,
+    load_high_water_marks,
+    save_high_water_marks,
 )
 
 
-def main() -> int:
-    """Run the rollback detection cycle.
+# A deferred write; persist callbacks decide when it runs
+Write = Callable[[], None]
+
+
+@dataclass
+class CycleState:
+    """Detection baseline carried from one cycle to the next, for one company."""
+
+    company: Company = field(default_factory=current_company)
+    previous_nsoh: Optional[Snapshot] = None  # "previous" baseline only
+    marks: Optional[HighWaterMarks] = None  # "high_water_mark" baseline only
+    thames: Optional[Snapshot] = None  # Reused while Thames is unchanged
+    nsoh: Optional[Snapshot] = None  # Last NSOH snapshot, for incremental fetches
+    episodes: EpisodeTracker = field(default_factory=EpisodeTracker)
+    lag: LagTracker = field(default_factory=LagTracker)
+
+    # Outcome of the last cycle, for adaptive polling
+    last_result: Optional[ComparisonResult] = None  # None if nothing was compared
+    thames_moves: int = 0  # Locations whose Thames StatusStart changed
+    thames_moves_back: int = 0  # ... of which moved backwards
+
+    @property
+    def has_baseline(self) -> bool:
+        if DETECTION_BASELINE == "high_water_mark":
+            return self.marks is not None
+        return self.previous_nsoh is not None
+
+    def log(self, message: str = ""):
+        """Print progress, prefixed with the company when several are tracked."""
+        if len(COMPANIES) > 1:
+            message = "\n".join(f"[{self.company.key}] {line}" for line in message.split("\n"))
+        # One write per message, so concurrent cycles never split a line
+        print(message + "\n", end="")
+
+
+def load_state(company: Optional[Company] = None) -> CycleState:
+    """Load a company's detection baseline and HTTP validators from disk.
+
+    Args:
+        company: Company to load; defaults to the one bound to this thread.
 
     Returns:
-        0 if no rollbacks detected, 1 if rollbacks detected.
+        State for the first cycle.
     """
-    print(f"[{datetime.now(timezone.utc).isoformat()}] Starting rollback detection cycle...")
+    if company is None:
+        company = current_company()
 
-    # Fetch data from both APIs
-    print("Fetching Thames Water data...")
-    try:
-        thames_snapshot = fetch_thames_water_data()
-        print(f"  Retrieved {len(thames_snapshot.records)} records")
-    except Exception as e:
-        print(f"  ERROR: Failed to fetch Thames Water data: {e}")
-        return 2
+    state = CycleState(company=company)
+    with use_company(company):
+        # Finish publishing a cycle interrupted after its commit point
+        if commit.recover():
+            state.log("Finished writing an interrupted cycle.")
+
+        # The baseline is the previous NSOH snapshot, or the much smaller
+        # per-location high-water mark index. With the marks, the snapshot
+        # only seeds an incremental fetch; the first cycle with new NSOH
+        # data loads it instead, so a 304 never reads it.
+        if DETECTION_BASELINE == "high_water_mark":
+            state.marks = load_high_water_marks()
+            if NSOH_INCREMENTAL and state.marks is None:
+                state.nsoh = load_latest("nsoh")
+        else:
+            state.previous_nsoh = state.nsoh = load_latest("nsoh")
+
+        state.episodes = load_episode_tracker()
+        state.lag = load_lag_tracker()
+        update_validators(load_http_validators())
+    return state
+
+
+def _write_now(write: Write):
+    write()
+
+
+def _publish(writes: list[Write]) -> Write:
+    """Combine a cycle's writes into one that publishes them atomically."""
+    def publish():
+        with commit.transaction():
+            for write in writes:
+                write()
 
-    print("Fetching NSOH data...")
+    return publish
+
+
+def _save_snapshot_writes(snapshot: Snapshot) -> list[Write]:
+    return [lambda: save_snapshot(snapshot), lambda: save_latest(snapshot)]
+
+
+def _save_changes_writes(previous: Optional[Snapshot], current: Snapshot) -> list[Write]:
+    """Diff a new snapshot against the previous one of its source, if any."""
+    if previous is None:
+        return []
+    changes = diff_snapshots(previous, current)
+    return [lambda: append_changes(changes)]
+
+
+def _save_marks_write(marks: HighWaterMarks) -> Write:
+    # Copy, so later cycles can keep updating the marks while this is pending
+    frozen = HighWaterMarks.from_dict(marks.to_dict())
+    return lambda: save_high_water_marks(frozen)
+
+
+def _save_episodes_writes(
+    tracker: EpisodeTracker,
+    closed: tuple[list, list],
+) -> list[Write]:
+    episodes, incidents = closed
+    records = {
+        "episodes": [e.to_dict() for e in episodes],
+        "incidents": [i.to_dict() for i in incidents],
+    }
+    frozen = EpisodeTracker.from_dict(tracker.to_dict())
+    return [
+        lambda: append_closed("episodes", records["episodes"]),
+        lambda: append_closed("incidents", records["incidents"]),
+        lambda: save_episode_tracker(frozen),
+    ]
+
+
+def _update_lag(state: CycleState) -> list[Write]:
+    """Measure how far the current NSOH snapshot trails the truth API."""
+    if state.thames is None or state.nsoh is None:
+        return []
+
+    report = state.lag.update(state.thames, state.nsoh)
+    if report.stale_rows or report.status_mismatches:
+        state.log(
+            f"  NSOH behind {state.company.name}: {report.stale_rows} stale rows "
+            f"(oldest {format_ms(report.max_stale_ms)}), {report.status_mismatches} status mismatches"
+        )
+
+    frozen = LagTracker.from_dict(state.lag.to_dict())
+    return [lambda: save_lag_tracker(frozen)]
+
+
+def _save_unchanged_check_writes(state: CycleState) -> list[Write]:
+    """Record a check that found NSOH unchanged, i.e. without rollbacks.
+
+    Keeps the latest comparison and the rollups' last check moving, as a
+    full comparison of identical data would.
+    """
+    if state.nsoh is not None:
+        total = len(state.nsoh.records)
+    elif state.marks is not None:
+        total = len(state.marks.marks)
+    else:
+        return []
+
+    result = build_comparison_result(datetime.now(timezone.utc).isoformat(), total, [])
+    return [lambda: save_latest_comparison(result), lambda: update_rollups(result)]
+
+
+def _save_validators_write(company: Company) -> Write:
+    """Accept and save the validators of this cycle's responses.
+
+    Must come after the writes saving the data they describe.
+    """
+    urls = (company.truth_url, company.nsoh_url)
+
+    def write():
+        replaced = accept_validators(urls)
+        # Keep the old ones if the cycle's data is never published
+        commit.on_abort(lambda: restore_validators(replaced))
+        save_http_validators(get_validators(urls))
+
+    return write
+
+
+def run_cycle(state: CycleState, persist: Callable[[Write], None] = _write_now) -> int:
+    """Run one rollback detection cycle and record its metrics.
+
+    Args:
+        state: Baseline from the previous cycle, updated in place.
+        persist: Called once with a write that publishes everything the
+            cycle saves in one commit.transaction(). Defaults to running it
+            immediately.
+
+    Returns:
+        0 if no rollbacks detected, 1 if rollbacks detected, 2 on fetch error.
+    """
+    company = state.company
+    cycle_metrics = metrics.Registry()
+    started = datetime.now(timezone.utc)
+    start = time.perf_counter()
+
+    writes: list[Write] = []
+
+    with use_company(company), metrics.recording(cycle_metrics, company=company.key):
+        exit_code = _run_cycle(state, writes.append)
+
+        duration = time.perf_counter() - start
+        metrics.observe("cycle_seconds", duration)
+        metrics.incr("cycles_total", exit_code=exit_code)
+        metrics.set_gauge("last_cycle_exit_code", exit_code)
+        metrics.set_gauge("last_cycle_timestamp_seconds", started.timestamp())
+
+    cycle = {
+        "company": company.key,
+        "started": started.isoformat(),
+        "duration_seconds": round(duration, 6),
+        "exit_code": exit_code,
+    }
+    writes.append(lambda: metrics.save_cycle_metrics(cycle_metrics, cycle))
+
+    # Writes go to this company's files and this cycle's metrics, even when
+    # they run on another thread after the cycle ends
+    persist(metrics.bind(cycle_metrics, bind_company(company, _publish(writes)), company=company.key))
+    return exit_code
+
+
+def run_companies(states: list[CycleState], persist: Callable[[Write], None] = _write_now) -> int:
+    """Run one detection cycle for each company, up to COMPANY_WORKERS at once.
+
+    Args:
+        states: One state per company, each updated in place.
+        persist: Called with each cycle's write to disk; must be thread-safe.
+
+    Returns:
+        The highest exit code: 2 if any company's cycle failed, else 1 if
+        any detected rollbacks, else 0.
+    """
+    if len(states) == 1:
+        return run_cycle(states[0], persist)
+
+    def run(state: CycleState) -> int:
+        try:
+            return run_cycle(state, persist)
+        except Exception as e:
+            # One company's failure must not stop the others
+            state.log(f"  ERROR: cycle failed: {e}")
+            return 2
+
+    with ThreadPoolExecutor(max_workers=min(COMPANY_WORKERS, len(states))) as executor:
+        return max(executor.map(run, states))
+
+
+def _run_cycle(state: CycleState, persist: Callable[[Write], None]) -> int:
+    company = state.company
+    state.log(f"[{datetime.now(timezone.utc).isoformat()}] Starting rollback detection cycle...")
+
+    state.last_result = None
+    state.thames_moves = state.thames_moves_back = 0
+
+    # Conditional requests need saved data to fall back on when unchanged
+    has_baseline = state.has_baseline
+    conditional = CONDITIONAL_REQUESTS and has_baseline
+
+    # Fetch data from both APIs concurrently
+    state.log(f"Fetching {company.name} and NSOH data...")
     try:
-        nsoh_snapshot = fetch_nsoh_data()
-        print(f"  Retrieved {len(nsoh_snapshot.records)} records")
-    except Exception as e:
-        print(f"  ERROR: Failed to fetch NSOH data: {e}")
+        thames_snapshot, nsoh_snapshot = fetch_sources(
+            conditional=conditional, company=company, previous_nsoh=state.nsoh
+        )
+    except FetchError as e:
+        # The source that did answer is fetched again next cycle
+        discard_validators((company.truth_url, company.nsoh_url))
+        state.log(f"  ERROR: {e}")
         return 2
 
-    # Load previous NSOH snapshot for comparison
-    previous_nsoh = load_latest("nsoh")
+    for source, snapshot in (("thames", thames_snapshot), ("nsoh", nsoh_snapshot)):
+        label = source_label(source, company)
+        if snapshot is None:
+            state.log(f"  {label}: unchanged since last poll")
+        else:
+            how = "" if snapshot.full_sweep_at in (None, snapshot.timestamp) else " incrementally"
+            state.log(
+                f"  {label}: retrieved {len(snapshot.records)} records{how} "
+                f"in {snapshot.fetch_duration_ms:.0f} ms"
+            )
+
+    thames_changed = thames_snapshot is not None
+    writes: list[Write] = []
+
+    if thames_changed:
+        if state.thames is not None:
+            state.thames_moves, state.thames_moves_back = count_status_start_moves(
+                state.thames, thames_snapshot
+            )
+        previous_thames = state.thames if state.thames is not None else load_latest("thames")
+        state.thames = thames_snapshot
+        writes.extend(_save_snapshot_writes(thames_snapshot))
+        writes.extend(_save_changes_writes(previous_thames, thames_snapshot))
 
-    if previous_nsoh is None:
-        print("No previous NSOH snapshot found. Saving baseline...")
-        save_snapshot(thames_snapshot)
-        save_snapshot(nsoh_snapshot)
-        save_latest(thames_snapshot)
-        save_latest(nsoh_snapshot)
-        print("Baseline saved. Run again to detect rollbacks.")
+    if nsoh_snapshot is None:
+        # Identical NSOH data cannot contain a rollback, but may have fallen
+        # further behind a changed truth API
+        if thames_changed:
+            writes.extend(_update_lag(state))
+        writes.extend(_save_unchanged_check_writes(state))
+        writes.append(_save_validators_write(company))
+        for write in writes:
+            persist(write)
+        state.log("NSOH unchanged since last poll. No rollbacks possible.")
+        return 0
+
+    previous_nsoh = state.nsoh if state.nsoh is not None else load_latest("nsoh")
+    state.nsoh = nsoh_snapshot
+    if state.thames is None:
+        state.thames = load_latest("thames")
+    thames_snapshot = state.thames
+    writes.extend(_save_snapshot_writes(nsoh_snapshot))
+    writes.extend(_save_changes_writes(previous_nsoh, nsoh_snapshot))
+    writes.extend(_update_lag(state))
+
+    if not has_baseline:
+        state.log("No previous NSOH snapshot found. Saving baseline...")
+        if DETECTION_BASELINE == "high_water_mark":
+            state.marks = HighWaterMarks.from_snapshot(nsoh_snapshot)
+            writes.append(_save_marks_write(state.marks))
+        else:
+            state.previous_nsoh = nsoh_snapshot
+        writes.append(_save_validators_write(company))
+        for write in writes:
+            persist(write)
+        state.log("Baseline saved. Run again to detect rollbacks.")
         return 0
 
     # Detect rollbacks
-    print("Comparing snapshots...")
-    result = detect_rollbacks(
-        previous_nsoh=previous_nsoh,
-        current_nsoh=nsoh_snapshot,
-        current_thames=thames_snapshot,
-    )
+    state.log("Comparing snapshots...")
+    if state.marks is not None:
+        result = detect_rollbacks_against_marks(
+            marks=state.marks,
+            current_nsoh=nsoh_snapshot,
+            current_thames=thames_snapshot,
+        )
+        state.marks.update(nsoh_snapshot)
+        writes.append(_save_marks_write(state.marks))
+    else:
+        result = detect_rollbacks(
+            previous_nsoh=state.previous_nsoh,
+            current_nsoh=nsoh_snapshot,
+            current_thames=thames_snapshot,
+        )
+        state.previous_nsoh = nsoh_snapshot
+    state.last_result = result
+    writes.append(_save_validators_write(company))
 
-    # Save current snapshots
-    save_snapshot(thames_snapshot)
-    save_snapshot(nsoh_snapshot)
-    save_latest(thames_snapshot)
-    save_latest(nsoh_snapshot)
+    # Link this result's events into rollback episodes
+    closed = state.episodes.update(result, nsoh_snapshot)
+    writes.extend(_save_episodes_writes(state.episodes, closed))
 
     # Save comparison result
-    save_latest_comparison(result)
+    writes.append(lambda: save_latest_comparison(result))
+    writes.append(lambda: update_rollups(result))
+    if result.rollbacks_detected > 0:
+        writes.append(lambda: append_rollback_log(result))
+
+    for write in writes:
+        persist(write)
 
     if result.rollbacks_detected > 0:
-        append_rollback_log(result)
         pattern = "DATASET-LEVEL" if result.is_dataset_level else "ROW-LEVEL"
-        print(f"\n{'='*60}")
-        print(f"ROLLBACK DETECTED! ({pattern})")
-        print(f"  Affected: {result.rollbacks_detected}/{result.total_locations} locations ({result.rollback_percentage}%)")
-        print(f"  Timestamp: {result.timestamp}")
-        print(f"{'='*60}\n")
+        state.log(f"\n{'='*60}")
+        state.log(f"ROLLBACK DETECTED! ({pattern})")
+        state.log(f"  Affected: {result.rollbacks_detected}/{result.total_locations} locations ({result.rollback_percentage}%)")
+        state.log(f"  Timestamp: {result.timestamp}")
+        state.log(f"{'='*60}\n")
         return 1
     else:
-        print(f"No rollbacks detected. {result.total_locations} locations checked.")
+        state.log(f"No rollbacks detected. {result.total_locations} locations checked.")
         return 0
 
 
+def main() -> int:
+    """Run a single rollback detection cycle for each tracked company.
+
+    Returns:
+        0 if no rollbacks detected, 1 if rollbacks detected, 2 on fetch error.
+    """
+    parser = argparse.ArgumentParser(description="Run one rollback detection cycle.")
+    parser.add_argument(
+        "--company", action="append", choices=list(COMPANIES),
+        help="company to check (repeatable); defaults to all",
+    )
+    args = parser.parse_args()
+
+    states = [load_state(company) for company in load_companies(args.company)]
+    return run_companies(states)
+
+
 if __name__ == "__main__":
     sys.exit(main())
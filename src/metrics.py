@@ -0,0 +1,271 @@
+"""Structured instrumentation: counters, timings and gauges.
+
+Every measurement is recorded twice: in a process-wide registry (exposed in
+Prometheus text format by the daemon) and in the registry of the cycle the
+current thread is recording for, which main.run_cycle writes to
+data/latest/metrics.json and appends to data/metrics/YYYY-MM-DD.jsonl.
+Neither is committed with the tracked data (see .gitignore). A cycle also
+binds labels (the company) that are added to everything it records.
+
+Names follow Prometheus conventions: counters end in _total, timings are
+in seconds and end in _seconds, sizes in bytes end in _bytes.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional, TypeVar
+
+from . import commit
+from .companies import data_path
+from .config import LATEST_DIR, METRICS_DIR, METRICS_LATEST_FILE, METRICS_PREFIX
+
+
+Labels = tuple[tuple[str, str], ...]
+T = TypeVar("T")
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    """Thread-safe store of counters, timing summaries and gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.timings: dict[tuple[str, Labels], list[float]] = {}  # count, sum, min, max
+        self.gauges: dict[tuple[str, Labels], float] = {}
+
+    def incr(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, labels: Labels):
+        with self._lock:
+            summary = self.timings.get((name, labels))
+            if summary is None:
+                self.timings[(name, labels)] = [1, seconds, seconds, seconds]
+            else:
+                summary[0] += 1
+                summary[1] += seconds
+                summary[2] = min(summary[2], seconds)
+                summary[3] = max(summary[3], seconds)
+
+    def set(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            self.gauges[(name, labels)] = value
+
+    def to_dict(self) -> dict:
+        """Get every metric as JSON-serialisable lists, sorted by name."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timings = sorted((k, list(v)) for k, v in self.timings.items())
+            gauges = sorted(self.gauges.items())
+
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "timings": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "sum": round(total, 6),
+                    "min": round(low, 6),
+                    "max": round(high, 6),
+                }
+                for (name, labels), (count, total, low, high) in timings
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in gauges
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        """Render the registry in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timings = sorted((k, list(v)) for k, v in self.timings.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        declared = set()
+
+        def sample(name: str, labels: Labels, value: float, kind: str, base: Optional[str] = None):
+            family = METRICS_PREFIX + (base or name)
+            if family not in declared:
+                lines.append(f"# TYPE {family} {kind}")
+                declared.add(family)
+            rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            label_text = f"{{{rendered}}}" if rendered else ""
+            lines.append(f"{METRICS_PREFIX}{name}{label_text} {value:g}")
+
+        for (name, labels), value in counters:
+            sample(name, labels, value, "counter")
+        for (name, labels), (count, total, _, _) in timings:
+            sample(f"{name}_count", labels, count, "summary", base=name)
+            sample(f"{name}_sum", labels, total, "summary", base=name)
+        for (name, labels), value in gauges:
+            sample(name, labels, value, "gauge")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_process = Registry()
+_cycle = Registry()  # Records made outside any binding
+_bound = threading.local()
+
+
+def _targets(labels: dict) -> tuple[Labels, tuple[Registry, Registry]]:
+    registry = getattr(_bound, "registry", None) or _cycle
+    bound_labels = getattr(_bound, "labels", None)
+    if bound_labels:
+        labels = {**bound_labels, **labels}
+    return _labels(labels), (_process, registry)
+
+
+def incr(name: str, value: float = 1, **labels):
+    """Add to a counter."""
+    key, registries = _targets(labels)
+    for registry in registries:
+        registry.incr(name, value, key)
+
+
+def observe(name: str, seconds: float, **labels):
+    """Record one timing, in seconds."""
+    key, registries = _targets(labels)
+    for registry in registries:
+        registry.observe(name, seconds, key)
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Set a gauge to its current value."""
+    key, registries = _targets(labels)
+    for registry in registries:
+        registry.set(name, value, key)
+
+
+@contextmanager
+def timer(name: str, **labels) -> Iterator[None]:
+    """Time the enclosed block; failed blocks are not recorded."""
+    start = time.perf_counter()
+    yield
+    observe(name, time.perf_counter() - start, **labels)
+
+
+def record_write(kind: str, seconds: float, size: int):
+    """Record one storage write.
+
+    Args:
+        kind: What was written, e.g. "snapshot" or "rollback_log".
+        seconds: Time spent serialising and writing.
+        size: Bytes written.
+    """
+    observe("storage_write_seconds", seconds, file=kind)
+    incr("storage_written_bytes_total", size, file=kind)
+
+
+def process_registry() -> Registry:
+    """Get the registry of everything recorded since the process started."""
+    return _process
+
+
+@contextmanager
+def recording(registry: Optional[Registry], **labels) -> Iterator[None]:
+    """Record into a cycle's registry, with extra labels, for the enclosed block.
+
+    Only this thread is affected; use propagate for work handed to others.
+
+    Args:
+        registry: The cycle's registry, or None for the unbound one.
+        **labels: Added to every metric recorded, e.g. company="thames".
+    """
+    previous = getattr(_bound, "registry", None), getattr(_bound, "labels", None)
+    _bound.registry = registry
+    _bound.labels = labels
+    try:
+        yield
+    finally:
+        _bound.registry, _bound.labels = previous
+
+
+def bind(registry: Optional[Registry], func: Callable[..., T], **labels) -> Callable[..., T]:
+    """Wrap a function so that, on any thread, it records into a given cycle.
+
+    Used for writes that run after their cycle has finished, e.g. on the
+    daemon's write-behind thread.
+    """
+    def bound(*args, **kwargs) -> T:
+        with recording(registry, **labels):
+            return func(*args, **kwargs)
+
+    return bound
+
+
+def propagate(func: Callable[..., T]) -> Callable[..., T]:
+    """Wrap a function to record like the calling thread, on whichever runs it.
+
+    Used for work submitted to thread pools.
+    """
+    return bind(getattr(_bound, "registry", None), func, **(getattr(_bound, "labels", None) or {}))
+
+
+def save_cycle_metrics(registry: Registry, cycle: dict):
+    """Write a cycle's metrics to the latest file and the daily history.
+
+    Args:
+        registry: The cycle's registry.
+        cycle: Cycle-level fields (start time, duration, exit code, ...).
+            Must include "started" as an ISO timestamp.
+    """
+    record = {**cycle, **registry.to_dict()}
+    line = json.dumps(record, separators=(",", ":"))
+
+    commit.write_file(data_path(LATEST_DIR) / METRICS_LATEST_FILE, json.dumps(record, indent=2).encode())
+
+    day = datetime.fromisoformat(cycle["started"]).strftime("%Y-%m-%d")
+    commit.append_file(data_path(METRICS_DIR) / f"{day}.jsonl", (line + "\n").encode())
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the process registry at /metrics on a background thread.
+
+    Args:
+        port: TCP port; 0 picks a free one.
+        host: Interface to bind.
+
+    Returns:
+        The running server; call shutdown() to stop it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = _process.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,11 +1,16 @@
-"""Data models for the NSOH API Rollback Tracker."""
+"""Data models for the NSOH API Rollback Tracker.
 
-from dataclasses import dataclass, field, asdict
-from datetime import datetime
+Models use __slots__ and hand-written to_dict/from_dict codecs instead of
+dataclasses.asdict, which deep-copies recursively. Location ids and sources
+are interned, so the same id loaded from many snapshots is stored once.
+"""
+
+from dataclasses import dataclass, field
+from sys import intern
 from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class OverflowRecord:
     """Represents a single storm overflow location's status."""
 
@@ -18,14 +23,30 @@ class OverflowRecord:
     source: str  # "thames" or "nsoh"
 
     def to_dict(self) -> dict:
-        return asdict(self)
+        return {
+            "location_id": self.location_id,
+            "status": self.status,
+            "status_start": self.status_start,
+            "latest_event_start": self.latest_event_start,
+            "latest_event_end": self.latest_event_end,
+            "last_updated": self.last_updated,
+            "source": self.source,
+        }
 
     @classmethod
     def from_dict(cls, data: dict) -> "OverflowRecord":
-        return cls(**data)
+        return cls(
+            intern(data["location_id"]),
+            data["status"],
+            data["status_start"],
+            data["latest_event_start"],
+            data["latest_event_end"],
+            data["last_updated"],
+            intern(data["source"]),
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class RollbackEvent:
     """Represents a detected rollback for a single location."""
 
@@ -39,14 +60,32 @@ class RollbackEvent:
     status_changed: bool  # Did the status value itself change?
 
     def to_dict(self) -> dict:
-        return asdict(self)
+        return {
+            "location_id": self.location_id,
+            "detected_at": self.detected_at,
+            "previous_status_start": self.previous_status_start,
+            "current_status_start": self.current_status_start,
+            "previous_last_updated": self.previous_last_updated,
+            "current_last_updated": self.current_last_updated,
+            "thames_status_start": self.thames_status_start,
+            "status_changed": self.status_changed,
+        }
 
     @classmethod
     def from_dict(cls, data: dict) -> "RollbackEvent":
-        return cls(**data)
+        return cls(
+            intern(data["location_id"]),
+            data["detected_at"],
+            data["previous_status_start"],
+            data["current_status_start"],
+            data["previous_last_updated"],
+            data["current_last_updated"],
+            data["thames_status_start"],
+            data["status_changed"],
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class ComparisonResult:
     """Result of comparing NSOH snapshots."""
 
@@ -58,13 +97,19 @@ class ComparisonResult:
     rollback_events: list[RollbackEvent] = field(default_factory=list)
 
     def to_dict(self) -> dict:
-        result = asdict(self)
-        result["rollback_events"] = [e.to_dict() for e in self.rollback_events]
-        return result
+        return {
+            "timestamp": self.timestamp,
+            "total_locations": self.total_locations,
+            "rollbacks_detected": self.rollbacks_detected,
+            "rollback_percentage": self.rollback_percentage,
+            "is_dataset_level": self.is_dataset_level,
+            "rollback_events": [e.to_dict() for e in self.rollback_events],
+        }
 
     @classmethod
     def from_dict(cls, data: dict) -> "ComparisonResult":
-        events = [RollbackEvent.from_dict(e) for e in data.get("rollback_events", [])]
+        decode = RollbackEvent.from_dict
+        events = [decode(e) for e in data.get("rollback_events", [])]
         return cls(
             timestamp=data["timestamp"],
             total_locations=data["total_locations"],
@@ -75,28 +120,45 @@ class ComparisonResult:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Snapshot:
     """A point-in-time snapshot of API data."""
 
-    timestamp: str  # ISO 8601 timestamp
+    timestamp: str  # ISO 8601 timestamp (shared capture clock for a cycle)
     source: str  # "thames" or "nsoh"
     records: list[OverflowRecord] = field(default_factory=list)
+    fetch_started: Optional[str] = None  # ISO 8601 timestamp
+    fetch_finished: Optional[str] = None  # ISO 8601 timestamp
+    fetch_duration_ms: Optional[float] = None  # Request latency for this source
+    # NSOH: capture time of the last full fetch; later than it, the records
+    # were fetched incrementally
+    full_sweep_at: Optional[str] = None
 
     def to_dict(self) -> dict:
-        return {
+        data = {
             "timestamp": self.timestamp,
             "source": self.source,
+            "fetch_started": self.fetch_started,
+            "fetch_finished": self.fetch_finished,
+            "fetch_duration_ms": self.fetch_duration_ms,
             "records": [r.to_dict() for r in self.records],
         }
+        if self.full_sweep_at is not None:
+            data["full_sweep_at"] = self.full_sweep_at
+        return data
 
     @classmethod
     def from_dict(cls, data: dict) -> "Snapshot":
-        records = [OverflowRecord.from_dict(r) for r in data.get("records", [])]
+        decode = OverflowRecord.from_dict
+        records = [decode(r) for r in data.get("records", [])]
         return cls(
             timestamp=data["timestamp"],
-            source=data["source"],
+            source=intern(data["source"]),
             records=records,
+            fetch_started=data.get("fetch_started"),
+            fetch_finished=data.get("fetch_finished"),
+            fetch_duration_ms=data.get("fetch_duration_ms"),
+            full_sweep_at=data.get("full_sweep_at"),
         )
 
     def get_record_by_id(self, location_id: str) -> Optional[OverflowRecord]:
@@ -0,0 +1,462 @@
+"""Indexed queries over the rollback log.
+
+Three indexes sit beside data/rollbacks/rollback_log.jsonl and are
+derived from it:
+
+    rollback_log.tix             per log entry: detection time (ms), and
+                                 running totals of dataset-level entries and
+                                 location events
+    locations/<id>.idx           per location: (detection time, entry) of
+                                 each log entry that rolled the location back
+    rollback_log.locations.json  per location: number of postings and the
+                                 first and last detection time
+
+The log is in detection order, so a time range maps to a run of entries by
+binary search on the time index. The running totals give any range's
+counts from its two ends. A location's history is read from its own
+postings file, and the most rolled-back locations from the summary; only
+locations with rollbacks both inside and outside a queried range have
+their postings read. No query reads the log beyond the entries it returns.
+
+The indexes catch up with the log lazily: each query first indexes any
+entries appended since the last one. Rewriting the log (e.g. by a replay)
+drops them, and the next query rebuilds them from scratch.
+
+Usage:
+    python -m src.query results [--since ISO] [--until ISO] [--level dataset|row]
+    python -m src.query events --location ID [--since ISO] [--until ISO]
+    python -m src.query top [-n N] [--since ISO] [--until ISO]
+    python -m src.query daily [--since ISO] [--until ISO]
+
+Each takes --company KEY and prints JSON lines.
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import quote, unquote
+
+from .companies import data_path, get_company, use_company
+from .config import (
+    COMPANIES,
+    DEFAULT_COMPANY,
+    ROLLBACKS_DIR,
+    ROLLBACK_LOCATIONS_DIR,
+    ROLLBACK_LOCATION_SUMMARY_FILE,
+    ROLLBACK_TIME_INDEX_FILE,
+)
+from .models import ComparisonResult, RollbackEvent
+from .storage import count_rollback_log, iter_rollback_entries, iter_rollback_log, query_index_lock
+
+
+# Time index entry: detection ms, dataset-level entries and location events
+# up to and including this entry
+_TIME_ENTRY = struct.Struct("<qQQ")
+# Location postings entry: detection ms, log entry index
+_POSTING = struct.Struct("<qQ")
+
+LEVELS = ("dataset", "row")
+
+
+def _to_ms(timestamp: str) -> int:
+    """Convert an ISO timestamp or date to Unix ms; naive values are UTC."""
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def _time_index_path() -> Path:
+    return data_path(ROLLBACKS_DIR) / ROLLBACK_TIME_INDEX_FILE
+
+
+def _postings_path(location_id: str) -> Path:
+    return data_path(ROLLBACK_LOCATIONS_DIR) / f"{quote(location_id, safe='')}.idx"
+
+
+def _summary_path() -> Path:
+    return data_path(ROLLBACKS_DIR) / ROLLBACK_LOCATION_SUMMARY_FILE
+
+
+class _TimeIndex:
+    """Memory-mapped view of the time index, indexable by entry."""
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb") if path.exists() else None
+        size = os.fstat(self._file.fileno()).st_size if self._file else 0
+        self._len = size // _TIME_ENTRY.size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._len else None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def entry(self, n: int) -> tuple[int, int, int]:
+        return _TIME_ENTRY.unpack_from(self._map, n * _TIME_ENTRY.size)
+
+    def __getitem__(self, n: int) -> int:
+        # Detection ms, so bisect can search the index directly
+        return _TIME_ENTRY.unpack_from(self._map, n * _TIME_ENTRY.size)[0]
+
+    def totals(self, stop: int) -> tuple[int, int]:
+        """Get (dataset-level entries, location events) in entries [0, stop)."""
+        if stop <= 0:
+            return 0, 0
+        _, dataset_level, events = self.entry(stop - 1)
+        return dataset_level, events
+
+    def span(self, since: Optional[str], until: Optional[str]) -> tuple[int, int]:
+        """Get the entries [start, stop) detected in [since, until)."""
+        start = bisect.bisect_left(self, _to_ms(since)) if since else 0
+        stop = bisect.bisect_left(self, _to_ms(until)) if until else self._len
+        return start, max(start, stop)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self) -> "_TimeIndex":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_postings(location_id: str, indexed: int) -> list[tuple[int, int]]:
+    """Read a location's postings, ignoring any not yet in the time index."""
+    path = _postings_path(location_id)
+    if not path.exists():
+        return []
+
+    postings = []
+    last = -1
+    for ms, entry in _POSTING.iter_unpack(path.read_bytes()):
+        # An interrupted catch-up can leave repeated or uncommitted postings
+        if last < entry < indexed:
+            postings.append((ms, entry))
+            last = entry
+    return postings
+
+
+def _save_summary(indexed: int, summary: dict[str, list[int]]):
+    path = _summary_path()
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"indexed": indexed, "locations": summary}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _load_summary(indexed: int) -> dict[str, list[int]]:
+    """Load each location's [postings, first ms, last ms] in the first indexed entries.
+
+    The summary is rebuilt from the postings files if it does not cover
+    exactly the indexed entries, e.g. after an interrupted catch-up.
+    """
+    path = _summary_path()
+    if path.exists():
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data["indexed"] == indexed:
+            return data["locations"]
+
+    summary = {}
+    folder = data_path(ROLLBACK_LOCATIONS_DIR)
+    if folder.exists():
+        for entry in os.scandir(folder):
+            location_id = unquote(entry.name[: -len(".idx")])
+            postings = _read_postings(location_id, indexed)
+            if postings:
+                summary[location_id] = [len(postings), postings[0][0], postings[-1][0]]
+    _save_summary(indexed, summary)
+    return summary
+
+
+def _index_entries(start: int, results: Iterator[ComparisonResult], totals: tuple[int, int]):
+    """Append results, which are log entries start, start+1, ..., to the indexes."""
+    summary = _load_summary(start)
+    dataset_level, events = totals
+    time_entries = []
+    postings: dict[str, list[tuple[int, int]]] = {}
+
+    for n, result in enumerate(results, start):
+        ms = _to_ms(result.timestamp)
+        dataset_level += result.is_dataset_level
+        events += result.rollbacks_detected
+        time_entries.append(_TIME_ENTRY.pack(ms, dataset_level, events))
+        for event in result.rollback_events:
+            entries = postings.setdefault(event.location_id, [])
+            if not entries or entries[-1][1] != n:
+                entries.append((ms, n))
+
+    if not time_entries:
+        return
+
+    data_path(ROLLBACK_LOCATIONS_DIR).mkdir(parents=True, exist_ok=True)
+    for location_id, entries in postings.items():
+        with open(_postings_path(location_id), "ab") as f:
+            f.write(b"".join(_POSTING.pack(*posting) for posting in entries))
+
+    # The time index is written after the postings: its length is what
+    # counts as indexed
+    with open(_time_index_path(), "ab") as f:
+        f.write(b"".join(time_entries))
+
+    for location_id, entries in postings.items():
+        count, first_ms, _ = summary.get(location_id, (0, entries[0][0], None))
+        summary[location_id] = [count + len(entries), first_ms, entries[-1][0]]
+    _save_summary(start + len(time_entries), summary)
+
+
+def _rebuild():
+    shutil.rmtree(data_path(ROLLBACK_LOCATIONS_DIR), ignore_errors=True)
+    _time_index_path().unlink(missing_ok=True)
+    _summary_path().unlink(missing_ok=True)
+    _index_entries(0, iter_rollback_log(), (0, 0))
+
+
+def rebuild_query_index():
+    """Rebuild every index from the whole rollback log."""
+    with query_index_lock():
+        _rebuild()
+
+
+def ensure_query_index() -> int:
+    """Index any log entries that are not indexed yet.
+
+    Returns:
+        Number of log entries, all of them indexed.
+    """
+    total = count_rollback_log()
+
+    with query_index_lock():
+        path = _time_index_path()
+        with _TimeIndex(path) as index:
+            indexed = len(index)
+            totals = index.totals(indexed)
+            last_ms = index[indexed - 1] if indexed else None
+
+        # A rewritten log no longer matches the last indexed entry, and a
+        # torn write leaves a partial entry at the end of the time index
+        stale = (
+            indexed > total
+            or (path.exists() and path.stat().st_size % _TIME_ENTRY.size)
+            or (indexed and _to_ms(next(iter_rollback_entries([indexed - 1]))[1].timestamp) != last_ms)
+        )
+        if stale:
+            _rebuild()
+        elif indexed < total:
+            _index_entries(indexed, iter_rollback_log(indexed), totals)
+
+    return total
+
+
+def iter_results(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    level: Optional[str] = None,
+) -> Iterator[ComparisonResult]:
+    """Stream logged comparison results detected in a time range.
+
+    Args:
+        since: Range start (ISO timestamp or date, inclusive), unbounded if None.
+        until: Range end (exclusive), unbounded if None.
+        level: "dataset" or "row" to return only that kind of rollback.
+
+    Yields:
+        ComparisonResults, oldest first.
+    """
+    ensure_query_index()
+
+    with _TimeIndex(_time_index_path()) as index:
+        start, stop = index.span(since, until)
+        if level is None:
+            numbers = range(start, stop)
+        else:
+            # Per-entry level from consecutive running totals
+            want = level == "dataset"
+            previous = index.totals(start)[0]
+            numbers = []
+            for n in range(start, stop):
+                current = index.entry(n)[1]
+                if (current > previous) == want:
+                    numbers.append(n)
+                previous = current
+
+    for _, result in iter_rollback_entries(numbers):
+        yield result
+
+
+def iter_location_events(
+    location_id: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> Iterator[tuple[ComparisonResult, RollbackEvent]]:
+    """Stream one location's rollback events in a time range.
+
+    Args:
+        location_id: Location to look up.
+        since: Range start (ISO timestamp or date, inclusive), unbounded if None.
+        until: Range end (exclusive), unbounded if None.
+
+    Yields:
+        (result, event) for each logged result that rolled the location
+        back, oldest first.
+    """
+    indexed = ensure_query_index()
+    postings = _read_postings(location_id, indexed)
+
+    times = [ms for ms, _ in postings]
+    start = bisect.bisect_left(times, _to_ms(since)) if since else 0
+    stop = bisect.bisect_left(times, _to_ms(until)) if until else len(times)
+
+    for _, result in iter_rollback_entries(entry for _, entry in postings[start:stop]):
+        for event in result.rollback_events:
+            if event.location_id == location_id:
+                yield result, event
+
+
+def top_locations(
+    n: int = 10,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> list[tuple[str, int]]:
+    """Get the locations rolled back in the most log entries.
+
+    Args:
+        n: Number of locations.
+        since: Range start (ISO timestamp or date, inclusive), unbounded if None.
+        until: Range end (exclusive), unbounded if None.
+
+    Returns:
+        (location_id, rollbacks), most first, ties by location id.
+    """
+    indexed = ensure_query_index()
+    since_ms = _to_ms(since) if since else None
+    until_ms = _to_ms(until) if until else None
+
+    counts = []
+    for location_id, (count, first_ms, last_ms) in _load_summary(indexed).items():
+        if (since_ms is not None and last_ms < since_ms) or (until_ms is not None and first_ms >= until_ms):
+            continue
+        if (since_ms is not None and first_ms < since_ms) or (until_ms is not None and last_ms >= until_ms):
+            # Rolled back both inside and outside the range
+            times = [ms for ms, _ in _read_postings(location_id, indexed)]
+            start = bisect.bisect_left(times, since_ms) if since_ms is not None else 0
+            stop = bisect.bisect_left(times, until_ms) if until_ms is not None else len(times)
+            count = max(stop - start, 0)
+        if count:
+            counts.append((location_id, count))
+
+    counts.sort(key=lambda item: (-item[1], item[0]))
+    return counts[:n]
+
+
+def daily_rates(since: Optional[str] = None, until: Optional[str] = None) -> list[dict]:
+    """Count logged rollbacks per UTC day.
+
+    Each day costs two binary searches of the time index, whatever the
+    number of entries in it.
+
+    Args:
+        since: First day (ISO timestamp or date), defaults to the first entry.
+        until: Range end (exclusive), defaults to after the last entry.
+
+    Returns:
+        One dict per day with rollbacks, dataset_level, row_level and
+        location_events, oldest first. Days without rollbacks are included.
+    """
+    ensure_query_index()
+
+    with _TimeIndex(_time_index_path()) as index:
+        if len(index) == 0:
+            return []
+
+        first_ms = _to_ms(since) if since else index[0]
+        end_ms = _to_ms(until) if until else index[len(index) - 1] + 1
+        day = datetime.fromtimestamp(first_ms / 1000, timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+        days = []
+        while int(day.timestamp() * 1000) < end_ms:
+            next_day = day + timedelta(days=1)
+            start = bisect.bisect_left(index, max(int(day.timestamp() * 1000), first_ms))
+            stop = bisect.bisect_left(index, min(int(next_day.timestamp() * 1000), end_ms))
+            dataset_start, events_start = index.totals(start)
+            dataset_stop, events_stop = index.totals(stop)
+            rollbacks = stop - start
+            days.append({
+                "day": day.strftime("%Y-%m-%d"),
+                "rollbacks": rollbacks,
+                "dataset_level": dataset_stop - dataset_start,
+                "row_level": rollbacks - (dataset_stop - dataset_start),
+                "location_events": events_stop - events_start,
+            })
+            day = next_day
+
+    return days
+
+
+def _print_line(data: dict):
+    print(json.dumps(data, separators=(",", ":")))
+
+
+def main() -> int:
+    """Run a rollback query and print JSON lines."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--company", default=DEFAULT_COMPANY, choices=list(COMPANIES))
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the indexes first")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_range(command: argparse.ArgumentParser):
+        command.add_argument("--since", help="range start, ISO timestamp or date")
+        command.add_argument("--until", help="range end (exclusive), ISO timestamp or date")
+
+    results = commands.add_parser("results", help="logged comparison results")
+    add_range(results)
+    results.add_argument("--level", choices=LEVELS, help="only dataset- or row-level rollbacks")
+
+    events = commands.add_parser("events", help="rollback events for one location")
+    add_range(events)
+    events.add_argument("--location", required=True, help="location id")
+
+    top = commands.add_parser("top", help="most rolled-back locations")
+    add_range(top)
+    top.add_argument("-n", type=int, default=10, help="number of locations")
+
+    daily = commands.add_parser("daily", help="rollbacks per day")
+    add_range(daily)
+
+    args = parser.parse_args()
+
+    with use_company(get_company(args.company)):
+        if args.rebuild:
+            rebuild_query_index()
+
+        if args.command == "results":
+            for result in iter_results(args.since, args.until, args.level):
+                _print_line(result.to_dict())
+        elif args.command == "events":
+            for result, event in iter_location_events(args.location, args.since, args.until):
+                _print_line({**event.to_dict(), "is_dataset_level": result.is_dataset_level})
+        elif args.command == "top":
+            for location_id, count in top_locations(args.n, args.since, args.until):
+                _print_line({"location_id": location_id, "rollbacks": count})
+        else:
+            for day in daily_rates(args.since, args.until):
+                _print_line(day)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
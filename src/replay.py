@@ -0,0 +1,275 @@
+"""Historical backfill: re-run rollback detection over data/snapshots.
+
+Streams every NSOH snapshot in capture order, pairs it with the nearest
+Thames snapshot of the same day, and runs detection on each consecutive
+pair. Only two NSOH snapshots are resident at a time. Day folders can be
+replayed in parallel; the pair spanning each day boundary is detected
+afterwards so the stitched result matches a single sequential pass.
+
+Everything derived from the rollback log is rebuilt with it: the rollups,
+the query indexes, and the rollback episodes and incidents. Episodes link
+results across days, so they take a second, sequential pass.
+
+Usage: python -m src.replay [--workers N] [--dry-run] [--company KEY]
+"""
+
+import argparse
+import bisect
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .archive import archive_path, list_archived, list_archived_days
+from .batch_detector import detect_history
+from .companies import data_path, get_company, use_company
+from .config import COMPANIES, DEFAULT_COMPANY, SNAPSHOTS_DIR
+from .episodes import Episode, EpisodeTracker, Incident, save_episodes
+from .models import ComparisonResult, Snapshot
+from .query import rebuild_query_index
+from .rollups import rebuild_rollups
+from .storage import load_snapshot, save_rollback_log
+
+
+# Snapshot file names for every backend, e.g. nsoh_09-05-14.json,
+# nsoh_09-05-14.manifest.json, nsoh_09-05-14.col or nsoh_09-05-14.delta.json
+SNAPSHOT_NAME = re.compile(
+    r"^(?P<source>[a-z]+)_(?P<time>\d\d-\d\d-\d\d)(\.manifest\.json|\.delta\.json|\.json|\.col)$"
+)
+
+
+@dataclass
+class DayReplay:
+    """Rollbacks found within one day folder, plus its boundary snapshots."""
+
+    day: str
+    results: list[ComparisonResult]
+    pairs: int
+    first: Optional[tuple[str, Optional[str]]]  # (nsoh path, thames path)
+    last: Optional[tuple[str, Optional[str]]]
+
+
+def _snapshots_dir(snapshots_dir: Optional[str]) -> str:
+    """Get the given snapshots directory, or the current company's."""
+    return str(data_path(SNAPSHOTS_DIR)) if snapshots_dir is None else snapshots_dir
+
+
+def list_days(snapshots_dir: Optional[str] = None) -> list[str]:
+    """List the days under the snapshots directory, as folders or archives, oldest first.
+
+    Args:
+        snapshots_dir: Root snapshots directory; defaults to the current company's.
+    """
+    snapshots_dir = _snapshots_dir(snapshots_dir)
+    root = Path(snapshots_dir)
+    if not root.exists():
+        return []
+    folders = {p.name for p in root.iterdir() if p.is_dir()}
+    return sorted(folders.union(list_archived_days(snapshots_dir)))
+
+
+def list_snapshot_paths(day: str, source: str, snapshots_dir: Optional[str] = None) -> list[tuple[str, str]]:
+    """List the snapshots of one source in a day folder, in capture order.
+
+    Args:
+        day: Day folder name (YYYY-MM-DD).
+        source: "thames" or "nsoh".
+        snapshots_dir: Root snapshots directory; defaults to the current company's.
+
+    Returns:
+        List of (HH-MM-SS, path). If a capture exists in several formats,
+        only the first by name is kept. A day without a folder is listed
+        from its archive.
+    """
+    snapshots_dir = _snapshots_dir(snapshots_dir)
+    folder = Path(snapshots_dir) / day
+    if not folder.is_dir():
+        return list_archived(archive_path(snapshots_dir, day), source)
+
+    found = {}
+    for path in sorted((Path(snapshots_dir) / day).iterdir()):
+        match = SNAPSHOT_NAME.match(path.name)
+        if match and match["source"] == source:
+            found.setdefault(match["time"], str(path))
+    return sorted(found.items())
+
+
+def _nearest(times: list[str], paths: list[str], time: str) -> Optional[str]:
+    """Get the path whose HH-MM-SS is nearest to the given time."""
+    if not times:
+        return None
+
+    def seconds(t: str) -> int:
+        h, m, s = t.split("-")
+        return int(h) * 3600 + int(m) * 60 + int(s)
+
+    i = bisect.bisect_left(times, time)
+    candidates = [j for j in (i - 1, i) if 0 <= j < len(times)]
+    best = min(candidates, key=lambda j: abs(seconds(times[j]) - seconds(time)))
+    return paths[best]
+
+
+def pair_day(day: str, snapshots_dir: Optional[str] = None) -> list[tuple[str, Optional[str]]]:
+    """Pair each NSOH snapshot of a day with its nearest Thames snapshot.
+
+    Returns:
+        List of (nsoh path, thames path or None) in capture order.
+    """
+    snapshots_dir = _snapshots_dir(snapshots_dir)
+    nsoh = list_snapshot_paths(day, "nsoh", snapshots_dir)
+    thames = list_snapshot_paths(day, "thames", snapshots_dir)
+    thames_times = [t for t, _ in thames]
+    thames_paths = [p for _, p in thames]
+
+    return [(path, _nearest(thames_times, thames_paths, time)) for time, path in nsoh]
+
+
+def _load_pairs(pairs: list[tuple[str, Optional[str]]]) -> Iterator[tuple[Snapshot, Optional[Snapshot]]]:
+    """Lazily load (nsoh, thames) snapshot pairs."""
+    for nsoh_path, thames_path in pairs:
+        thames = load_snapshot(thames_path) if thames_path else None
+        yield load_snapshot(nsoh_path), thames
+
+
+def replay_pairs(pairs: list[tuple[str, Optional[str]]]) -> Iterator[ComparisonResult]:
+    """Run detection over consecutive NSOH snapshots, streaming from disk.
+
+    Args:
+        pairs: (nsoh path, thames path) in capture order.
+
+    Yields:
+        One ComparisonResult per consecutive pair. Its timestamp is the
+        capture time of the later snapshot.
+    """
+    yield from detect_history(_load_pairs(pairs))
+
+
+def replay_day(day: str, snapshots_dir: Optional[str] = None) -> DayReplay:
+    """Replay one day folder.
+
+    Returns:
+        The rollbacks within the day and its first/last pairs for stitching.
+    """
+    pairs = pair_day(day, snapshots_dir)
+    results = [r for r in replay_pairs(pairs) if r.rollbacks_detected > 0]
+
+    return DayReplay(
+        day=day,
+        results=results,
+        pairs=max(len(pairs) - 1, 0),
+        first=pairs[0] if pairs else None,
+        last=pairs[-1] if pairs else None,
+    )
+
+
+def replay(
+    snapshots_dir: Optional[str] = None,
+    workers: int = 1,
+) -> tuple[list[ComparisonResult], int]:
+    """Replay rollback detection over the whole snapshot history.
+
+    Args:
+        snapshots_dir: Root snapshots directory; defaults to the current company's.
+        workers: Number of processes; day folders are replayed in parallel.
+
+    Returns:
+        Tuple of (results with rollbacks in capture order, pairs compared).
+    """
+    # Worker processes have no company bound
+    snapshots_dir = _snapshots_dir(snapshots_dir)
+    days = list_days(snapshots_dir)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            day_replays = list(executor.map(replay_day, days, [snapshots_dir] * len(days)))
+    else:
+        day_replays = [replay_day(day, snapshots_dir) for day in days]
+
+    results = []
+    pairs = 0
+    previous_last = None
+
+    for day_replay in day_replays:
+        if day_replay.first is None:
+            continue
+
+        # Stitch the pair spanning the boundary with the previous day
+        if previous_last is not None:
+            boundary = list(replay_pairs([previous_last, day_replay.first]))
+            results.extend(r for r in boundary if r.rollbacks_detected > 0)
+            pairs += 1
+
+        results.extend(day_replay.results)
+        pairs += day_replay.pairs
+        previous_last = day_replay.last
+
+    return results, pairs
+
+
+def replay_episodes(
+    snapshots_dir: Optional[str] = None,
+) -> tuple[EpisodeTracker, list[Episode], list[Incident]]:
+    """Link the rollbacks over the whole snapshot history into episodes.
+
+    Every comparison is folded into one tracker in capture order, as the
+    live cycle does, so this pass is sequential.
+
+    Args:
+        snapshots_dir: Root snapshots directory; defaults to the current company's.
+
+    Returns:
+        Tuple of (tracker holding the open episodes, closed episodes,
+        closed incidents), in recovery order.
+    """
+    snapshots_dir = _snapshots_dir(snapshots_dir)
+    pairs = [pair for day in list_days(snapshots_dir) for pair in pair_day(day, snapshots_dir)]
+
+    # detect_history yields each result right after reading its snapshot
+    current: list[Snapshot] = []
+
+    def loaded() -> Iterator[tuple[Snapshot, Optional[Snapshot]]]:
+        for nsoh, thames in _load_pairs(pairs):
+            current[:] = [nsoh]
+            yield nsoh, thames
+
+    tracker = EpisodeTracker()
+    episodes: list[Episode] = []
+    incidents: list[Incident] = []
+    for result in detect_history(loaded()):
+        closed_episodes, closed_incidents = tracker.update(result, current[0])
+        episodes.extend(closed_episodes)
+        incidents.extend(closed_incidents)
+    return tracker, episodes, incidents
+
+
+def main() -> int:
+    """Rebuild the rollback log, and what is derived from it, from the snapshot history."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=1, help="parallel day workers")
+    parser.add_argument("--dry-run", action="store_true", help="don't rewrite the rollback log")
+    parser.add_argument("--company", default=DEFAULT_COMPANY, choices=list(COMPANIES))
+    args = parser.parse_args()
+
+    with use_company(get_company(args.company)):
+        results, pairs = replay(workers=args.workers)
+        dataset_level = sum(1 for r in results if r.is_dataset_level)
+
+        print(f"Compared {pairs} snapshot pairs.")
+        print(f"  Rollbacks: {len(results)} ({dataset_level} dataset-level, {len(results) - dataset_level} row-level)")
+
+        if not args.dry_run:
+            save_rollback_log(results)
+            rebuild_rollups(results)
+            rebuild_query_index()
+            tracker, episodes, incidents = replay_episodes()
+            save_episodes(tracker, episodes, incidents)
+            print(f"  Episodes: {len(episodes)} recovered, {len(tracker.open_episodes)} open; {len(incidents)} incidents")
+            print("Rollback log, rollups, query indexes and episodes rebuilt.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
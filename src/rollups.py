@@ -0,0 +1,181 @@
+"""Pre-aggregated rollback rollups for the dashboard.
+
+Each cycle's ComparisonResult is folded into a few small files under
+data/rollups/, so the dashboard never has to download the whole rollback log:
+
+    summary.json    totals by dataset- vs row-level, last check and rollback
+    hourly.json     per-hour counts (last ROLLUP_HOURLY_DAYS days)
+    daily.json      per-day counts
+    locations.json  per-location rollback frequency
+    recent.json     the last ROLLUP_RECENT_ENTRIES log entries, newest first,
+                    each with at most ROLLUP_EVENTS_PER_ENTRY events
+    index.json      content hash and size of each file above
+
+Updates are incremental: only the rollups themselves are read, never the log.
+"""
+
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from .config import (
+    ROLLUPS_DIR,
+    ROLLUP_RECENT_ENTRIES,
+    ROLLUP_EVENTS_PER_ENTRY,
+    ROLLUP_HOURLY_DAYS,
+)
+from . import commit, metrics
+from .companies import data_path
+from .models import ComparisonResult
+
+
+ROLLUP_FILES = ("summary", "hourly", "daily", "locations", "recent")
+INDEX_FILE = "index.json"
+
+
+def _empty_rollups() -> dict[str, dict]:
+    return {
+        "summary": {
+            "total_rollbacks": 0,
+            "dataset_level": 0,
+            "row_level": 0,
+            "location_events": 0,
+            "last_check": None,
+            "last_rollback": None,
+        },
+        "hourly": {"buckets": {}},
+        "daily": {"buckets": {}},
+        "locations": {"locations": {}},
+        "recent": {"entries": []},
+    }
+
+
+def load_rollups() -> dict[str, dict]:
+    """Load the current rollups, starting empty for any missing file."""
+    rollups = _empty_rollups()
+
+    for name in ROLLUP_FILES:
+        path = data_path(ROLLUPS_DIR) / f"{name}.json"
+        if path.exists():
+            with open(path, "r") as f:
+                rollups[name] = json.load(f)
+
+    return rollups
+
+
+def _add_to_bucket(buckets: dict, key: str, result: ComparisonResult):
+    bucket = buckets.setdefault(
+        key, {"rollbacks": 0, "dataset_level": 0, "row_level": 0, "location_events": 0}
+    )
+    bucket["rollbacks"] += 1
+    bucket["dataset_level" if result.is_dataset_level else "row_level"] += 1
+    bucket["location_events"] += result.rollbacks_detected
+
+
+def apply_result(rollups: dict[str, dict], result: ComparisonResult):
+    """Fold one comparison result into the rollups in place.
+
+    Args:
+        rollups: Rollups as returned by load_rollups.
+        result: The cycle's comparison result.
+    """
+    summary = rollups["summary"]
+    summary["last_check"] = result.timestamp
+
+    if result.rollbacks_detected == 0:
+        return
+
+    summary["total_rollbacks"] += 1
+    summary["dataset_level" if result.is_dataset_level else "row_level"] += 1
+    summary["location_events"] += result.rollbacks_detected
+    summary["last_rollback"] = result.timestamp
+
+    detected = datetime.fromisoformat(result.timestamp.replace("Z", "+00:00"))
+    hourly = rollups["hourly"]["buckets"]
+    _add_to_bucket(hourly, detected.strftime("%Y-%m-%dT%H:00"), result)
+    _add_to_bucket(rollups["daily"]["buckets"], detected.strftime("%Y-%m-%d"), result)
+
+    # Keep a bounded window of hourly buckets
+    cutoff = (detected - timedelta(days=ROLLUP_HOURLY_DAYS)).strftime("%Y-%m-%dT%H:00")
+    for key in [k for k in hourly if k < cutoff]:
+        del hourly[key]
+
+    locations = rollups["locations"]["locations"]
+    for event in result.rollback_events:
+        entry = locations.setdefault(event.location_id, {"rollbacks": 0, "last_rollback": None})
+        entry["rollbacks"] += 1
+        entry["last_rollback"] = result.timestamp
+
+    # rollbacks_detected still carries the full count
+    recent_entry = result.to_dict()
+    del recent_entry["rollback_events"][ROLLUP_EVENTS_PER_ENTRY:]
+
+    recent = rollups["recent"]["entries"]
+    recent.insert(0, recent_entry)
+    del recent[ROLLUP_RECENT_ENTRIES:]
+
+
+def save_rollups(rollups: dict[str, dict]) -> dict[str, dict]:
+    """Write the rollups and their content-hash index.
+
+    Files whose content is unchanged are not rewritten.
+
+    Args:
+        rollups: Rollups as returned by load_rollups.
+
+    Returns:
+        The index: file name -> {"hash", "bytes"}.
+    """
+    start = time.perf_counter()
+    folder = data_path(ROLLUPS_DIR)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    written = 0
+    index = {}
+    for name in ROLLUP_FILES:
+        content = json.dumps(rollups[name], separators=(",", ":"), sort_keys=True).encode()
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        filename = f"{name}.json"
+        index[filename] = {"hash": digest, "bytes": len(content)}
+
+        if commit.write_file(folder / filename, content):
+            written += len(content)
+
+    content = json.dumps(index, indent=2, sort_keys=True).encode()
+    if commit.write_file(folder / INDEX_FILE, content):
+        written += len(content)
+
+    metrics.record_write("rollups", time.perf_counter() - start, written)
+
+    return index
+
+
+def update_rollups(result: ComparisonResult) -> dict[str, dict]:
+    """Fold the latest comparison result into the saved rollups.
+
+    Args:
+        result: The cycle's comparison result.
+
+    Returns:
+        The updated rollup index.
+    """
+    rollups = load_rollups()
+    apply_result(rollups, result)
+    return save_rollups(rollups)
+
+
+def rebuild_rollups(results: Iterable[ComparisonResult]) -> dict[str, dict]:
+    """Rebuild the rollups from scratch, e.g. after replaying history.
+
+    Args:
+        results: Comparison results in detection order.
+
+    Returns:
+        The rebuilt rollup index.
+    """
+    rollups = _empty_rollups()
+    for result in results:
+        apply_result(rollups, result)
+    return save_rollups(rollups)
@@ -0,0 +1,221 @@
+"""Content-addressed, deduplicated snapshot store.
+
+Each record is hashed over its canonical JSON, leaving out the volatile
+fields. NSOH moves LastUpdated forward at almost every location on each
+refresh, so a blob that included it would never be shared. A snapshot is
+saved as a small manifest listing the hashes of its records in order, with
+the volatile fields' values alongside, and the record blobs are appended to
+a per-day object pack. Only records that changed since the previous
+snapshot of the same source are appended, so unchanged records are shared
+across snapshots. Each day folder is self-contained:
+
+    data/snapshots/<date>/objects.jsonl          {"hash": ..., "record": {...}}
+    data/snapshots/<date>/<source>_<time>.manifest.json
+"""
+
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Optional
+
+from . import commit
+from .models import Snapshot, OverflowRecord
+
+
+OBJECTS_FILE = "objects.jsonl"
+MANIFEST_SUFFIX = ".manifest.json"
+
+# Record fields kept in the manifest rather than the blob
+VOLATILE_FIELDS = ("last_updated",)
+
+# Folder -> source -> record hashes of the last manifest written there
+_last_hashes: dict[str, dict[str, set[str]]] = {}
+
+
+def record_hash(record: dict) -> str:
+    """Get the content hash of a record dict."""
+    canonical = json.dumps(record, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def is_manifest(path: str) -> bool:
+    """Check whether a snapshot path points at a store manifest."""
+    return str(path).endswith(MANIFEST_SUFFIX)
+
+
+def _previous_hashes(folder: Path, source: str, manifest_path: Path) -> set[str]:
+    """Get the record hashes of the previous manifest for a source in a folder."""
+    by_source = _last_hashes.get(str(folder), {})
+    if source in by_source:
+        return by_source[source]
+
+    manifests = sorted(
+        p for p in folder.glob(f"{source}_*{MANIFEST_SUFFIX}") if p != manifest_path
+    )
+    if not manifests:
+        return set()
+
+    with open(manifests[-1], "r") as f:
+        return set(json.load(f)["records"])
+
+
+def save_dedup_snapshot(snapshot: Snapshot, manifest_path: str) -> str:
+    """Save a snapshot as a manifest plus any new record blobs.
+
+    Args:
+        snapshot: The snapshot to save.
+        manifest_path: Where to write the manifest. Its folder holds the pack.
+
+    Returns:
+        Path where the manifest was saved.
+    """
+    path = Path(manifest_path)
+    folder = path.parent
+    previous = _previous_hashes(folder, snapshot.source, path)
+
+    hashes = []
+    volatile = {name: [] for name in VOLATILE_FIELDS}
+    new_blobs = []
+    seen = set()
+    for record in snapshot.records:
+        data = record.to_dict()
+        for name, values in volatile.items():
+            values.append(data.pop(name))
+        h = record_hash(data)
+        hashes.append(h)
+        if h not in previous and h not in seen:
+            new_blobs.append({"hash": h, "record": data})
+        seen.add(h)
+
+    # Blobs go first: a crash in between only leaves unreferenced blobs
+    if new_blobs:
+        lines = (json.dumps(blob, separators=(",", ":")) + "\n" for blob in new_blobs)
+        commit.append_file(folder / OBJECTS_FILE, "".join(lines).encode())
+
+    manifest = {
+        "timestamp": snapshot.timestamp,
+        "source": snapshot.source,
+        "fetch_started": snapshot.fetch_started,
+        "fetch_finished": snapshot.fetch_finished,
+        "fetch_duration_ms": snapshot.fetch_duration_ms,
+        "full_sweep_at": snapshot.full_sweep_at,
+        "records": hashes,
+        "volatile": volatile,
+    }
+    commit.write_file(path, json.dumps(manifest, separators=(",", ":")).encode())
+
+    by_source = _last_hashes.setdefault(str(folder), {})
+    by_source[snapshot.source] = set(hashes)
+    # Never published: the next save reads the last manifest from disk
+    commit.on_abort(lambda: by_source.pop(snapshot.source, None))
+    return str(path)
+
+
+def _load_blobs(folder: Path, wanted: Optional[set[str]] = None) -> dict[str, dict]:
+    """Load record blobs from a day pack, optionally only the wanted hashes."""
+    blobs = {}
+    pack = folder / OBJECTS_FILE
+
+    if not pack.exists():
+        return blobs
+
+    with open(pack, "r") as f:
+        for line in f:
+            blob = json.loads(line)
+            if wanted is None or blob["hash"] in wanted:
+                blobs[blob["hash"]] = blob["record"]
+    return blobs
+
+
+def _rebuild(manifest: dict, blobs: dict[str, dict]) -> Snapshot:
+    """Rebuild a snapshot from a manifest and its record blobs."""
+    hashes = manifest["records"]
+    # Manifests written before VOLATILE_FIELDS have them in the blobs
+    volatile = manifest.get("volatile", {})
+    records = []
+    for i, h in enumerate(hashes):
+        data = blobs[h]
+        if volatile:
+            data = {**data, **{name: values[i] for name, values in volatile.items()}}
+        records.append(OverflowRecord.from_dict(data))
+
+    return Snapshot(
+        timestamp=manifest["timestamp"],
+        source=manifest["source"],
+        records=records,
+        fetch_started=manifest.get("fetch_started"),
+        fetch_finished=manifest.get("fetch_finished"),
+        fetch_duration_ms=manifest.get("fetch_duration_ms"),
+        full_sweep_at=manifest.get("full_sweep_at"),
+    )
+
+
+def load_dedup_snapshot(manifest_path: str) -> Snapshot:
+    """Rebuild a snapshot from its manifest and day pack.
+
+    Args:
+        manifest_path: Path to the manifest.
+
+    Returns:
+        The snapshot exactly as it was saved.
+
+    Raises:
+        KeyError: If a record blob referenced by the manifest is missing.
+    """
+    path = Path(manifest_path)
+
+    with open(path, "r") as f:
+        manifest = json.load(f)
+
+    blobs = _load_blobs(path.parent, set(manifest["records"]))
+    return _rebuild(manifest, blobs)
+
+
+def migrate_folder(folder: str, remove: bool = False) -> int:
+    """Convert the plain JSON snapshots in a day folder into the store.
+
+    Args:
+        folder: A data/snapshots/<date> folder.
+        remove: Delete each JSON snapshot once it has been verified.
+
+    Returns:
+        Number of snapshots migrated.
+
+    Raises:
+        ValueError: If a migrated snapshot does not rebuild exactly.
+    """
+    paths = [p for p in Path(folder).glob("*.json") if not is_manifest(str(p))]
+    # Save in capture order so each source deduplicates against its predecessor
+    paths.sort(key=lambda p: p.stem.split("_", 1)[1])
+
+    manifests = {}
+    for path in paths:
+        with open(path, "r") as f:
+            snapshot = Snapshot.from_dict(json.load(f))
+        manifest_path = path.with_name(path.stem + MANIFEST_SUFFIX)
+        manifests[path] = save_dedup_snapshot(snapshot, str(manifest_path))
+
+    # Verify every snapshot against a single read of the pack
+    blobs = _load_blobs(Path(folder))
+    for path, manifest_path in manifests.items():
+        with open(path, "r") as f:
+            original = Snapshot.from_dict(json.load(f))
+        with open(manifest_path, "r") as f:
+            rebuilt = _rebuild(json.load(f), blobs)
+
+        if rebuilt != original:
+            raise ValueError(f"Snapshot {path} did not rebuild exactly")
+        if remove:
+            path.unlink()
+
+    return len(paths)
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.snapstore <day folder>... [--remove]
+    args = sys.argv[1:]
+    remove = "--remove" in args
+    for folder in (a for a in args if a != "--remove"):
+        count = migrate_folder(folder, remove=remove)
+        print(f"{folder}: migrated {count} snapshots")
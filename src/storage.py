@@ -1,35 +1,85 @@
 """JSON file management for snapshots and rollback logs."""
 
+import fcntl
 import json
 import os
+import shutil
+import struct
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 from .config import (
     SNAPSHOTS_DIR,
     ROLLBACKS_DIR,
     LATEST_DIR,
     ROLLBACK_LOG_FILE,
+    ROLLBACK_INDEX_FILE,
+    ROLLBACK_TIME_INDEX_FILE,
+    ROLLBACK_LOCATION_SUMMARY_FILE,
+    ROLLBACK_LOCATIONS_DIR,
+    LEGACY_ROLLBACK_LOG_FILE,
     LATEST_COMPARISON_FILE,
     THAMES_LATEST_FILE,
     NSOH_LATEST_FILE,
+    HTTP_VALIDATORS_FILE,
+    SNAPSHOT_BACKEND,
+    HIGH_WATER_MARKS_FILE,
 )
+from . import commit, metrics
+from .companies import data_path
+from .hwm import HighWaterMarks
 from .models import Snapshot, ComparisonResult
+from .snapstore import (
+    MANIFEST_SUFFIX,
+    is_manifest,
+    save_dedup_snapshot,
+    load_dedup_snapshot,
+)
+from .deltastore import DELTA_SUFFIX, is_delta, save_delta_snapshot, load_delta_snapshot
+from .archive import is_archived, load_archived_snapshot
+from .columnar import (
+    COLUMNAR_SUFFIX,
+    ColumnarSnapshot,
+    write_columnar,
+    load_columnar,
+    open_columnar,
+)
 
 
 def ensure_directories():
     """Create data directories if they don't exist."""
     for dir_path in [SNAPSHOTS_DIR, ROLLBACKS_DIR, LATEST_DIR]:
-        Path(dir_path).mkdir(parents=True, exist_ok=True)
+        data_path(dir_path).mkdir(parents=True, exist_ok=True)
+
 
+def _write_json(path, data, kind: str, **dump_kwargs):
+    """Write a JSON file atomically, recording the write time and size.
 
-def get_snapshot_path(timestamp: str, source: str) -> str:
+    Nothing is written, or recorded, if the file already holds the same JSON.
+
+    Args:
+        path: Destination path.
+        data: JSON-serialisable data.
+        kind: Metrics label for what is being written.
+        **dump_kwargs: Passed to json.dumps.
+    """
+    start = time.perf_counter()
+    content = json.dumps(data, **dump_kwargs).encode()
+    if commit.write_file(path, content):
+        metrics.record_write(kind, time.perf_counter() - start, len(content))
+
+
+def get_snapshot_path(timestamp: str, source: str, suffix: str = ".json") -> str:
     """Get the file path for a snapshot.
 
     Args:
         timestamp: ISO timestamp.
         source: "thames" or "nsoh".
+        suffix: File suffix for the snapshot format.
 
     Returns:
         File path for the snapshot.
@@ -38,30 +88,80 @@ def get_snapshot_path(timestamp: str, source: str) -> str:
     date_folder = dt.strftime("%Y-%m-%d")
     time_str = dt.strftime("%H-%M-%S")
 
-    folder_path = Path(SNAPSHOTS_DIR) / date_folder
+    folder_path = data_path(SNAPSHOTS_DIR) / date_folder
     folder_path.mkdir(parents=True, exist_ok=True)
 
-    return str(folder_path / f"{source}_{time_str}.json")
+    return str(folder_path / f"{source}_{time_str}{suffix}")
 
 
-def save_snapshot(snapshot: Snapshot) -> str:
+def save_snapshot(snapshot: Snapshot, backend: str = SNAPSHOT_BACKEND) -> str:
     """Save a snapshot to the snapshots directory.
 
     Args:
         snapshot: The snapshot to save.
+        backend: "json", "dedup", "columnar" or "delta" (see SNAPSHOT_BACKEND).
 
     Returns:
         Path where the snapshot was saved.
     """
     ensure_directories()
-    path = get_snapshot_path(snapshot.timestamp, snapshot.source)
 
-    with open(path, "w") as f:
-        json.dump(snapshot.to_dict(), f, indent=2)
+    if backend in ("dedup", "columnar", "delta"):
+        start = time.perf_counter()
+        if backend == "dedup":
+            path = get_snapshot_path(snapshot.timestamp, snapshot.source, MANIFEST_SUFFIX)
+            save_dedup_snapshot(snapshot, path)
+        elif backend == "delta":
+            path = get_snapshot_path(snapshot.timestamp, snapshot.source, DELTA_SUFFIX)
+            save_delta_snapshot(snapshot, path)
+        else:
+            path = get_snapshot_path(snapshot.timestamp, snapshot.source, COLUMNAR_SUFFIX)
+            write_columnar(snapshot, path)
+        # The dedup record pack is appended to as well; only the manifest is counted
+        metrics.record_write("snapshot", time.perf_counter() - start, commit.file_size(path))
+        return path
+
+    path = get_snapshot_path(snapshot.timestamp, snapshot.source)
+    _write_json(path, snapshot.to_dict(), "snapshot", indent=2)
 
     return path
 
 
+def load_snapshot(path: str) -> Snapshot:
+    """Load a historical snapshot saved by any backend, or archived.
+
+    Args:
+        path: Path returned by save_snapshot, or listed by
+            replay.list_snapshot_paths.
+
+    Returns:
+        The saved snapshot.
+    """
+    if is_archived(path):
+        return load_archived_snapshot(path)
+    if is_manifest(path):
+        return load_dedup_snapshot(path)
+    if is_delta(path):
+        return load_delta_snapshot(path)
+    if path.endswith(COLUMNAR_SUFFIX):
+        return load_columnar(path)
+
+    with open(path, "r") as f:
+        return Snapshot.from_dict(json.load(f))
+
+
+def open_snapshot_view(path: str) -> ColumnarSnapshot:
+    """Memory-map a columnar snapshot without building records.
+
+    Args:
+        path: Path to a snapshot saved with the "columnar" backend.
+
+    Returns:
+        Zero-copy view of the snapshot; close it when done.
+    """
+    return open_columnar(path)
+
+
 def save_latest(snapshot: Snapshot):
     """Save a snapshot as the latest for its source.
 
@@ -71,10 +171,9 @@ def save_latest(snapshot: Snapshot):
     ensure_directories()
 
     filename = THAMES_LATEST_FILE if snapshot.source == "thames" else NSOH_LATEST_FILE
-    path = Path(LATEST_DIR) / filename
+    path = data_path(LATEST_DIR) / filename
 
-    with open(path, "w") as f:
-        json.dump(snapshot.to_dict(), f, indent=2)
+    _write_json(path, snapshot.to_dict(), "latest", indent=2)
 
 
 def load_latest(source: str) -> Optional[Snapshot]:
@@ -87,7 +186,7 @@ def load_latest(source: str) -> Optional[Snapshot]:
         Snapshot if found, None otherwise.
     """
     filename = THAMES_LATEST_FILE if source == "thames" else NSOH_LATEST_FILE
-    path = Path(LATEST_DIR) / filename
+    path = data_path(LATEST_DIR) / filename
 
     if not path.exists():
         return None
@@ -97,10 +196,121 @@ def load_latest(source: str) -> Optional[Snapshot]:
         return Snapshot.from_dict(data)
 
 
+def load_high_water_marks() -> Optional[HighWaterMarks]:
+    """Load the NSOH high-water mark index.
+
+    Returns:
+        HighWaterMarks if saved, None otherwise.
+    """
+    path = data_path(LATEST_DIR) / HIGH_WATER_MARKS_FILE
+
+    if not path.exists():
+        return None
+
+    with open(path, "r") as f:
+        return HighWaterMarks.from_dict(json.load(f))
+
+
+def save_high_water_marks(marks: HighWaterMarks):
+    """Save the NSOH high-water mark index.
+
+    Args:
+        marks: The updated marks.
+    """
+    ensure_directories()
+    path = data_path(LATEST_DIR) / HIGH_WATER_MARKS_FILE
+
+    _write_json(path, marks.to_dict(), "high_water_marks", separators=(",", ":"))
+
+
+# Rollback log index entry: byte offset and length of one log line
+_INDEX_ENTRY = struct.Struct("<QQ")
+_rollback_log_lock = threading.Lock()
+
+
+def _rollback_log_paths() -> tuple[Path, Path]:
+    return data_path(ROLLBACKS_DIR) / ROLLBACK_LOG_FILE, data_path(ROLLBACKS_DIR) / ROLLBACK_INDEX_FILE
+
+
+def _encode_entry(result: ComparisonResult) -> bytes:
+    return (json.dumps(result.to_dict(), separators=(",", ":")) + "\n").encode()
+
+
+def rebuild_rollback_index():
+    """Rebuild the rollback log index by scanning the log.
+
+    A trailing partial line (left by a crash mid-append) is truncated.
+    """
+    log_path, index_path = _rollback_log_paths()
+
+    entries = []
+    offset = 0
+    if log_path.exists():
+        with open(log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entries.append(_INDEX_ENTRY.pack(offset, len(line)))
+                offset += len(line)
+        if log_path.stat().st_size != offset:
+            os.truncate(log_path, offset)
+
+    with open(index_path, "wb") as f:
+        f.write(b"".join(entries))
+
+
+def _ensure_rollback_log():
+    """Migrate a legacy JSON log and repair the index if it is out of step."""
+    log_path, index_path = _rollback_log_paths()
+    legacy_path = data_path(ROLLBACKS_DIR) / LEGACY_ROLLBACK_LOG_FILE
+
+    if not log_path.exists() and legacy_path.exists():
+        with open(legacy_path, "r") as f:
+            entries = [ComparisonResult.from_dict(e) for e in json.load(f)]
+        _write_rollback_log(entries)
+        return
+
+    log_size = log_path.stat().st_size if log_path.exists() else 0
+    index_size = index_path.stat().st_size if index_path.exists() else 0
+
+    expected_size = 0
+    if index_size > 0 and index_size % _INDEX_ENTRY.size == 0:
+        with open(index_path, "rb") as f:
+            f.seek(index_size - _INDEX_ENTRY.size)
+            offset, length = _INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size))
+            expected_size = offset + length
+
+    if index_size % _INDEX_ENTRY.size or expected_size != log_size:
+        rebuild_rollback_index()
+
+
+def _write_rollback_log(results: list[ComparisonResult]):
+    """Write a complete rollback log and index, replacing any existing one."""
+    log_path, index_path = _rollback_log_paths()
+
+    lines = [_encode_entry(r) for r in results]
+    index = []
+    offset = 0
+    for line in lines:
+        index.append(_INDEX_ENTRY.pack(offset, len(line)))
+        offset += len(line)
+
+    for path, content in ((log_path, b"".join(lines)), (index_path, b"".join(index))):
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
 def append_rollback_log(result: ComparisonResult):
     """Append a comparison result to the rollback log.
 
-    Only appends if rollbacks were detected.
+    Only appends if rollbacks were detected. The entry is written as one line
+    with a single append, then its offset is added to the index, so the cost
+    does not grow with the size of the log. Inside a commit.transaction()
+    both appends are published with the rest of the cycle.
 
     Args:
         result: The comparison result.
@@ -109,20 +319,173 @@ def append_rollback_log(result: ComparisonResult):
         return
 
     ensure_directories()
-    log_path = Path(ROLLBACKS_DIR) / ROLLBACK_LOG_FILE
+    log_path, index_path = _rollback_log_paths()
+    line = _encode_entry(result)
+
+    start = time.perf_counter()
+    with _rollback_log_lock:
+        _ensure_rollback_log()
+
+        offset = commit.append_file(log_path, line)
+        commit.append_file(index_path, _INDEX_ENTRY.pack(offset, len(line)))
+
+    metrics.record_write("rollback_log", time.perf_counter() - start, len(line) + _INDEX_ENTRY.size)
 
-    # Load existing log or create new
-    log_entries = []
-    if log_path.exists():
-        with open(log_path, "r") as f:
-            log_entries = json.load(f)
 
-    # Append new entry
-    log_entries.append(result.to_dict())
+@contextmanager
+def query_index_lock() -> Iterator[None]:
+    """Hold the lock serialising writes to the rollback query indexes between processes."""
+    folder = data_path(ROLLBACKS_DIR)
+    folder.mkdir(parents=True, exist_ok=True)
+    with open(folder / f"{ROLLBACK_TIME_INDEX_FILE}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
 
-    # Save updated log
-    with open(log_path, "w") as f:
-        json.dump(log_entries, f, indent=2)
+
+def _drop_query_index():
+    """Remove the query indexes derived from the rollback log (see src.query)."""
+    folder = data_path(ROLLBACKS_DIR)
+    # The time index first: without it nothing counts as indexed
+    (folder / ROLLBACK_TIME_INDEX_FILE).unlink(missing_ok=True)
+    (folder / ROLLBACK_LOCATION_SUMMARY_FILE).unlink(missing_ok=True)
+    shutil.rmtree(data_path(ROLLBACK_LOCATIONS_DIR), ignore_errors=True)
+
+
+def save_rollback_log(results: list[ComparisonResult]):
+    """Replace the rollback log with the given results.
+
+    The query indexes are dropped, to be rebuilt by the next query: a
+    rewritten entry can keep its number and detection time while naming
+    other locations, which their catch-up cannot detect.
+
+    Args:
+        results: Comparison results in detection order. Results without
+            rollbacks are skipped, as in append_rollback_log.
+    """
+    ensure_directories()
+
+    # In the order the query index catch-up takes them
+    with query_index_lock(), _rollback_log_lock:
+        _drop_query_index()
+        _write_rollback_log([r for r in results if r.rollbacks_detected > 0])
+
+
+def count_rollback_log() -> int:
+    """Get the number of entries in the rollback log."""
+    _, index_path = _rollback_log_paths()
+
+    with _rollback_log_lock:
+        _ensure_rollback_log()
+        if not index_path.exists():
+            return 0
+        return index_path.stat().st_size // _INDEX_ENTRY.size
+
+
+def iter_rollback_log(start: int = 0, stop: Optional[int] = None) -> Iterator[ComparisonResult]:
+    """Stream entries of the rollback log, oldest first.
+
+    Only the requested entries are read, using the index to seek to them.
+
+    Args:
+        start: Index of the first entry.
+        stop: Index after the last entry, defaults to the end of the log.
+
+    Yields:
+        ComparisonResults in log order.
+    """
+    total = count_rollback_log()
+    stop = total if stop is None else min(stop, total)
+    if start >= stop:
+        return
+
+    log_path, index_path = _rollback_log_paths()
+
+    with open(index_path, "rb") as f:
+        f.seek(start * _INDEX_ENTRY.size)
+        first_offset, _ = _INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size))
+
+    with open(log_path, "rb") as f:
+        f.seek(first_offset)
+        for _ in range(stop - start):
+            yield ComparisonResult.from_dict(json.loads(f.readline()))
+
+
+def iter_rollback_entries(numbers: Iterable[int]) -> Iterator[tuple[int, ComparisonResult]]:
+    """Read specific entries of the rollback log.
+
+    Each entry is read by seeking to it, so the cost depends only on how
+    many are requested.
+
+    Args:
+        numbers: Entry indices, ideally ascending.
+
+    Yields:
+        (index, ComparisonResult) for each index that exists.
+    """
+    total = count_rollback_log()
+    log_path, index_path = _rollback_log_paths()
+    if total == 0:
+        return
+
+    with open(index_path, "rb") as index, open(log_path, "rb") as log:
+        for n in numbers:
+            if not 0 <= n < total:
+                continue
+            index.seek(n * _INDEX_ENTRY.size)
+            offset, length = _INDEX_ENTRY.unpack(index.read(_INDEX_ENTRY.size))
+            log.seek(offset)
+            yield n, ComparisonResult.from_dict(json.loads(log.read(length)))
+
+
+def load_rollback_log_page(
+    page: int = 0,
+    page_size: int = 50,
+    newest_first: bool = True,
+) -> list[ComparisonResult]:
+    """Load one page of the rollback log.
+
+    Args:
+        page: Zero-based page number.
+        page_size: Entries per page.
+        newest_first: Page from the most recent entry backwards.
+
+    Returns:
+        ComparisonResults on the page, in page order.
+    """
+    total = count_rollback_log()
+
+    if newest_first:
+        stop = max(total - page * page_size, 0)
+        start = max(stop - page_size, 0)
+        return list(iter_rollback_log(start, stop))[::-1]
+
+    start = page * page_size
+    return list(iter_rollback_log(start, start + page_size))
+
+
+def export_rollback_log(path: Optional[str] = None) -> str:
+    """Export the rollback log as a single JSON array.
+
+    Args:
+        path: Destination, defaults to the legacy rollback_log.json.
+
+    Returns:
+        Path of the export.
+    """
+    ensure_directories()
+    if path is None:
+        path = str(data_path(ROLLBACKS_DIR) / LEGACY_ROLLBACK_LOG_FILE)
+
+    with open(path, "w") as f:
+        f.write("[")
+        for i, result in enumerate(iter_rollback_log()):
+            if i:
+                f.write(",")
+            f.write("\n")
+            json.dump(result.to_dict(), f)
+        f.write("\n]\n")
+
+    return path
 
 
 def save_latest_comparison(result: ComparisonResult):
@@ -132,10 +495,9 @@ def save_latest_comparison(result: ComparisonResult):
         result: The comparison result.
     """
     ensure_directories()
-    path = Path(ROLLBACKS_DIR) / LATEST_COMPARISON_FILE
+    path = data_path(ROLLBACKS_DIR) / LATEST_COMPARISON_FILE
 
-    with open(path, "w") as f:
-        json.dump(result.to_dict(), f, indent=2)
+    _write_json(path, result.to_dict(), "comparison", indent=2)
 
 
 def load_rollback_log() -> list[ComparisonResult]:
@@ -144,11 +506,34 @@ def load_rollback_log() -> list[ComparisonResult]:
     Returns:
         List of ComparisonResults.
     """
-    log_path = Path(ROLLBACKS_DIR) / ROLLBACK_LOG_FILE
+    return list(iter_rollback_log())
 
-    if not log_path.exists():
-        return []
 
-    with open(log_path, "r") as f:
-        data = json.load(f)
-        return [ComparisonResult.from_dict(entry) for entry in data]
+def load_http_validators() -> dict[str, dict]:
+    """Load the ETag/Last-Modified validators saved by the previous cycle.
+
+    Returns:
+        Mapping of request key to validators, empty if none are saved.
+    """
+    path = data_path(LATEST_DIR) / HTTP_VALIDATORS_FILE
+
+    if not path.exists():
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_http_validators(validators: dict[str, dict]):
+    """Save the ETag/Last-Modified validators for the next cycle.
+
+    Must only be called once the data the validators describe is saved,
+    otherwise a later 304 would refer to data we never stored.
+
+    Args:
+        validators: Mapping of request key to validators.
+    """
+    ensure_directories()
+    path = data_path(LATEST_DIR) / HTTP_VALIDATORS_FILE
+
+    _write_json(path, validators, "http_validators", indent=2, sort_keys=True)
@@ -0,0 +1,38 @@
+"""Shared fixtures. Every test runs in its own empty working directory."""
+
+from dataclasses import replace
+
+import pytest
+
+from src import commit, deltastore, snapstore
+from src.companies import current_company
+from src.fetchers import http
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Run in an empty directory, with no state cached from other tests."""
+    monkeypatch.chdir(tmp_path)
+    # Caches are keyed by relative path, which every test shares
+    deltastore._heads.clear()
+    snapstore._last_hashes.clear()
+    commit._published.clear()
+    yield tmp_path
+    deltastore._heads.clear()
+    snapstore._last_hashes.clear()
+    commit._published.clear()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Start a stub Thames/ArcGIS server; yields (server, company pointed at it)."""
+    from benchmarks.stub_server import StubServer
+    from helpers import records
+
+    monkeypatch.setattr(http, "backoff_delay", lambda attempt: 0)
+    http.close_session()
+    http.set_validators({})
+    with StubServer(records(20), records(20, source="thames")) as server:
+        yield server, replace(current_company(), truth_url=server.thames_url, nsoh_url=server.arcgis_url)
+    http.close_session()
+    http.set_validators({})
@@ -0,0 +1,76 @@
+"""Builders for records and snapshots used across the tests."""
+
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from src.models import OverflowRecord, Snapshot
+
+
+BASE_MS = 1_770_000_000_000  # 2026-02-02T02:40:00Z
+START = datetime(2026, 2, 3, 10, 0, tzinfo=timezone.utc)
+
+
+def timestamp(minutes: int) -> str:
+    """Get the ISO capture time a number of minutes after START."""
+    return (START + timedelta(minutes=minutes)).isoformat()
+
+
+def record(
+    location_id: str,
+    last_updated: Optional[int] = BASE_MS,
+    status: int = 0,
+    source: str = "nsoh",
+) -> OverflowRecord:
+    return OverflowRecord(
+        location_id=location_id,
+        status=status,
+        status_start=None if last_updated is None else last_updated - 60_000,
+        latest_event_start=None if last_updated is None else last_updated - 120_000,
+        latest_event_end=None,
+        last_updated=last_updated,
+        source=source,
+    )
+
+
+def records(count: int, source: str = "nsoh", step_ms: int = 0) -> list[OverflowRecord]:
+    """Get count records, TWL00000 onwards, with LastUpdated moved on by step_ms."""
+    return [record(f"TWL{i:05d}", BASE_MS + i * 1000 + step_ms, i % 2, source) for i in range(count)]
+
+
+def snapshot(minutes: int, recs: list[OverflowRecord], source: str = "nsoh") -> Snapshot:
+    return Snapshot(
+        timestamp=timestamp(minutes),
+        source=source,
+        records=recs,
+        fetch_started=timestamp(minutes),
+        fetch_finished=timestamp(minutes),
+        fetch_duration_ms=12.5,
+    )
+
+
+def history(count: int, size: int = 30, source: str = "nsoh") -> list[Snapshot]:
+    """Get consecutive snapshots of a source, changing the way NSOH does.
+
+    Each poll moves LastUpdated forward everywhere and flips a status;
+    along the way locations are removed and added, the record order
+    changes, and a LastUpdated is rolled back or cleared.
+    """
+    recs = records(size, source)
+    snapshots = []
+    for n in range(count):
+        recs = [r if r.last_updated is None else replace(r, last_updated=r.last_updated + 60_000) for r in recs]
+        i = n % len(recs)
+        recs[i] = replace(recs[i], status=1 - recs[i].status)
+        if n % 5 == 2:
+            recs.pop(n % len(recs))
+        if n % 5 == 3:
+            recs.append(record(f"NEW{n:04d}", BASE_MS + n, source=source))
+        if n % 7 == 4:
+            recs.reverse()
+        if n % 6 == 5 and recs[0].last_updated is not None:
+            recs[0] = replace(recs[0], last_updated=recs[0].last_updated - 3_600_000)
+        if n == 3:
+            recs[1] = replace(recs[1], last_updated=None, latest_event_end=None)
+        snapshots.append(snapshot(n * 5, list(recs), source))
+    return snapshots
@@ -0,0 +1,57 @@
+"""The vectorized detector must agree with detect_rollbacks."""
+
+import pytest
+
+from src import batch_detector
+from src.batch_detector import detect_history, detect_rollbacks_batched
+from src.detector import detect_rollbacks
+from src.storage import open_snapshot_view, save_snapshot
+
+from helpers import history
+
+
+@pytest.fixture(autouse=True, params=["numpy", "without numpy"])
+def numpy_path(request, monkeypatch):
+    """Run every test with NumPy and through the fallback without it."""
+    if request.param == "without numpy":
+        monkeypatch.setattr(batch_detector, "np", None)
+
+
+def _expected(nsoh, thames=None) -> list:
+    return [
+        detect_rollbacks(previous, current, thames and thames[i + 1], current.timestamp)
+        for i, (previous, current) in enumerate(zip(nsoh, nsoh[1:]))
+    ]
+
+
+def test_history_matches_detect_rollbacks():
+    nsoh = history(24)
+    expected = _expected(nsoh)
+    assert sum(r.rollbacks_detected for r in expected) > 0
+    assert list(detect_history(nsoh)) == expected
+
+
+def test_history_with_thames_context():
+    nsoh = history(24)
+    thames = history(24, size=25, source="thames")
+    assert list(detect_history(zip(nsoh, thames))) == _expected(nsoh, thames)
+
+
+def test_history_from_columnar_views():
+    nsoh = history(12)
+    views = [open_snapshot_view(save_snapshot(s, backend="columnar")) for s in nsoh]
+    try:
+        assert list(detect_history(views)) == _expected(nsoh)
+    finally:
+        for view in views:
+            view.close()
+
+
+@pytest.mark.parametrize("n", [1, 5, 11, 17])
+def test_batched_pair_matches_detect_rollbacks(n):
+    nsoh = history(n + 1)
+    thames = history(n + 1, source="thames")[n]
+    assert (
+        detect_rollbacks_batched(nsoh[n - 1], nsoh[n], thames, "t")
+        == detect_rollbacks(nsoh[n - 1], nsoh[n], thames, "t")
+    )
@@ -0,0 +1,46 @@
+"""The change feed across compaction of its finished days."""
+
+from src.changes import append_changes, compact_changes, diff_snapshots, iter_changes, rebuild_changes
+from src.companies import data_path
+from src.config import CHANGES_DIR
+from src.storage import save_snapshot
+
+from helpers import history
+
+
+def _feed(snapshots) -> list:
+    return [diff_snapshots(a, b) for a, b in zip(snapshots, snapshots[1:])]
+
+
+def test_compacted_days_read_back_with_late_lines():
+    feed = _feed(history(8))
+    for changes in feed[:5]:
+        append_changes(changes)
+
+    assert [(day, size > gzipped) for day, size, gzipped in compact_changes(before="2026-02-04")] == [
+        ("2026-02-03", True)
+    ]
+    assert sorted(p.name for p in data_path(CHANGES_DIR).iterdir()) == ["2026-02-03.jsonl.gz"]
+    assert list(iter_changes()) == feed[:5]
+
+    # A cycle committed late appends to the compacted day
+    for changes in feed[5:]:
+        append_changes(changes)
+    assert list(iter_changes("2026-02-03")) == feed
+
+    compact_changes(before="2026-02-04")
+    assert list(iter_changes()) == feed
+    assert compact_changes(before="2026-02-04") == []
+
+
+def test_rebuild_keeps_a_compacted_day_compressed():
+    snapshots = history(6)
+    for s in snapshots:
+        save_snapshot(s)
+    rebuild_changes()
+    compact_changes(before="2026-02-04")
+    append_changes(_feed(snapshots)[-1])
+
+    assert rebuild_changes() == len(snapshots) - 1
+    assert list(iter_changes()) == _feed(snapshots)
+    assert (data_path(CHANGES_DIR) / "2026-02-03.jsonl.gz").exists()
@@ -0,0 +1,37 @@
+"""Round trips through the columnar snapshot format."""
+
+from src.compact import compact
+from src.replay import list_snapshot_paths
+from src.storage import load_snapshot, open_snapshot_view, save_snapshot
+
+from helpers import history
+
+
+def test_round_trip():
+    snapshots = history(12)
+    paths = [save_snapshot(s, backend="columnar") for s in snapshots]
+    assert [load_snapshot(p) for p in paths] == snapshots
+
+
+def test_view_reads_nulls_without_building_records():
+    snapshot = history(4)[3]  # Has a cleared LastUpdated
+    path = save_snapshot(snapshot, backend="columnar")
+
+    with open_snapshot_view(path) as view:
+        assert len(view) == len(snapshot.records)
+        for i, record in enumerate(snapshot.records):
+            assert view.location_id(i) == record.location_id
+            assert view.value("last_updated", i) == record.last_updated
+            assert view.value("latest_event_end", i) == record.latest_event_end
+        assert list(view) == snapshot.records
+
+
+def test_round_trip_after_compaction():
+    snapshots = history(12)
+    for s in snapshots:
+        save_snapshot(s, backend="columnar")
+
+    [(day, count, _, _)] = compact(before="2026-02-04")
+    assert (day, count) == ("2026-02-03", len(snapshots))
+    paths = [p for _, p in list_snapshot_paths(day, "nsoh", "data/snapshots")]
+    assert [load_snapshot(p) for p in paths] == snapshots
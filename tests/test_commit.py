@@ -0,0 +1,169 @@
+"""Transactions: publishing, aborting and recovering a cycle's writes."""
+
+import os
+from dataclasses import replace
+
+import pytest
+
+from src import commit, main
+from src.companies import current_company
+from src.fetchers import http
+from src.storage import load_snapshot, save_snapshot
+
+from helpers import history, timestamp
+
+
+class Crash(Exception):
+    pass
+
+
+def _staging() -> list[str]:
+    return os.listdir("data/.staging") if os.path.exists("data/.staging") else []
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_transaction_publishes_on_exit():
+    commit.write_file("data/a.json", b"old")
+    with commit.transaction():
+        commit.write_file("data/a.json", b"new")
+        assert commit.append_file("data/log.jsonl", b"one\n") == 0
+        assert commit.append_file("data/log.jsonl", b"two\n") == 4
+        assert commit.file_size("data/log.jsonl") == 8
+        assert _read("data/a.json") == b"old"
+        assert not os.path.exists("data/log.jsonl")
+
+    assert _read("data/a.json") == b"new"
+    assert _read("data/log.jsonl") == b"one\ntwo\n"
+    assert _staging() == []
+
+
+def test_unchanged_files_are_skipped():
+    assert commit.write_file("data/a.json", b"same")
+    assert not commit.write_file("data/a.json", b"same")
+    with commit.transaction():
+        assert not commit.write_file("data/a.json", b"same")
+        assert commit.write_file("data/a.json", b"other")
+        # The staged content is what counts from here on
+        assert commit.write_file("data/a.json", b"same")
+    assert _read("data/a.json") == b"same"
+
+
+def test_abort_discards_writes_and_runs_callbacks():
+    commit.write_file("data/a.json", b"old")
+    undone = []
+    with pytest.raises(Crash):
+        with commit.transaction():
+            commit.write_file("data/a.json", b"new")
+            commit.append_file("data/log.jsonl", b"one\n")
+            commit.on_abort(lambda: undone.append(1))
+            commit.on_abort(lambda: undone.append(2))
+            raise Crash
+
+    assert _read("data/a.json") == b"old"
+    assert not os.path.exists("data/log.jsonl")
+    assert undone == [2, 1]
+    assert _staging() == []
+
+
+def test_failed_journal_aborts(monkeypatch):
+    commit.write_file("data/a.json", b"old")
+    undone = []
+
+    def fail(path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(commit, "_fsync_dir", fail)
+    with pytest.raises(OSError):
+        with commit.transaction():
+            commit.write_file("data/a.json", b"new")
+            commit.on_abort(lambda: undone.append(1))
+
+    assert _read("data/a.json") == b"old"
+    assert undone == [1]
+    assert _staging() == []
+
+
+def test_on_abort_outside_a_transaction_is_ignored():
+    commit.on_abort(lambda: pytest.fail("ran"))
+
+
+def test_crash_after_commit_point_is_rolled_forward(monkeypatch):
+    commit.write_file("data/a.json", b"old")
+    commit.append_file("data/log.jsonl", b"zero\n")
+
+    def crash(root, ops):
+        raise Crash
+
+    with monkeypatch.context() as m, pytest.raises(Crash):
+        m.setattr(commit, "_roll_forward", crash)
+        with commit.transaction():
+            commit.write_file("data/a.json", b"new")
+            commit.append_file("data/log.jsonl", b"one\n")
+            commit.on_abort(lambda: pytest.fail("committed transaction aborted"))
+    assert _read("data/a.json") == b"old"
+
+    assert commit.recover() == 1
+    assert _read("data/a.json") == b"new"
+    assert _read("data/log.jsonl") == b"zero\none\n"
+    assert _staging() == []
+
+    # Repeating a roll-forward changes nothing
+    assert commit.recover() == 0
+    assert _read("data/log.jsonl") == b"zero\none\n"
+
+
+def test_crash_before_commit_point_is_discarded(monkeypatch):
+    commit.write_file("data/a.json", b"old")
+
+    def crash(tx):
+        raise Crash
+
+    with monkeypatch.context() as m, pytest.raises(Crash):
+        m.setattr(commit, "_commit", crash)
+        with commit.transaction():
+            commit.write_file("data/a.json", b"new")
+    assert _staging() != []
+
+    assert commit.recover() == 0
+    assert _read("data/a.json") == b"old"
+    assert _staging() == []
+
+
+@pytest.mark.parametrize("backend", ["delta", "dedup"])
+def test_next_snapshot_after_an_abort(backend):
+    snapshots = history(4)
+    first = save_snapshot(snapshots[0], backend=backend)
+
+    with pytest.raises(Crash):
+        with commit.transaction():
+            aborted = save_snapshot(snapshots[1], backend=backend)
+            raise Crash
+    assert not os.path.exists(aborted)
+
+    # The same records again: all of them were in the aborted snapshot
+    saved = [replace(snapshots[1], timestamp=timestamp(7)), *snapshots[2:]]
+    with commit.transaction():
+        paths = [save_snapshot(s, backend=backend) for s in saved]
+
+    assert load_snapshot(first) == snapshots[0]
+    assert [load_snapshot(p) for p in paths] == saved
+
+
+def test_validators_accepted_in_an_aborted_transaction_are_restored():
+    url = "http://example.test/query"
+    company = replace(current_company(), truth_url=url)
+    http.set_validators({url: {"etag": "old", "last_modified": None}})
+    http._received[url] = {"etag": "new", "last_modified": None}
+
+    with pytest.raises(Crash):
+        with commit.transaction():
+            main._save_validators_write(company)()
+            assert http.get_validators()[url]["etag"] == "new"
+            raise Crash
+
+    assert http.get_validators() == {url: {"etag": "old", "last_modified": None}}
+    http.set_validators({})
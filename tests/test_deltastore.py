@@ -0,0 +1,86 @@
+"""Round trips through per-cycle delta snapshots and their daily archive."""
+
+import json
+
+import pytest
+
+from src import archive, deltastore
+from src.compact import compact
+from src.replay import list_snapshot_paths
+from src.storage import load_snapshot, save_snapshot
+
+from helpers import history
+
+
+@pytest.fixture(autouse=True)
+def short_chains(monkeypatch):
+    """Use a base every 4 snapshots so tests cross several of them."""
+    monkeypatch.setattr(deltastore, "DELTA_KEYFRAME_INTERVAL", 4)
+    monkeypatch.setattr(archive, "DELTA_KEYFRAME_INTERVAL", 4)
+
+
+def _bases(paths: list[str]) -> list[bool]:
+    bases = []
+    for path in paths:
+        with open(path) as f:
+            bases.append(json.load(f)["base"])
+    return bases
+
+
+def test_round_trip():
+    snapshots = history(12)
+    paths = [save_snapshot(s, backend="delta") for s in snapshots]
+
+    assert _bases(paths) == [True, False, False, False] * 3
+    assert [load_snapshot(p) for p in paths] == snapshots
+
+
+def test_saves_continue_the_chain_on_disk():
+    snapshots = history(10)
+    paths = [save_snapshot(s, backend="delta") for s in snapshots[:6]]
+
+    # A new process knows nothing of the last save
+    deltastore._heads.clear()
+    paths += [save_snapshot(s, backend="delta") for s in snapshots[6:]]
+
+    assert _bases(paths) == [True, False, False, False] * 2 + [True, False]
+    assert [load_snapshot(p) for p in paths] == snapshots
+
+
+def test_sources_keep_separate_chains():
+    nsoh = history(5)
+    thames = history(5, source="thames")
+    paths = []
+    for pair in zip(nsoh, thames):
+        paths.extend(save_snapshot(s, backend="delta") for s in pair)
+    assert [load_snapshot(p) for p in paths] == [s for pair in zip(nsoh, thames) for s in pair]
+
+
+def test_round_trip_after_compaction():
+    snapshots = history(12)
+    for s in snapshots:
+        save_snapshot(s, backend="delta")
+
+    [(day, count, _, _)] = compact(before="2026-02-04")
+    assert (day, count) == ("2026-02-03", len(snapshots))
+    paths = [p for _, p in list_snapshot_paths(day, "nsoh", "data/snapshots")]
+    assert [load_snapshot(p) for p in paths] == snapshots
+
+
+def test_compacting_a_day_twice_keeps_the_archived_snapshots():
+    snapshots = history(12)
+    thames = history(3, source="thames")
+    for s in snapshots[:8] + thames:
+        save_snapshot(s, backend="delta")
+    compact(before="2026-02-04")
+
+    # A late cycle writes the rest of the day after it was compacted
+    deltastore._heads.clear()
+    for s in snapshots[8:]:
+        save_snapshot(s, backend="delta")
+    [(day, count, _, _)] = compact(before="2026-02-04")
+
+    assert count == len(snapshots) + len(thames)
+    for source, expected in (("nsoh", snapshots), ("thames", thames)):
+        paths = [p for _, p in list_snapshot_paths(day, source, "data/snapshots")]
+        assert [load_snapshot(p) for p in paths] == expected
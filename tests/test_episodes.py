@@ -0,0 +1,40 @@
+"""Folding comparison results into rollback episodes."""
+
+from dataclasses import replace
+
+from src.detector import detect_rollbacks
+from src.episodes import EpisodeTracker
+
+from helpers import records, snapshot
+
+
+def _poll(n: int, behind: dict[int, int]) -> list:
+    """Records a minute on per poll, with some positions behind by minutes."""
+    recs = [replace(r, last_updated=r.last_updated + n * 60_000) for r in records(10)]
+    for i, minutes in behind.items():
+        recs[i] = replace(recs[i], last_updated=recs[i].last_updated - minutes * 60_000)
+    return recs
+
+
+def test_open_episodes_follow_their_locations_only():
+    tracker = EpisodeTracker()
+    polls = [
+        snapshot(0, _poll(0, {})),
+        snapshot(1, _poll(1, {2: 3})),
+        # Missing from the snapshot: still unknown
+        snapshot(2, [r for r in _poll(2, {2: 4}) if r.location_id != "TWL00002"]),
+        snapshot(3, _poll(3, {2: 5})),
+    ]
+    for previous, current in zip(polls, polls[1:]):
+        assert tracker.update(detect_rollbacks(previous, current, None, current.timestamp), current) == ([], [])
+
+    [episode] = tracker.open_episodes.values()
+    assert (episode.location_id, episode.observations) == ("TWL00002", 2)
+    assert episode.max_depth_ms == 2 * 60_000
+
+    # A repeated location id resolves to its last record, which caught up
+    recs = _poll(4, {})
+    current = snapshot(4, [replace(recs[2], last_updated=recs[2].last_updated - 600_000), *recs])
+    closed, _ = tracker.update(detect_rollbacks(polls[-1], current, None, current.timestamp), current)
+    assert [e.episode_id for e in closed] == [episode.episode_id]
+    assert not tracker.open_episodes
@@ -0,0 +1,88 @@
+"""Tests for the detection cycle against a stub server."""
+
+import json
+from dataclasses import replace
+
+from src import main
+from src.companies import use_company
+from src.storage import load_latest
+
+from helpers import records
+
+
+def _cycle(state: main.CycleState) -> int:
+    with use_company(state.company):
+        return main.run_cycle(state)
+
+
+def test_unchanged_nsoh_still_records_the_check(stub):
+    server, company = stub
+    state = main.CycleState(company=company)
+    assert _cycle(state) == 0  # Baseline
+    assert _cycle(state) == 0  # First comparison
+
+    with open("data/rollbacks/latest_comparison.json") as f:
+        before = json.load(f)["timestamp"]
+
+    # Both sources answer 304
+    assert _cycle(state) == 0
+    with open("data/rollbacks/latest_comparison.json") as f:
+        comparison = json.load(f)
+    with open("data/rollups/summary.json") as f:
+        summary = json.load(f)
+
+    assert comparison["timestamp"] > before
+    assert comparison["rollbacks_detected"] == 0
+    assert comparison["total_locations"] == len(load_latest("nsoh").records)
+    assert summary["last_check"] == comparison["timestamp"]
+    assert summary["total_rollbacks"] == 0
+
+
+def _rolled_back(recs: list, minutes: int) -> list:
+    return [replace(r, last_updated=r.last_updated - minutes * 60_000) for r in recs]
+
+
+def test_rollback_fetched_in_a_failed_cycle_is_detected_next_cycle(stub):
+    server, company = stub
+    state = main.CycleState(company=company)
+    assert _cycle(state) == 0  # Baseline
+    assert _cycle(state) == 0
+
+    server.set_data(_rolled_back(records(20), 30), records(20, source="thames"))
+    failed = main.CycleState(company=replace(company, truth_url=company.truth_url + "x"))
+    failed.nsoh, failed.previous_nsoh, failed.marks = state.nsoh, state.previous_nsoh, state.marks
+    assert _cycle(failed) == 2
+
+    assert _cycle(state) == 1
+
+
+def test_truth_data_fetched_in_a_failed_cycle_is_saved_next_cycle(stub):
+    server, company = stub
+    state = main.CycleState(company=company)
+    assert _cycle(state) == 0  # Baseline
+
+    changed = records(20, source="thames", step_ms=120_000)
+    server.set_data(records(20), changed)
+    failed = main.CycleState(company=replace(company, nsoh_url=company.nsoh_url + "x"))
+    failed.nsoh, failed.previous_nsoh, failed.marks = state.nsoh, state.previous_nsoh, state.marks
+    assert _cycle(failed) == 2
+
+    assert _cycle(state) == 0
+    with use_company(company):
+        assert [r.status_start for r in load_latest("thames").records] == [r.status_start for r in changed]
+
+
+def test_high_water_mark_baseline_starts_without_the_nsoh_snapshot(stub, monkeypatch):
+    server, company = stub
+    monkeypatch.setattr(main, "DETECTION_BASELINE", "high_water_mark")
+    monkeypatch.setattr(main, "NSOH_INCREMENTAL", True)
+    state = main.CycleState(company=company)
+    assert _cycle(state) == 0  # Baseline
+
+    state = main.load_state(company)
+    assert state.marks is not None and state.nsoh is None
+    assert _cycle(state) == 0  # Both sources answer 304
+    assert state.nsoh is None
+
+    server.set_data(_rolled_back(records(20), 30), records(20, source="thames"))
+    assert _cycle(state) == 1
@@ -0,0 +1,65 @@
+"""Incremental NSOH fetches: merging stamps and changed features."""
+
+from dataclasses import replace
+
+from src.fetchers.nsoh import _merge, fetch_nsoh_data
+
+from helpers import record, records, snapshot
+
+HOUR_MS = 3_600_000
+
+
+def _stamps(recs: list, step_ms: int = 60_000) -> list:
+    return [record(r.location_id, r.last_updated + step_ms) for r in recs]
+
+
+def test_merge_applies_stamps_and_changed_features():
+    previous = snapshot(0, records(5))
+    changed = replace(previous.records[2], status=1 - previous.records[2].status, latest_event_end=42)
+
+    merged = _merge(previous, _stamps(previous.records), [changed])
+
+    assert [r.last_updated for r in merged] == [r.last_updated + 60_000 for r in previous.records]
+    assert merged[2].status == changed.status
+    assert merged[2].latest_event_end == 42
+    assert merged[:2] + merged[3:] == [
+        replace(r, last_updated=r.last_updated + 60_000) for r in previous.records[:2] + previous.records[3:]
+    ]
+
+
+def test_merge_needs_a_sweep_when_a_feature_is_added():
+    previous = snapshot(0, records(5))
+    added = record("NEW00000", previous.records[0].last_updated)
+    assert _merge(previous, _stamps(previous.records) + [added], [added]) is None
+
+
+def test_merge_needs_a_sweep_when_a_feature_is_removed():
+    previous = snapshot(0, records(5))
+    assert _merge(previous, _stamps(previous.records[1:]), []) is None
+
+
+def test_merge_needs_a_sweep_when_features_are_swapped():
+    previous = snapshot(0, records(5))
+    added = record("NEW00000", previous.records[0].last_updated + HOUR_MS)
+
+    # Same count, and the new feature is among the changed ones
+    assert _merge(previous, _stamps(previous.records[1:]) + [added], [added]) is None
+
+
+def test_merge_needs_a_sweep_when_last_updated_goes_back():
+    previous = snapshot(0, records(5))
+    stamps = _stamps(previous.records)
+    stamps[3] = record(stamps[3].location_id, previous.records[3].last_updated - 1)
+    assert _merge(previous, stamps, []) is None
+
+
+def test_swapped_feature_is_fetched_by_a_full_sweep(stub):
+    server, company = stub
+    previous = fetch_nsoh_data(url=company.nsoh_url)
+
+    current = records(20)[1:] + [record("NEW00000", records(1)[0].last_updated + HOUR_MS)]
+    server.set_data(current, records(20, source="thames"))
+    snapshot = fetch_nsoh_data(url=company.nsoh_url, previous=previous)
+
+    assert snapshot.full_sweep_at == snapshot.timestamp
+    assert sorted(r.location_id for r in snapshot.records) == sorted(r.location_id for r in current)
@@ -0,0 +1,107 @@
+"""Indexed queries over the rollback log."""
+
+from datetime import timedelta
+
+import pytest
+
+from src import query
+from src.detector import build_comparison_result
+from src.models import RollbackEvent
+from src.storage import append_rollback_log, save_rollback_log
+
+from helpers import START
+
+
+def _result(hours: int, location_ids: list[str]):
+    detected_at = (START + timedelta(hours=hours)).isoformat()
+    events = [
+        RollbackEvent(location_id, detected_at, None, None, 2, 1, None, False)
+        for location_id in location_ids
+    ]
+    return build_comparison_result(detected_at, 10, events)
+
+
+def _log(hours: range) -> list:
+    results = [_result(h, [f"TWL{j:05d}" for j in range(h % 5 + 1)] + [f"TWL{h % 7:05d}"]) for h in hours]
+    for result in results:
+        append_rollback_log(result)
+    return results
+
+
+def _expected(results: list, n: int, since=None, until=None) -> list[tuple[str, int]]:
+    counts: dict[str, int] = {}
+    for result in results:
+        if (since and result.timestamp < since) or (until and result.timestamp >= until):
+            continue
+        for location_id in {e.location_id for e in result.rollback_events}:
+            counts[location_id] = counts.get(location_id, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+RANGES = [
+    (None, None),
+    ("2026-02-04", None),
+    (None, "2026-02-04"),
+    ("2026-02-03T20:00:00+00:00", "2026-02-04T09:00:00+00:00"),
+    ("2026-02-06", None),
+]
+
+
+@pytest.mark.parametrize("since, until", RANGES)
+def test_top_locations(since, until):
+    results = _log(range(40))
+    assert query.top_locations(5, since, until) == _expected(results, 5, since, until)
+
+
+def test_top_locations_catch_up_with_the_log():
+    results = _log(range(20))
+    assert query.top_locations(3) == _expected(results, 3)
+
+    results += _log(range(20, 45))
+    for since, until in RANGES:
+        assert query.top_locations(10, since, until) == _expected(results, 10, since, until)
+
+
+def test_summary_out_of_step_is_rebuilt():
+    results = _log(range(30))
+    query.ensure_query_index()
+
+    # As left by a catch-up interrupted after the time index was written
+    query._save_summary(12, {})
+    assert query.top_locations(10) == _expected(results, 10)
+
+    query._summary_path().unlink()
+    assert query.top_locations(10) == _expected(results, 10)
+
+
+def test_rebuild():
+    results = _log(range(30))
+    assert query.top_locations(10) == _expected(results, 10)
+    query.rebuild_query_index()
+    assert query.top_locations(10) == _expected(results, 10)
+    assert [r.timestamp for r in query.iter_results()] == [r.timestamp for r in results]
+
+
+def test_unbounded_top_reads_no_postings(monkeypatch):
+    results = _log(range(30))
+    query.ensure_query_index()
+
+    def fail(*args):
+        raise AssertionError("postings read")
+
+    monkeypatch.setattr(query, "_read_postings", fail)
+    assert query.top_locations(10) == _expected(results, 10)
+    assert query.top_locations(10, since="2026-02-03") == _expected(results, 10)
+
+
+def test_rewritten_log_is_reindexed():
+    _log(range(3))
+    assert [loc for loc, _ in query.top_locations(10)] == ["TWL00000", "TWL00001", "TWL00002"]
+
+    # Same number of entries and detection times, other locations
+    rewritten = [_result(h, ["OTHER"]) for h in range(3)]
+    save_rollback_log(rewritten)
+
+    assert query.top_locations(10) == [("OTHER", 3)]
+    assert len(list(query.iter_location_events("OTHER"))) == 3
+    assert list(query.iter_location_events("TWL00000")) == []
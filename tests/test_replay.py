@@ -0,0 +1,81 @@
+"""Replaying the snapshot history, and rebuilding what derives from the log."""
+
+import sys
+from dataclasses import replace
+
+from src import query, replay
+from src.companies import current_company, use_company
+from src.detector import detect_rollbacks
+from src.episodes import EpisodeTracker, append_closed, iter_closed, load_episode_tracker
+from src.storage import append_rollback_log, save_snapshot
+
+from helpers import records, snapshot
+
+
+def _polls(count: int) -> list:
+    """Snapshots a minute apart, with rollbacks that recover a few polls later."""
+    snapshots = []
+    for n in range(count):
+        recs = [replace(r, last_updated=r.last_updated + n * 60_000) for r in records(10)]
+        if 3 <= n < 6:
+            # One location 5 minutes behind, back after 4 polls
+            recs[2] = replace(recs[2], last_updated=recs[2].last_updated - (6 - n) * 60_000 - 120_000)
+        if 12 <= n < 14:
+            # Every location behind: a dataset-level incident
+            recs = [replace(r, last_updated=r.last_updated - 180_000) for r in recs]
+        snapshots.append(snapshot(n, recs))
+    return snapshots
+
+
+def _save_history(nsoh: list) -> list:
+    for n, nsoh_snapshot in enumerate(nsoh):
+        save_snapshot(snapshot(n, records(10, source="thames"), "thames"))
+        save_snapshot(nsoh_snapshot)
+    return nsoh
+
+
+def _expected(nsoh: list) -> tuple[list, EpisodeTracker, list]:
+    results = []
+    tracker = EpisodeTracker()
+    episodes = []
+    for n in range(1, len(nsoh)):
+        previous, current = nsoh[n - 1], nsoh[n]
+        thames = snapshot(n, records(10, source="thames"), "thames")
+        result = detect_rollbacks(previous, current, thames, current.timestamp)
+        episodes.extend(e.to_dict() for e in tracker.update(result, current)[0])
+        if result.rollbacks_detected:
+            results.append(result)
+    return results, tracker, episodes
+
+
+def test_replay_rebuilds_log_indexes_and_episodes(monkeypatch):
+    nsoh = _save_history(_polls(20))
+    results, tracker, episodes = _expected(nsoh)
+
+    # State from a log that the replay will replace
+    first = results[0]
+    append_rollback_log(replace(first, rollback_events=[replace(first.rollback_events[0], location_id="STALE")]))
+    assert query.top_locations() == [("STALE", 1)]
+    append_closed("episodes", [{"location_id": "STALE", "detected_at": nsoh[0].timestamp, "recovered_at": nsoh[1].timestamp}])
+
+    monkeypatch.setattr(sys, "argv", ["replay"])
+    assert replay.main() == 0
+
+    assert len(episodes) == 11 and not tracker.open_episodes
+    assert [r.timestamp for r in query.iter_results()] == [r.timestamp for r in results]
+    assert query.top_locations(1) == [("TWL00002", 2)]
+    assert list(iter_closed("episodes")) == episodes
+    assert [i["detected_at"] for i in iter_closed("incidents")] == [nsoh[12].timestamp]
+    assert load_episode_tracker().to_dict() == tracker.to_dict()
+
+
+def test_replay_reads_the_company_namespace():
+    company = replace(current_company(), key="other")
+    with use_company(company):
+        nsoh = _save_history(_polls(20))
+        results, pairs = replay.replay()
+    assert pairs == len(nsoh) - 1
+    assert [r.timestamp for r in results] == [r.timestamp for r in _expected(nsoh)[0]]
+
+    # Nothing in the default namespace
+    assert replay.replay() == ([], 0)
@@ -0,0 +1,80 @@
+"""Round trips through the deduplicated snapshot store."""
+
+import json
+from dataclasses import replace
+from pathlib import Path
+
+from src import snapstore
+from src.compact import compact
+from src.models import Snapshot
+from src.replay import list_snapshot_paths
+from src.storage import load_snapshot, save_snapshot
+
+from helpers import history, timestamp
+
+
+def test_round_trip():
+    snapshots = history(12)
+    paths = [save_snapshot(s, backend="dedup") for s in snapshots]
+
+    # Load from disk only, as a new process would
+    snapstore._last_hashes.clear()
+    assert [load_snapshot(p) for p in paths] == snapshots
+
+
+def test_unchanged_records_are_stored_once():
+    first = history(1)[0]
+    save_snapshot(first, backend="dedup")
+    save_snapshot(replace(first, timestamp=timestamp(5)), backend="dedup")
+
+    assert len(list_snapshot_paths("2026-02-03", "nsoh", "data/snapshots")) == 2
+    with open(f"data/snapshots/2026-02-03/{snapstore.OBJECTS_FILE}") as f:
+        assert sum(1 for _ in f) == len(first.records)
+
+
+def test_round_trip_after_compaction():
+    snapshots = history(12)
+    for s in snapshots:
+        save_snapshot(s, backend="dedup")
+
+    [(day, count, _, _)] = compact(before="2026-02-04")
+    assert (day, count) == ("2026-02-03", len(snapshots))
+    paths = [p for _, p in list_snapshot_paths(day, "nsoh", "data/snapshots")]
+    assert [load_snapshot(p) for p in paths] == snapshots
+
+
+def test_consecutive_nsoh_snapshots_share_blobs():
+    # Two real polls: LastUpdated moved at every location, little else did
+    folder = Path(__file__).parents[1] / "data" / "snapshots" / "2026-01-30"
+    snapshots = []
+    for name in ("nsoh_09-05-55.json", "nsoh_09-18-43.json"):
+        with open(folder / name) as f:
+            snapshots.append(Snapshot.from_dict(json.load(f)))
+    paths = [save_snapshot(s, backend="dedup") for s in snapshots]
+
+    before = {r.location_id: replace(r, last_updated=None) for r in snapshots[0].records}
+    moved = [r for r in snapshots[1].records if replace(r, last_updated=None) != before[r.location_id]]
+    assert 0 < len(moved) < len(snapshots[1].records) // 10
+    with open(f"data/snapshots/2026-01-30/{snapstore.OBJECTS_FILE}") as f:
+        assert sum(1 for _ in f) == len(snapshots[0].records) + len(moved)
+
+    snapstore._last_hashes.clear()
+    assert [load_snapshot(p) for p in paths] == snapshots
+
+
+def test_manifests_with_volatile_fields_in_blobs_still_load():
+    first = history(1)[0]
+    path = save_snapshot(first, backend="dedup")
+
+    # The layout before volatile fields moved to the manifest
+    with open(path) as f:
+        manifest = json.load(f)
+    del manifest["volatile"]
+    blobs = [{"hash": snapstore.record_hash(r.to_dict()), "record": r.to_dict()} for r in first.records]
+    with open(f"data/snapshots/2026-02-03/{snapstore.OBJECTS_FILE}", "w") as f:
+        f.writelines(json.dumps(blob) + "\n" for blob in blobs)
+    manifest["records"] = [blob["hash"] for blob in blobs]
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+    assert load_snapshot(path) == first